@@ -0,0 +1,78 @@
+#benchmarks/bulk_import.py
+"""
+Per-row POST /subs versus one POST /subs/bulk for the same subscriptions
+
+    python -m benchmarks.bulk_import --subs 500
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import date, timedelta
+from typing import Dict, List
+
+from benchmarks.common import configure
+from benchmarks.load import asgi_request
+
+
+def make_subs(count: int) -> List[Dict]:
+    return [
+        {
+            "name": f"sub-{i:05d}",
+            "cost": 1 + i % 50,
+            "next_payment_date": (date.today() + timedelta(days=i % 28)).isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+async def create_user(app) -> int:
+    status, body = await asgi_request(app, "POST", "/register", body={"name": f"b{uuid.uuid4().hex[:12]}"})
+    if status != 200:
+        raise RuntimeError(f"Cannot create benchmark user: {status} {body!r}")
+    return json.loads(body)["id"]
+
+
+async def main_async(args) -> None:
+    from src.db import engine, async_engine
+    from src.main import app
+    from src.migrations import upgrade
+
+    upgrade(engine)
+
+    subs = make_subs(args.subs)
+
+    user_id = await create_user(app)
+    started = time.perf_counter()
+    for sub in subs:
+        await asgi_request(app, "POST", "/subs", params={"user_id": user_id}, body=sub)
+    per_row = time.perf_counter() - started
+    await asgi_request(app, "DELETE", "/delete-user/by-id", params={"user_id": user_id})
+
+    user_id = await create_user(app)
+    started = time.perf_counter()
+    status, body = await asgi_request(app, "POST", "/subs/bulk", params={"user_id": user_id}, body=subs)
+    bulk = time.perf_counter() - started
+    await asgi_request(app, "DELETE", "/delete-user/by-id", params={"user_id": user_id})
+    if status != 200 or json.loads(body)["created"] != len(subs):
+        raise RuntimeError(f"Bulk import failed: {status} {body!r}")
+
+    print(f"subs={args.subs}")
+    print(f"per-row POST /subs   {per_row * 1000:9.1f} ms  {args.subs / per_row:8.1f} subs/s")
+    print(f"POST /subs/bulk      {bulk * 1000:9.1f} ms  {args.subs / bulk:8.1f} subs/s  x{per_row / bulk:.1f}")
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk import benchmark")
+    parser.add_argument("--subs", type=int, default=500)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    configure(args.database_url)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#benchmarks/common.py
+"""
+Shared setup of the benchmarks: database selection, latency statistics and JSON results
+
+configure() must run before anything from src is imported, src reads its settings at import time
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence
+
+
+DEFAULT_DATABASE_PATH = os.path.join(tempfile.gettempdir(), "subs-benchmarks.db")
+
+
+def add_common_arguments(parser) -> None:
+    parser.add_argument("--database-url", default=None,
+                        help="database to run on (DATABASE_URL or a fresh SQLite file by default)")
+    parser.add_argument("--no-cache", action="store_true", help="disable the read cache (CACHE_BACKEND=none)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the data generator")
+    parser.add_argument("--output", default=None, help="write results as JSON to this file")
+
+
+def configure(database_url: Optional[str] = None, no_cache: bool = False) -> str:
+    """
+    Select the database (and cache) of a benchmark run
+
+    Without an explicit url or DATABASE_URL a fresh SQLite file is used, so runs are reproducible
+
+    Returns:
+        str: Database url
+    """
+    database_url = database_url or os.getenv("DATABASE_URL")
+    if database_url is None:
+        if os.path.exists(DEFAULT_DATABASE_PATH):
+            os.remove(DEFAULT_DATABASE_PATH)
+        database_url = f"sqlite:///{DEFAULT_DATABASE_PATH}"
+    os.environ["DATABASE_URL"] = database_url
+    if no_cache:
+        os.environ["CACHE_BACKEND"] = "none"
+    return database_url
+
+
+def summarize(latencies: Sequence[float]) -> Dict[str, float]:
+    """
+    Latency statistics in milliseconds
+
+    Args:
+        latencies (Sequence[float]): Latencies in seconds
+
+    Returns:
+        Dict[str, float]: p50, p99, mean and max latency in ms
+    """
+    ordered = sorted(latencies)
+    return {
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def make_metadata() -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    database_url = os.getenv("DATABASE_URL", "")
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "database": database_url.split(":", 1)[0],
+        "async_db": os.getenv("USE_ASYNC_DB", "0"),
+        "cache": os.getenv("CACHE_BACKEND", "memory"),
+    }
+
+
+def write_results(path: Optional[str], benchmark: str, results: List[Dict], params: Dict) -> None:
+    """
+    Write benchmark results as JSON (benchmarks.compare reads them)
+
+    Every result is a flat dict, *_ms, rps, requests and errors are metrics, the other keys identify the case
+    """
+    if path is None:
+        return None
+    with open(path, "w") as file:
+        json.dump({"benchmark": benchmark, "meta": make_metadata(), "params": params, "results": results}, file, indent=2)
+    return None
@@ -0,0 +1,86 @@
+#benchmarks/compare.py
+"""
+Compare two JSON result files of the same benchmark and fail on regressions
+
+Results are matched on their non-metric keys (name, path, subs, concurrency...),
+a latency that grew or a throughput that dropped by more than --threshold percent is a regression
+
+    python -m benchmarks.compare baseline.json current.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Sequence, Tuple
+
+
+LOWER_IS_BETTER = ("p50_ms", "p99_ms")
+HIGHER_IS_BETTER = ("rps",)
+
+
+def is_metric(key: str) -> bool:
+    return key.endswith("_ms") or key in HIGHER_IS_BETTER or key in ("requests", "errors")
+
+
+def index_results(results: List[Dict]) -> Dict[Tuple, Dict]:
+    return {tuple(sorted((key, value) for key, value in result.items() if not is_metric(key))): result for result in results}
+
+
+def compare(
+    baseline: Dict,
+    current: Dict,
+    threshold: float,
+    metrics: Sequence[str] = LOWER_IS_BETTER + HIGHER_IS_BETTER
+) -> List[str]:
+    """
+    Compare the results of two runs
+
+    Args:
+        baseline (Dict): Baseline result file content
+        current (Dict): Current result file content
+        threshold (float): Allowed change in percent
+        metrics (Sequence[str]): Compared metrics
+
+    Returns:
+        List[str]: Regressions, empty if there are none
+    """
+    regressions = []
+    baseline_results = index_results(baseline["results"])
+    for case, result in index_results(current["results"]).items():
+        base = baseline_results.get(case)
+        if base is None:
+            continue
+        label = " ".join(f"{key}={value}" for key, value in case)
+        for metric in metrics:
+            if metric not in result or not base.get(metric):
+                continue
+            change = (result[metric] - base[metric]) / base[metric] * 100
+            regressed = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            print(f"{'REGRESSION' if regressed else 'ok':<10} {label:<60} {metric:<7} "
+                  f"{base[metric]:10.3f} -> {result[metric]:10.3f} ({change:+.1f}%)")
+            if regressed:
+                regressions.append(f"{label} {metric} {change:+.1f}%")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=10, help="allowed change in percent")
+    parser.add_argument("--metrics", default=",".join(LOWER_IS_BETTER + HIGHER_IS_BETTER))
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    if baseline["benchmark"] != current["benchmark"]:
+        sys.exit(f"Cannot compare {baseline['benchmark']} results with {current['benchmark']} results")
+    regressions = compare(baseline, current, args.threshold, args.metrics.split(","))
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
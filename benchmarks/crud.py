@@ -0,0 +1,77 @@
+#benchmarks/crud.py
+"""
+Microbenchmarks of the src.crud read paths for users with 10, 1k and 100k subscriptions
+
+Every call runs on a fresh identity map, so ORM loads are not served from the session
+
+    python -m benchmarks.crud --sizes 10,1000,100000 --repeat 50 --output crud.json
+"""
+import argparse
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+from benchmarks.common import add_common_arguments, configure, summarize, write_results
+
+
+def make_cases(crud, billing, today: date) -> Dict[str, Callable]:
+    # name -> fn(db, user_id), every case returns its result so nothing is left lazy
+    return {
+        "get_db_subs(limit=50)": lambda db, user_id: crud.get_db_subs(db, user_id, limit=50),
+        "get_db_subs": lambda db, user_id: crud.get_db_subs(db, user_id),
+        "get_next_payment_db_sub": crud.get_next_payment_db_sub,
+        "count_monthly_amount": crud.count_monthly_amount,
+        "count_monthly_amount_by_category": crud.count_monthly_amount_by_category,
+        "upcoming(30 days)": lambda db, user_id: list(billing.merge_payment_schedules(
+            crud.get_upcoming_db_subs(db, user_id, today + timedelta(days=30)), today, today + timedelta(days=30)
+        )),
+    }
+
+
+def run_case(db, fn: Callable, user_id: int, repeat: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    for _ in range(repeat):
+        db.expunge_all()
+        started = time.perf_counter()
+        fn(db, user_id)
+        latencies.append(time.perf_counter() - started)
+        db.rollback()
+    return summarize(latencies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CRUD read path microbenchmarks")
+    parser.add_argument("--sizes", default="10,1000,100000", help="subscriptions per user")
+    parser.add_argument("--repeat", type=int, default=50)
+    add_common_arguments(parser)
+    args = parser.parse_args()
+
+    configure(args.database_url, args.no_cache)
+
+    import src.billing as billing
+    import src.crud as crud
+    from src.db import SessionLocal, engine
+    from src.migrations import upgrade
+    from benchmarks.datagen import generate
+
+    upgrade(engine)
+    today = date.today()
+    results = []
+    db = SessionLocal()
+    try:
+        for size in (int(value) for value in args.sizes.split(",")):
+            started = time.perf_counter()
+            user_id = generate(db, 1, size, args.seed + size)[0]
+            print(f"subs={size} generated in {time.perf_counter() - started:.1f} s")
+            for name, fn in make_cases(crud, billing, today).items():
+                result = {"name": name, "subs": size, **run_case(db, fn, user_id, args.repeat)}
+                results.append(result)
+                print(f"  {name:<34} p50={result['p50_ms']:9.3f}ms p99={result['p99_ms']:9.3f}ms")
+            crud.delete_db_user(db, user_id=user_id)
+    finally:
+        db.close()
+    write_results(args.output, "crud", results, {"sizes": args.sizes, "repeat": args.repeat, "seed": args.seed})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#benchmarks/datagen.py
+"""
+Seeded synthetic users and subscriptions for the benchmarks
+
+The same seed always produces the same rows. The distributions follow real data:
+most subscriptions are monthly and cheap, few are expensive, and a share of them has a
+next_payment_date that is months or years stale (users that were not rolled over)
+
+    python -m benchmarks.datagen --users 100 --subs 1000 --seed 1
+"""
+import argparse
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional
+
+from benchmarks.common import configure
+
+
+CATEGORY_WEIGHTS = {"OTHER": 50, "ENTERTAINMENT": 35, "WORK": 15}
+# (billing_period, billing_interval): weight
+BILLING_WEIGHTS = {("MONTH", 1): 78, ("YEAR", 1): 12, ("WEEK", 1): 4, ("WEEK", 2): 2, ("QUARTER", 1): 3, ("MONTH", 6): 1}
+STALE_RATIO = 0.1
+MAX_STALE_DAYS = 3 * 365
+INSERT_BATCH_SIZE = 1000
+
+
+def generate_subs(rng: random.Random, count: int, today: date, stale_ratio: float = STALE_RATIO) -> Iterator[Dict]:
+    """
+    Yield `count` subscription rows (without user_id and monthly_cost)
+
+    Costs are log-normal (median about 9, long tail up to a few hundred),
+    dates are spread over one billing cycle or are 1 day to 3 years stale
+    """
+    categories, category_weights = zip(*CATEGORY_WEIGHTS.items())
+    billings, billing_weights = zip(*BILLING_WEIGHTS.items())
+    for index in range(count):
+        period, interval = rng.choices(billings, billing_weights)[0]
+        cost = min(Decimal("999.99"), Decimal(str(round(rng.lognormvariate(2.2, 0.9), 2))).max(Decimal("0.99")))
+        if period == "YEAR":
+            cost *= 10
+        if rng.random() < stale_ratio:
+            next_payment_date = today - timedelta(days=rng.randint(1, MAX_STALE_DAYS))
+        else:
+            next_payment_date = today + timedelta(days=rng.randrange(28 if period != "WEEK" else 7 * interval))
+        yield {
+            "name": f"sub-{index:06d}",
+            "cost": cost,
+            "next_payment_date": next_payment_date,
+            "category": rng.choices(categories, category_weights)[0],
+            "billing_period": period,
+            "billing_interval": interval,
+        }
+
+
+def generate(
+    db,
+    users: int,
+    subs_per_user: int,
+    seed: int = 1,
+    stale_ratio: float = STALE_RATIO,
+    today: Optional[date] = None
+) -> List[int]:
+    """
+    Insert `users` users with `subs_per_user` subscriptions each and rebuild the spend summaries
+
+    Subscriptions are inserted with multi-row INSERTs like src.crud.create_new_subs,
+    stale dates are allowed here (the API rejects past dates)
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        users (int): Number of users
+        subs_per_user (int): Number of subscriptions of every user
+        seed (int): Random seed
+        stale_ratio (float): Share of subscriptions with a past next_payment_date
+        today (datetime.date): Reference date, today by default
+
+    Returns:
+        List[int]: Ids of the created users
+    """
+    from sqlalchemy import insert
+
+    from src.billing import count_monthly_cost
+    from src.constants import BillingPeriod, Category
+    from src.crud import create_new_user, rebuild_user_spend_summaries
+    from src.models import SubModel
+
+    rng = random.Random(seed)
+    today = today or date.today()
+    user_ids = []
+    for _ in range(users):
+        user_ids.append(create_new_user(db, f"bench-{seed}-{rng.getrandbits(40):010x}").id)
+        rows = []
+        for row in generate_subs(rng, subs_per_user, today, stale_ratio):
+            row["category"] = Category(row["category"])
+            row["billing_period"] = BillingPeriod(row["billing_period"])
+            row["monthly_cost"] = count_monthly_cost(row["cost"], row["billing_period"], row["billing_interval"])
+            row["billing_anchor_date"] = row["next_payment_date"]
+            row["user_id"] = user_ids[-1]
+            rows.append(row)
+            if len(rows) == INSERT_BATCH_SIZE:
+                db.execute(insert(SubModel), rows)
+                rows = []
+        if rows:
+            db.execute(insert(SubModel), rows)
+        db.commit()
+    rebuild_user_spend_summaries(db)
+    return user_ids
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate benchmark users and subscriptions")
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--subs", type=int, default=100, help="subscriptions per user")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stale-ratio", type=float, default=STALE_RATIO)
+    args = parser.parse_args()
+
+    database_url = configure(args.database_url)
+
+    from src.db import SessionLocal, engine
+    from src.migrations import upgrade
+
+    upgrade(engine)
+    db = SessionLocal()
+    try:
+        user_ids = generate(db, args.users, args.subs, args.seed, args.stale_ratio)
+    finally:
+        db.close()
+    print(f"{len(user_ids)} users x {args.subs} subs -> {database_url}")
+
+
+if __name__ == "__main__":
+    main()
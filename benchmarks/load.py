@@ -0,0 +1,149 @@
+#benchmarks/load.py
+"""
+In-process HTTP load driver for the FastAPI app
+
+Requests are sent straight to the ASGI app (no sockets), so the numbers show how the
+server side scales with concurrency: threadpool for USE_ASYNC_DB=0, event loop for USE_ASYNC_DB=1
+
+The user is seeded with benchmarks.datagen, results can be saved as JSON for benchmarks.compare
+
+    USE_ASYNC_DB=0 python -m benchmarks.load --concurrency 1,10,50,200
+    USE_ASYNC_DB=1 python -m benchmarks.load --concurrency 1,10,50,200 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlencode
+
+from benchmarks.common import add_common_arguments, configure, summarize, write_results
+
+
+async def asgi_request(app, method: str, path: str, params: Dict = None, body: Any = None) -> Tuple[int, bytes]:
+    """
+    Send one HTTP request to an ASGI app
+
+    Returns:
+        Tuple[int, bytes]: Response status and body
+    """
+    payload = json.dumps(body).encode() if body is not None else b""
+    headers = [(b"host", b"benchmark")]
+    if body is not None:
+        headers.append((b"content-type", b"application/json"))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(params or {}).encode(),
+        "root_path": "",
+        "headers": headers,
+        "client": ("127.0.0.1", 0),
+        "server": ("benchmark", 80),
+    }
+    request_sent = False
+    status = 0
+    chunks: List[bytes] = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+async def run_load(app, path: str, params: Dict, concurrency: int, requests: int) -> Dict:
+    """
+    Send `requests` GET requests with `concurrency` in-flight clients
+
+    Returns:
+        Dict: latency statistics in ms (benchmarks.common.summarize), throughput in requests per second and error count
+    """
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def client():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            status, _ = await asgi_request(app, "GET", path, params)
+            latencies.append(time.perf_counter() - started)
+            if status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "path": path,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        **summarize(latencies),
+        "rps": len(latencies) / elapsed,
+    }
+
+
+async def main_async(args) -> None:
+    from src.db import USE_ASYNC_DB, SessionLocal, engine, async_engine
+    from src.main import app
+    from src.migrations import upgrade
+    from benchmarks.datagen import generate
+
+    upgrade(engine)
+    db = SessionLocal()
+    try:
+        user_id = generate(db, 1, args.subs, args.seed)[0]
+    finally:
+        db.close()
+
+    results = []
+    print(f"mode={'async' if USE_ASYNC_DB else 'threadpool'} subs={args.subs}")
+    for path in args.paths.split(","):
+        for concurrency in (int(value) for value in args.concurrency.split(",")):
+            result = await run_load(app, path, {"user_id": user_id}, concurrency, args.requests)
+            results.append({**result, "subs": args.subs})
+            print(
+                f"{path:<24} c={concurrency:<4} rps={result['rps']:8.1f} "
+                f"p50={result['p50_ms']:7.2f}ms p99={result['p99_ms']:7.2f}ms errors={result['errors']}"
+            )
+    await asgi_request(app, "DELETE", "/delete-user/by-id", params={"user_id": user_id})
+    if async_engine is not None:
+        await async_engine.dispose()
+    write_results(args.output, "load", results, {
+        "paths": args.paths, "concurrency": args.concurrency, "requests": args.requests, "subs": args.subs,
+        "seed": args.seed, "mode": "async" if USE_ASYNC_DB else "threadpool",
+    })
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrency load benchmark")
+    parser.add_argument("--paths", default="/subs,/subs/next-payment,/subs/monthly-amount,/subs/upcoming")
+    parser.add_argument("--concurrency", default="1,10,50,200")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--subs", type=int, default=20)
+    add_common_arguments(parser)
+    args = parser.parse_args()
+    configure(args.database_url, args.no_cache)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
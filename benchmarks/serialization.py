@@ -0,0 +1,99 @@
+#benchmarks/serialization.py
+"""
+Serialization time of sub responses per 1k subscriptions, without the database
+
+"validated" is the previous path: a validated Sub per row, model_dump, then FastAPI validates
+the list again against response_model and encodes it with jsonable_encoder and json.
+The other cases build the response from trusted rows like the routes do now
+
+    python -m benchmarks.serialization --subs 1000 --repeat 200 --output serialization.json
+"""
+import argparse
+import json
+import random
+import time
+from collections import namedtuple
+from datetime import date
+from typing import Callable, Dict, List
+
+from benchmarks.common import configure, summarize, write_results
+
+
+SubRow = namedtuple(
+    "SubRow", "id name cost next_payment_date category billing_period billing_interval billing_anchor_date"
+)
+
+
+def make_rows(count: int, seed: int) -> List[SubRow]:
+    from benchmarks.datagen import generate_subs
+    from src.constants import BillingPeriod, Category
+
+    rng = random.Random(seed)
+    return [
+        SubRow(index + 1, row["name"], row["cost"], row["next_payment_date"], Category(row["category"]),
+               BillingPeriod(row["billing_period"]), row["billing_interval"], row["next_payment_date"])
+        for index, row in enumerate(generate_subs(rng, count, date.today()))
+    ]
+
+
+def make_cases(today: date) -> Dict[str, Callable]:
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from src.billing import roll_sub_payment_date
+    from src.responses import ORJSONResponse
+    from src.schemas import Sub
+    from src.utils import make_dict_from_sub_row, make_scheme_from_submodel
+
+    response_adapter = TypeAdapter(List[Sub])
+
+    def validated(rows):
+        items = [
+            Sub(id=row.id, name=row.name, cost=row.cost, next_payment_date=roll_sub_payment_date(row, today),
+                category=row.category, billing_period=row.billing_period,
+                billing_interval=row.billing_interval).model_dump(mode="json")
+            for row in rows
+        ]
+        return json.dumps(jsonable_encoder(response_adapter.validate_python(items))).encode()
+
+    return {
+        "validated": validated,
+        "model_construct+type_adapter": lambda rows: response_adapter.dump_json(
+            [make_scheme_from_submodel(row, today) for row in rows]
+        ),
+        "dict+orjson": lambda rows: ORJSONResponse([make_dict_from_sub_row(row, today=today) for row in rows]).body,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Sub response serialization benchmark")
+    parser.add_argument("--subs", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    # src.utils creates the engines at import, nothing is queried
+    configure()
+
+    today = date.today()
+    rows = make_rows(args.subs, args.seed)
+    outputs = {}
+    results = []
+    for name, fn in make_cases(today).items():
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            outputs[name] = fn(rows)
+            latencies.append(time.perf_counter() - started)
+        result = {"name": name, "subs": args.subs, **summarize(latencies)}
+        result["per_1k_subs_ms"] = result["p50_ms"] * 1000 / args.subs
+        results.append(result)
+        print(f"{name:<30} p50={result['p50_ms']:8.3f}ms p99={result['p99_ms']:8.3f}ms "
+              f"per 1k subs={result['per_1k_subs_ms']:8.3f}ms")
+    if len({json.dumps(json.loads(output), sort_keys=True) for output in outputs.values()}) != 1:
+        raise RuntimeError("The serialization paths produced different JSON")
+    write_results(args.output, "serialization", results, {"subs": args.subs, "repeat": args.repeat, "seed": args.seed})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#benchmarks/startup.py
+"""
+Startup benchmark: import time of src.main and time-to-first-request of uvicorn
+
+Every run starts a fresh uvicorn process and polls it until the first response,
+the first DB-backed request is timed separately (connect + query on a cold or warmed pool)
+
+    python -m benchmarks.startup --workers 1,4 --runs 3
+    DB_POOL_WARMUP=0 python -m benchmarks.startup --workers 1,4
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict
+
+from benchmarks.common import configure
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    code = "import time; started = time.perf_counter(); import src.main; print(time.perf_counter() - started)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def request(url: str, timeout: float = 5) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def measure_first_request(workers: int, timeout: float) -> Dict[str, float]:
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"Server did not answer within {timeout} s")
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                request(f"{base_url}/metrics/cache", timeout=1)
+                break
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.01)
+        first_response = time.perf_counter() - started
+
+        db_started = time.perf_counter()
+        status = request(f"{base_url}/subs/monthly-amount?user_id=0")
+        if status >= 500:
+            raise RuntimeError(f"DB request failed with status {status}, is the schema migrated?")
+        first_db_request = time.perf_counter() - db_started
+    finally:
+        server.terminate()
+        server.wait()
+    return {"first_response_ms": first_response * 1000, "first_db_request_ms": first_db_request * 1000}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    # uvicorn workers inherit DATABASE_URL
+    configure(args.database_url)
+
+    from src.db import engine
+    from src.migrations import upgrade
+
+    upgrade(engine)
+    engine.dispose()
+
+    results = {"import_ms": statistics.median(measure_import() * 1000 for _ in range(args.runs)), "workers": {}}
+    for workers in (int(value) for value in args.workers.split(",")):
+        runs = [measure_first_request(workers, args.timeout) for _ in range(args.runs)]
+        results["workers"][workers] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"import src.main        {results['import_ms']:8.1f} ms  (warm-up {os.getenv('DB_POOL_WARMUP', '1')})")
+    for workers, result in results["workers"].items():
+        print(
+            f"workers={workers:<3} first response {result['first_response_ms']:8.1f} ms  "
+            f"first DB request {result['first_db_request_ms']:7.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
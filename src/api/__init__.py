@@ -3,9 +3,15 @@ from fastapi import APIRouter
 
 from src.api.sub import router as sub_router
 from src.api.user import router as user_router
+from src.api.metrics import router as metrics_router
+from src.api.admin import router as admin_router
+from src.api.batch import router as batch_router
 
 
 main_router = APIRouter()
 
 main_router.include_router(sub_router)
 main_router.include_router(user_router)
+main_router.include_router(metrics_router)
+main_router.include_router(admin_router)
+main_router.include_router(batch_router)
@@ -0,0 +1,41 @@
+#src/api/admin.py
+from typing import Annotated
+from datetime import date, timedelta
+
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from src.utils import stream_sub_export, stream_due_subs, EXPORT_MEDIA_TYPES
+from src.constants import ExportFormat, DUE_SCAN_DAYS, MAX_UPCOMING_DAYS
+
+
+router = APIRouter()
+
+
+#region GET
+
+@router.get(path="/admin/subs/export", tags=["admin"], response_class=StreamingResponse)
+async def export_all_subs(
+    export_format: Annotated[ExportFormat, Query(alias="format")] = ExportFormat.NDJSON
+):
+    return StreamingResponse(
+        stream_sub_export(None, export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="all-subs.{export_format.value}"'}
+    )
+
+
+@router.get(path="/admin/subs/due", tags=["admin"], response_class=StreamingResponse)
+async def export_due_subs(
+    days: Annotated[int, Query(ge=0, le=MAX_UPCOMING_DAYS)] = DUE_SCAN_DAYS,
+    export_format: Annotated[ExportFormat, Query(alias="format")] = ExportFormat.NDJSON
+):
+    # subscriptions of all users with a payment between today and today + days
+    today = date.today()
+    return StreamingResponse(
+        stream_due_subs(today, today + timedelta(days=days), export_format),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="due-subs.{export_format.value}"'}
+    )
+
+#endregion
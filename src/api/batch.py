@@ -0,0 +1,78 @@
+#src/api/batch.py
+from typing import Annotated, List
+
+from fastapi import APIRouter, Depends, Query
+from pydantic import TypeAdapter
+
+import src.exceptions as exceptions
+from src.schemas import UserIdsBatch, UserAmount, UserNextPayment
+from src.db import get_db, run_db_for_users, DbSession
+from src.crud import count_monthly_amounts, get_next_payment_db_subs, get_existing_user_ids
+from src.utils import make_scheme_from_submodel
+from src.responses import TypeAdapterResponse
+from src.constants import CENT, MIN_MONTH_COUNT
+
+
+router = APIRouter()
+
+# responses are built with model_construct from db rows and serialized without validation
+_user_amounts_adapter = TypeAdapter(List[UserAmount])
+_user_next_payments_adapter = TypeAdapter(List[UserNextPayment])
+
+
+#region POST
+# batch reads for internal services: one result per distinct user id in request order,
+# users that cannot be answered get a detail instead of failing the whole request
+
+@router.post(path="/batch/subs/amount", tags=["batch"], response_model=List[UserAmount], response_model_exclude_none=True)
+async def get_batch_amounts(
+    batch: UserIdsBatch,
+    months: Annotated[int, Query(ge=MIN_MONTH_COUNT)] = 1,
+    db: DbSession = Depends(get_db)
+):
+    user_ids = list(dict.fromkeys(batch.user_ids))
+    amounts = await run_db_for_users(db, count_monthly_amounts, user_ids)
+    response = []
+    for user_id in user_ids:
+        amount = amounts.get(user_id)
+        if amount is None:
+            response.append(UserAmount.model_construct(
+                user_id=user_id, month_count=months, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException
+            ))
+        elif amount[1] == 0:
+            response.append(UserAmount.model_construct(
+                user_id=user_id, month_count=months, detail=exceptions.DetailsForHTTPExceptions.UserHasNoSubsException
+            ))
+        else:
+            response.append(UserAmount.model_construct(
+                user_id=user_id, month_count=months, amount=(amount[0] * months).quantize(CENT)
+            ))
+    return TypeAdapterResponse(_user_amounts_adapter, response, exclude_none=True)
+
+
+@router.post(path="/batch/subs/next-payment", tags=["batch"], response_model=List[UserNextPayment],
+             response_model_exclude_none=True)
+async def get_batch_next_payments(
+    batch: UserIdsBatch,
+    db: DbSession = Depends(get_db)
+):
+    user_ids = list(dict.fromkeys(batch.user_ids))
+    next_payment_subs = await run_db_for_users(db, get_next_payment_db_subs, user_ids)
+    without_subs = [user_id for user_id in user_ids if user_id not in next_payment_subs]
+    existing = await run_db_for_users(db, get_existing_user_ids, without_subs) if without_subs else set()
+    response = []
+    for user_id in user_ids:
+        sub = next_payment_subs.get(user_id)
+        if sub is not None:
+            response.append(UserNextPayment.model_construct(user_id=user_id, sub=make_scheme_from_submodel(sub)))
+        elif user_id in existing:
+            response.append(UserNextPayment.model_construct(
+                user_id=user_id, detail=exceptions.DetailsForHTTPExceptions.UserHasNoSubsException
+            ))
+        else:
+            response.append(UserNextPayment.model_construct(
+                user_id=user_id, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException
+            ))
+    return TypeAdapterResponse(_user_next_payments_adapter, response, exclude_none=True)
+
+#endregion
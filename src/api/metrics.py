@@ -0,0 +1,47 @@
+#src/api/metrics.py
+from typing import Dict
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from src.schemas import PoolStats, CacheStats, IdentityCacheStats
+from src.db import get_engines
+from src.metrics import pool_metrics, render_prometheus
+from src.cache import cache
+from src.identity import identity_cache, invalidation_bus
+
+
+router = APIRouter()
+
+
+#region GET
+
+@router.get(path="/metrics", tags=["metrics"], response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    # Prometheus text exposition format: route latency and DB time histograms, domain exceptions, pool state
+    return PlainTextResponse(render_prometheus(get_engines()), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@router.get(path="/metrics/db-pool", tags=["metrics"], response_model=Dict[str, PoolStats])
+async def get_db_pool_metrics():
+    response = {
+        name: pool_metrics[name].snapshot(engine.pool)
+        for name, engine in get_engines().items()
+        if name in pool_metrics
+    }
+    return response
+
+
+@router.get(path="/metrics/cache", tags=["metrics"], response_model=CacheStats)
+async def get_cache_metrics():
+    return CacheStats(backend=type(cache).__name__, size=cache.size(), **cache.stats.snapshot())
+
+
+@router.get(path="/metrics/identity-cache", tags=["metrics"], response_model=IdentityCacheStats)
+async def get_identity_cache_metrics():
+    # saved_round_trips: user existence and name lookups answered without a statement
+    return IdentityCacheStats(
+        backend=type(invalidation_bus).__name__, size=identity_cache.size(), **identity_cache.stats.snapshot()
+    )
+
+#endregion
@@ -1,139 +1,331 @@
 #src/api/sub.py
-from typing import List
+from typing import Annotated, Dict, List, Optional, Tuple
+from datetime import date
+from decimal import Decimal
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 
 import src.exceptions as exceptions
-from src.schemas import NewSub, Sub, Ok, AmountResponse
-from src.db import get_db
-from src.crud import (get_db_user, create_new_sub, get_db_sub, delete_db_sub, delete_all_user_db_subs,
-                      get_next_payment_db_sub, count_monthly_amount)
-from src.utils import make_scheme_from_submodel
-from src.constants import Category
+from src.schemas import NewSub, Sub, SubProjection, Ok, AmountResponse, BulkImportError, BulkImportReport
+from src.db import get_db, get_read_db, run_db, DbSession
+from src.crud import (get_db_subs, create_new_sub, create_new_subs, get_db_sub, delete_db_sub,
+                      delete_all_user_db_subs, get_next_payment_db_sub, get_upcoming_db_subs, count_monthly_amount,
+                      count_monthly_amount_by_category, get_user_data_version)
+from src.utils import (make_dict_from_sub_row, encode_sub_cursor, decode_sub_cursor, read_bulk_records,
+                       validate_bulk_records, stream_sub_export, start_stream, make_upcoming_window,
+                       format_upcoming_payments, make_user_etag, etag_matches, EXPORT_MEDIA_TYPES)
+from src.cache import get_or_load
+from src.responses import ORJSONResponse
+from src.constants import (Category, SubField, SubOrder, ExportFormat, CENT, MIN_MONTH_COUNT, MAX_PAGE_SIZE,
+                           MAX_BULK_IMPORT_ROWS, MAX_UPCOMING_DAYS)
 
 
 router = APIRouter()
 
+# clients keep user reads but revalidate them (If-None-Match) before every use
+USER_READ_CACHE_CONTROL = "private, no-cache"
+
 
 #region POST
 
 @router.post(path="/subs", tags=["subs"], response_model=Sub)
-def post_sub(
+async def post_sub(
     user_id: int,
     new_sub: NewSub,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
+):
+    try:
+        db_sub = await run_db(db, create_new_sub, user_id, new_sub)
+    except exceptions.UserIsNoneException:
+        raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
+    except exceptions.SubNameNotUniqueException:
+        raise HTTPException(status_code=409, detail=exceptions.DetailsForHTTPExceptions.SubNameNotUniqueException)
+    return ORJSONResponse(make_dict_from_sub_row(db_sub))
+
+
+@router.post(path="/subs/bulk", tags=["subs"], response_model=BulkImportReport)
+async def post_subs_bulk(
+    user_id: int,
+    request: Request,
+    db: DbSession = Depends(get_db)
 ):
+    # body: JSON array (application/json), NDJSON (application/x-ndjson) or CSV with a header row (text/csv)
+    try:
+        records = await read_bulk_records(request, MAX_BULK_IMPORT_ROWS)
+    except exceptions.InvalidBulkBodyException:
+        raise HTTPException(status_code=400, detail=exceptions.DetailsForHTTPExceptions.InvalidBulkBodyException)
+    except exceptions.TooManyBulkRowsException:
+        raise HTTPException(status_code=413, detail=exceptions.DetailsForHTTPExceptions.TooManyBulkRowsException)
+    valid, errors = validate_bulk_records(records)
     try:
-        db_sub = create_new_sub(db, user_id, new_sub)
+        existing_names = await run_db(db, create_new_subs, user_id, [new_sub for _, new_sub in valid])
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     except exceptions.SubNameNotUniqueException:
         raise HTTPException(status_code=409, detail=exceptions.DetailsForHTTPExceptions.SubNameNotUniqueException)
-    return make_scheme_from_submodel(db_sub)
+    for row, new_sub in valid:
+        if new_sub.name in existing_names:
+            errors.append(BulkImportError(row=row, detail=exceptions.DetailsForHTTPExceptions.SubNameNotUniqueException))
+    errors.sort(key=lambda error: error.row)
+    return BulkImportReport(created=len(valid) - len(existing_names), errors=errors)
 
 #endregion
 
 
 #region GET
 
-@router.get(path="/subs", tags=["subs"], response_model=List[Sub])
-def get_subs(
+@router.get(path="/subs", tags=["subs"], response_model=List[SubProjection], response_model_exclude_unset=True)
+async def get_subs(
+    request: Request,
     user_id: int,
-    db: Session = Depends(get_db)
+    category: Optional[Category] = None,
+    order_by: SubOrder = SubOrder.ID,
+    cursor: Optional[str] = None,
+    limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    fields: Annotated[Optional[List[SubField]], Query()] = None,
+    db: DbSession = Depends(get_read_db)
 ):
-    try:
-        user = get_db_user(db, user_id, update_next_payment_dates=True)
-    except exceptions.UserIsNoneException:
-        raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
-    return user.subs
+    return await _list_subs(request, db, user_id, category, order_by, cursor, limit, fields)
 
 
-@router.get(path="/subs/by-category/{category}", tags=["subs"], response_model=List[Sub])
-def get_subs_by_category(
+@router.get(path="/subs/by-category/{category}", tags=["subs"], response_model=List[SubProjection],
+            response_model_exclude_unset=True)
+async def get_subs_by_category(
+    request: Request,
     user_id: int,
     category: Category,
-    db: Session = Depends(get_db)
+    order_by: SubOrder = SubOrder.ID,
+    cursor: Optional[str] = None,
+    limit: Annotated[Optional[int], Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    fields: Annotated[Optional[List[SubField]], Query()] = None,
+    db: DbSession = Depends(get_read_db)
 ):
+    return await _list_subs(request, db, user_id, category, order_by, cursor, limit, fields)
+
+
+async def _list_subs(
+    request: Request,
+    db: DbSession,
+    user_id: int,
+    category: Optional[Category],
+    order_by: SubOrder,
+    cursor: Optional[str],
+    limit: Optional[int],
+    fields: Optional[List[SubField]]
+) -> Response:
+    # without limit the whole list is returned, with limit the next page cursor is sent in X-Next-Cursor
+    async def load():
+        # one extra row tells whether there is a next page
+        rows = await run_db(
+            db, get_db_subs, user_id, category, order_by, after, limit + 1 if limit is not None else None, fields
+        )
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_sub_cursor(rows[-1], order_by)
+        items = [make_dict_from_sub_row(row, fields, today) for row in rows]
+        return {"items": items, "next_cursor": next_cursor}
+
+    today = date.today()
     try:
-        user = get_db_user(db, user_id, update_next_payment_dates=True)
+        after = decode_sub_cursor(cursor, order_by) if cursor is not None else None
+        etag, data_version, not_modified = await _resolve_etag(request, db, user_id, today)
+        if not_modified:
+            return _not_modified_response(etag)
+        field_key = ",".join(field.value for field in fields) if fields else "*"
+        page = await get_or_load(
+            user_id,
+            f"subs:{category and category.value}:{order_by.value}:{cursor}:{limit}:{field_key}@{today}@v{data_version}",
+            load
+        )
+    except exceptions.InvalidCursorException:
+        raise HTTPException(status_code=400, detail=exceptions.DetailsForHTTPExceptions.InvalidCursorException)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
-    response = [make_scheme_from_submodel(sub) for sub in user.subs if sub.category == category]
-    return response
+    headers = _user_read_headers(etag)
+    if page["next_cursor"] is not None:
+        headers["X-Next-Cursor"] = page["next_cursor"]
+    return ORJSONResponse(page["items"], headers=headers)
 
 
 @router.get(path="/subs/by-id/{sub_id}", tags=["subs"], response_model=Sub)
-def get_sub_by_id(
+async def get_sub_by_id(
     user_id: int,
     sub_id: int,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        sub = get_db_sub(db, user_id, sub_id)
+        sub = await run_db(db, get_db_sub, user_id, sub_id)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     except exceptions.SubIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.SubIsNoneException)
-    return make_scheme_from_submodel(sub)
+    return ORJSONResponse(make_dict_from_sub_row(sub))
 
 
 @router.get(path="/subs/by-name/{sub_name}", tags=["subs"], response_model=Sub)
-def get_sub_by_name(
+async def get_sub_by_name(
     user_id: int,
     sub_name: str,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        sub = get_db_sub(db, user_id, None, sub_name)
+        sub = await run_db(db, get_db_sub, user_id, None, sub_name)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     except exceptions.SubIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.SubIsNoneException)
-    return make_scheme_from_submodel(sub)
+    return ORJSONResponse(make_dict_from_sub_row(sub))
+
+
+@router.get(path="/subs/export", tags=["subs"], response_class=StreamingResponse)
+async def export_subs(
+    user_id: int,
+    export_format: Annotated[ExportFormat, Query(alias="format")] = ExportFormat.NDJSON
+):
+    # the export checks the user with its own session, the only one of the request
+    try:
+        chunks = await run_in_threadpool(start_stream, stream_sub_export(user_id, export_format))
+    except exceptions.UserIsNoneException:
+        raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="subs.{export_format.value}"'}
+    )
 
 
 @router.get(path="/subs/next-payment", tags=["subs"], response_model=Sub)
-def get_next_payment_sub(
+async def get_next_payment_sub(
+    request: Request,
     user_id: int,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_read_db)
 ):
+    async def load():
+        next_payment_sub = await run_db(db, get_next_payment_db_sub, user_id)
+        return make_dict_from_sub_row(next_payment_sub, today=today)
+
+    today = date.today()
     try:
-        next_payment_sub = get_next_payment_db_sub(db, user_id)
+        etag, data_version, not_modified = await _resolve_etag(request, db, user_id, today)
+        if not_modified:
+            return _not_modified_response(etag)
+        response = await get_or_load(user_id, f"next-payment@{today}@v{data_version}", load)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     except exceptions.UserHasNoSubsException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserHasNoSubsException)
-    return next_payment_sub
+    return ORJSONResponse(response, headers=_user_read_headers(etag))
 
 
-@router.get(path="/subs/monthly-amount", tags=["subs"], response_model=AmountResponse)
-def get_monthly_amount(
+@router.get(path="/subs/upcoming", tags=["subs"], response_class=Response)
+async def get_upcoming_payments(
     user_id: int,
-    db: Session = Depends(get_db)
+    from_date: Annotated[Optional[date], Query(alias="from")] = None,
+    to_date: Annotated[Optional[date], Query(alias="to")] = None,
+    db: DbSession = Depends(get_db)
 ):
+    # NDJSON lines {date, sub_id, name, cost, category, running_total} in date order, default window is one month.
+    # The window is bounded (MAX_UPCOMING_DAYS), the body is rendered before the request session is released
+    try:
+        start, end = make_upcoming_window(from_date, to_date, MAX_UPCOMING_DAYS)
+    except exceptions.InvalidDateRangeException:
+        raise HTTPException(status_code=400, detail=exceptions.DetailsForHTTPExceptions.InvalidDateRangeException)
     try:
-        monthly_amount = count_monthly_amount(db, user_id)
+        rows = await run_db(db, get_upcoming_db_subs, user_id, end)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
-    except exceptions.UserHasNoSubsException:
-        raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserHasNoSubsException)
-    return AmountResponse(month_count=1, amount=monthly_amount)
+    content = "".join(format_upcoming_payments(rows, start, end))
+    return Response(content, media_type=EXPORT_MEDIA_TYPES[ExportFormat.NDJSON])
+
+
+@router.get(path="/subs/monthly-amount", tags=["subs"], response_model=AmountResponse, response_model_exclude_none=True)
+async def get_monthly_amount(
+    request: Request,
+    user_id: int,
+    by_category: bool = False,
+    db: DbSession = Depends(get_read_db)
+):
+    return await _count_amount(request, db, user_id, 1, by_category)
+
+
+@router.get(path="/subs/annual-amount", tags=["subs"], response_model=AmountResponse, response_model_exclude_none=True)
+async def get_annual_amount(
+    request: Request,
+    user_id: int,
+    by_category: bool = False,
+    db: DbSession = Depends(get_read_db)
+):
+    return await _count_amount(request, db, user_id, 12, by_category)
 
 
-@router.get(path="/subs/annual-amount", tags=["subs"], response_model=AmountResponse)
-def get_annual_amount(
+@router.get(path="/subs/amount", tags=["subs"], response_model=AmountResponse, response_model_exclude_none=True)
+async def get_amount(
+    request: Request,
     user_id: int,
-    db: Session = Depends(get_db)
+    months: Annotated[int, Query(ge=MIN_MONTH_COUNT)] = 1,
+    by_category: bool = False,
+    db: DbSession = Depends(get_read_db)
 ):
+    return await _count_amount(request, db, user_id, months, by_category)
+
+
+async def _count_amount(request: Request, db: DbSession, user_id: int, month_count: int, by_category: bool) -> Response:
+    # monthly amounts are cached as strings to stay Decimal-exact in every cache backend
+    async def load():
+        if by_category:
+            monthly_by_category = await run_db(db, count_monthly_amount_by_category, user_id)
+            return {
+                "amount": str(sum(monthly_by_category.values(), Decimal(0))),
+                "by_category": {category.value: str(amount) for category, amount in monthly_by_category.items()},
+            }
+        monthly_amount = await run_db(db, count_monthly_amount, user_id)
+        return {"amount": str(monthly_amount), "by_category": None}
+
     try:
-        monthly_amount = count_monthly_amount(db, user_id)
-        annual_amount = monthly_amount * 12
+        etag, data_version, not_modified = await _resolve_etag(request, db, user_id, date.today())
+        if not_modified:
+            return _not_modified_response(etag)
+        monthly_key = "monthly-amount:by-category" if by_category else "monthly-amount"
+        monthly = await get_or_load(user_id, f"{monthly_key}@v{data_version}", load)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     except exceptions.UserHasNoSubsException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserHasNoSubsException)
-    return AmountResponse(month_count=12, amount=annual_amount)
+    # monthly costs of non-monthly plans are stored with more decimal places, totals are rounded to cents
+    response = {"month_count": month_count, "amount": (Decimal(monthly["amount"]) * month_count).quantize(CENT)}
+    if monthly["by_category"] is not None:
+        response["by_category"] = {
+            category: (Decimal(amount) * month_count).quantize(CENT) for category, amount in monthly["by_category"].items()
+        }
+    return ORJSONResponse(response, headers=_user_read_headers(etag))
+
+
+async def _resolve_etag(request: Request, db: DbSession, user_id: int, today: date) -> Tuple[str, int, bool]:
+    # with If-None-Match the data version is read from db (one primary key lookup, nothing else is loaded),
+    # otherwise the data version is cached with the user's other reads and dropped with them on every write.
+    # Cached bodies are keyed by the data version (@v{data_version}), a body is only ever sent with its own ETag
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        data_version = await run_db(db, get_user_data_version, user_id)
+        etag = make_user_etag(user_id, data_version, today)
+        return etag, data_version, etag_matches(if_none_match, etag)
+
+    async def load():
+        return await run_db(db, get_user_data_version, user_id)
+
+    data_version = await get_or_load(user_id, "data-version", load)
+    return make_user_etag(user_id, data_version, today), data_version, False
+
+
+def _user_read_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": USER_READ_CACHE_CONTROL}
+
+
+def _not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers=_user_read_headers(etag))
 
 #endregion
 
@@ -141,25 +333,25 @@ def get_annual_amount(
 #region DELETE
 
 @router.delete(path="/subs", tags=["subs"], response_model=Ok)
-def delete_all_subs(
+async def delete_all_subs(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        delete_all_user_db_subs(db, user_id)
+        await run_db(db, delete_all_user_db_subs, user_id)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     return Ok()
 
 
 @router.delete(path="/subs/by-id/{sub_id}", tags=["subs"], response_model=Ok)
-def delete_sub_by_id(
+async def delete_sub_by_id(
     user_id: int,
     sub_id: int,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        delete_db_sub(db, user_id, sub_id=sub_id)
+        await run_db(db, delete_db_sub, user_id, sub_id=sub_id)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     except exceptions.SubIsNoneException:
@@ -168,13 +360,13 @@ def delete_sub_by_id(
 
 
 @router.delete(path="/subs/by-name/{sub_name}", tags=["subs"], response_model=Ok)
-def delete_sub_by_name(
+async def delete_sub_by_name(
     user_id: int,
     sub_name: str,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        delete_db_sub(db, user_id, sub_name=sub_name)
+        await run_db(db, delete_db_sub, user_id, sub_name=sub_name)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     except exceptions.SubIsNoneException:
@@ -1,11 +1,12 @@
 #src/api/user.py
 from fastapi import APIRouter, HTTPException, Depends
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
 
 import src.exceptions as exceptions
-from src.db import get_db
+from src.db import get_db, run_db, DbSession, SHARDED
 from src.schemas import User, NewUser, Ok
 from src.crud import create_new_user, delete_db_user
+from src.shards import create_sharded_user, delete_sharded_user
 from src.utils import make_scheme_from_usermodel
 
 
@@ -15,12 +16,15 @@ router = APIRouter()
 #region POST
 
 @router.post(path="/register", tags=["user"], response_model=User)
-def create_user(
+async def create_user(
     new_user: NewUser,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        user = create_new_user(db, new_user.name)
+        if SHARDED:
+            user = await run_in_threadpool(create_sharded_user, new_user.name)
+        else:
+            user = await run_db(db, create_new_user, new_user.name)
         return make_scheme_from_usermodel(user)
     except exceptions.UsernameNotUniqueException:
         raise HTTPException(status_code=409, detail=exceptions.DetailsForHTTPExceptions.UserNameNotUniqueException)
@@ -31,24 +35,30 @@ def create_user(
 #region DELETE
 
 @router.delete(path="/delete-user/by-id", tags=["user"], response_model=Ok)
-def delete_user_by_id(
+async def delete_user_by_id(
     user_id: int,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        delete_db_user(db, user_id=user_id)
+        if SHARDED:
+            await run_in_threadpool(delete_sharded_user, user_id=user_id)
+        else:
+            await run_db(db, delete_db_user, user_id=user_id)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     return Ok()
 
 
 @router.delete(path="/delete-user/by-name", tags=["user"], response_model=Ok)
-def delete_user_by_name(
+async def delete_user_by_name(
     name: str,
-    db: Session = Depends(get_db)
+    db: DbSession = Depends(get_db)
 ):
     try:
-        delete_db_user(db, username=name)
+        if SHARDED:
+            await run_in_threadpool(delete_sharded_user, username=name)
+        else:
+            await run_db(db, delete_db_user, username=name)
     except exceptions.UserIsNoneException:
         raise HTTPException(status_code=404, detail=exceptions.DetailsForHTTPExceptions.UserIsNoneException)
     return Ok()
@@ -0,0 +1,204 @@
+#src/billing.py
+import heapq
+from typing import Any, Iterable, Iterator, List, Tuple
+from datetime import date, timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+
+from src.constants import BillingPeriod
+
+
+# months in one billing period, weekly periods are counted in days
+PERIOD_MONTHS = {
+    BillingPeriod.MONTH: 1,
+    BillingPeriod.QUARTER: 3,
+    BillingPeriod.YEAR: 12,
+}
+WEEK_DAYS = 7
+
+# monthly cost = cost * numerator / (denominator * billing_interval), a year has 52 weekly payments
+MONTHLY_COST_RATIOS = {
+    BillingPeriod.WEEK: (52, 12),
+    BillingPeriod.MONTH: (1, 1),
+    BillingPeriod.QUARTER: (1, 3),
+    BillingPeriod.YEAR: (1, 12),
+}
+MONTHLY_COST_SCALE = 6  # decimal places of the stored monthly_cost
+
+
+def shift_payment_date(
+    payment_date: date,
+    periods: int,
+    period: BillingPeriod = BillingPeriod.MONTH,
+    interval: int = 1
+) -> date:
+    """
+    Get the billing date `periods` billing cycles after the anchor date
+
+    Month-based periods keep the billing day-of-month (Jan 31 -> Feb 28 -> Mar 31)
+
+    Args:
+        payment_date (datetime.date): Anchor payment date
+        periods (int): Number of billing cycles
+        period (src.constants.BillingPeriod): Billing period
+        interval (int): Number of periods in one billing cycle
+
+    Returns:
+        datetime.date: Payment date
+    """
+    if period == BillingPeriod.WEEK:
+        return payment_date + timedelta(days=WEEK_DAYS * interval * periods)
+    return payment_date + relativedelta(months=+PERIOD_MONTHS[period] * interval * periods)
+
+
+def roll_payment_date(
+    payment_date: date,
+    today: date,
+    period: BillingPeriod = BillingPeriod.MONTH,
+    interval: int = 1
+) -> date:
+    """
+    Get the first billing date on or after today
+
+    The result is computed in one step from the anchor date, so the billing day-of-month
+    is kept and the cost does not depend on how stale the date is
+
+    Args:
+        payment_date (datetime.date): Anchor (last known) payment date
+        today (datetime.date): Reference date
+        period (src.constants.BillingPeriod): Billing period
+        interval (int): Number of periods in one billing cycle
+
+    Returns:
+        datetime.date: First payment date that is not earlier than today
+    """
+    if payment_date >= today:
+        return payment_date
+    return shift_payment_date(payment_date, __cycles_until(payment_date, today, period, interval), period, interval)
+
+
+def roll_sub_payment_date(sub: Any, today: date) -> date:
+    """
+    Get the effective payment date of a subscription (SubModel or row with the billing columns)
+
+    Overdue dates are rolled from the billing anchor, not from the stored next_payment_date,
+    so the result is the same whether the rollover job has already run or not
+
+    Args:
+        sub (Any): Object with next_payment_date, billing_anchor_date, billing_period and billing_interval attributes
+        today (datetime.date): Reference date
+
+    Returns:
+        datetime.date: First payment date that is not earlier than today
+    """
+    if sub.next_payment_date >= today:
+        return sub.next_payment_date
+    return roll_payment_date(get_sub_billing_anchor(sub), today, sub.billing_period, sub.billing_interval)
+
+
+def get_sub_billing_anchor(sub: Any) -> date:
+    # rows created before billing_anchor_date existed and not backfilled yet are anchored at their stored date
+    return sub.billing_anchor_date or sub.next_payment_date
+
+
+def roll_sub_payment_dates(subs: Iterable[Any], today: date) -> List[date]:
+    """
+    Roll the payment dates of a batch of subscriptions (e.g. all subscriptions of a user) in a single pass
+
+    Args:
+        subs (Iterable[Any]): Objects with next_payment_date, billing_anchor_date, billing_period and billing_interval
+        today (datetime.date): Reference date
+
+    Returns:
+        List[datetime.date]: Rolled payment dates in the same order
+    """
+    return [roll_sub_payment_date(sub, today) for sub in subs]
+
+
+def count_monthly_cost(cost: Decimal, period: BillingPeriod = BillingPeriod.MONTH, interval: int = 1) -> Decimal:
+    """
+    Normalize the cost of one billing cycle to a monthly cost (stored in SubModel.monthly_cost)
+
+    Args:
+        cost (Decimal): Cost of one billing cycle
+        period (src.constants.BillingPeriod): Billing period
+        interval (int): Number of periods in one billing cycle
+
+    Returns:
+        Decimal: Monthly cost rounded to MONTHLY_COST_SCALE decimal places
+    """
+    numerator, denominator = MONTHLY_COST_RATIOS[period]
+    monthly_cost = Decimal(str(cost)) * numerator / (denominator * interval)
+    return monthly_cost.quantize(Decimal(1).scaleb(-MONTHLY_COST_SCALE))
+
+
+def iter_payment_dates(
+    payment_date: date,
+    start: date,
+    end: date,
+    period: BillingPeriod = BillingPeriod.MONTH,
+    interval: int = 1
+) -> Iterator[date]:
+    """
+    Lazily yield the billing dates of a subscription within [start, end]
+
+    Uses the same recurrence as roll_payment_date: every date is computed from the anchor,
+    so the cost is proportional to the number of dates in the window, not to the age of the anchor
+
+    Args:
+        payment_date (datetime.date): Anchor (last known) payment date, earlier dates are not billed
+        start (datetime.date): First day of the window
+        end (datetime.date): Last day of the window
+        period (src.constants.BillingPeriod): Billing period
+        interval (int): Number of periods in one billing cycle
+
+    Returns:
+        Iterator[datetime.date]: Payment dates in ascending order
+    """
+    cycles = __cycles_until(payment_date, start, period, interval) if payment_date < start else 0
+    current = shift_payment_date(payment_date, cycles, period, interval)
+    while current <= end:
+        yield current
+        cycles += 1
+        current = shift_payment_date(payment_date, cycles, period, interval)
+
+
+def merge_payment_schedules(subs: Iterable[Any], start: date, end: date) -> Iterator[Tuple[date, Any]]:
+    """
+    Merge the payment dates of many subscriptions into one date-ordered stream
+
+    Each subscription is expanded lazily and the streams are k-way merged on a heap,
+    so producing n payments costs O(n log k) for k subscriptions
+
+    Args:
+        subs (Iterable[Any]): Objects with id and the billing columns (next_payment_date, billing_anchor_date...)
+        start (datetime.date): First day of the window
+        end (datetime.date): Last day of the window
+
+    Returns:
+        Iterator[Tuple[datetime.date, Any]]: (payment date, subscription) ordered by date, then by id
+    """
+    schedules = [__iter_sub_payments(sub, start, end) for sub in subs]
+    for payment_date, _, sub in heapq.merge(*schedules, key=lambda item: item[:2]):
+        yield payment_date, sub
+
+
+def __iter_sub_payments(sub: Any, start: date, end: date) -> Iterator[Tuple[date, int, Any]]:
+    # dates are rolled from the anchor, dates before the stored next payment are not billed
+    for payment_date in iter_payment_dates(
+        get_sub_billing_anchor(sub), max(start, sub.next_payment_date), end, sub.billing_period, sub.billing_interval
+    ):
+        yield payment_date, sub.id, sub
+
+
+def __cycles_until(payment_date: date, today: date, period: BillingPeriod, interval: int) -> int:
+    # number of billing cycles from the anchor to the first payment date on or after today (anchor < today)
+    if period == BillingPeriod.WEEK:
+        step = WEEK_DAYS * interval
+        return -(-(today - payment_date).days // step)
+    step = PERIOD_MONTHS[period] * interval
+    cycles = ((today.year - payment_date.year) * 12 + (today.month - payment_date.month)) // step
+    if shift_payment_date(payment_date, cycles, period, interval) < today:
+        cycles += 1
+    return cycles
@@ -0,0 +1,189 @@
+#src/cache.py
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from src.config import CACHE_BACKEND, CACHE_TTL, CACHE_MAX_USERS, CACHE_REDIS_URL
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class NullCache:
+    """Cache backend that stores nothing"""
+    blocking = False
+
+    def __init__(self) -> None:
+        self.stats = CacheStats()
+
+    def get(self, user_id: int, key: str) -> Optional[Any]:
+        self.stats.misses += 1
+        return None
+
+    def set(self, user_id: int, key: str, value: Any) -> None:
+        return None
+
+    def invalidate(self, user_id: int) -> None:
+        return None
+
+    def size(self) -> int:
+        return 0
+
+
+class LRUCache:
+    """
+    In-process cache of per-user entries
+
+    Entries of a user live in one bucket, so invalidating a user is a single pop.
+    Buckets are evicted in LRU order when there are more than max_users of them,
+    every entry expires ttl seconds after it was set
+    """
+    blocking = False
+
+    def __init__(self, max_users: int, ttl: float) -> None:
+        self.max_users = max_users
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._buckets: "OrderedDict[int, Dict[str, Tuple[float, Any]]]" = OrderedDict()
+        # invalidation runs in threadpool workers, reads run in the event loop
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, key: str) -> Optional[Any]:
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            entry = bucket.get(key) if bucket is not None else None
+            if entry is None or entry[0] < time.monotonic():
+                self.stats.misses += 1
+                return None
+            self._buckets.move_to_end(user_id)
+            self.stats.hits += 1
+            return entry[1]
+
+    def set(self, user_id: int, key: str, value: Any) -> None:
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = {}
+                if len(self._buckets) > self.max_users:
+                    self._buckets.popitem(last=False)
+                    self.stats.evictions += 1
+            else:
+                self._buckets.move_to_end(user_id)
+            bucket[key] = (time.monotonic() + self.ttl, value)
+        return None
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            if self._buckets.pop(user_id, None) is not None:
+                self.stats.invalidations += 1
+        return None
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+class RedisCache:
+    """
+    Cache backend on a Redis-compatible server, one hash per user
+
+    Values are stored as JSON, so only JSON-compatible values can be cached.
+    Any client with the redis-py interface works (e.g. a local stand-in server or fakeredis)
+    """
+    blocking = True
+
+    def __init__(self, client: Any, ttl: float, prefix: str = "subs-cache:") -> None:
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, user_id: int, key: str) -> Optional[Any]:
+        raw = self.client.hget(f"{self.prefix}{user_id}", key)
+        if raw is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return json.loads(raw)
+
+    def set(self, user_id: int, key: str, value: Any) -> None:
+        name = f"{self.prefix}{user_id}"
+        pipe = self.client.pipeline()
+        pipe.hset(name, key, json.dumps(value))
+        pipe.expire(name, int(self.ttl) or 1)
+        pipe.execute()
+        return None
+
+    def invalidate(self, user_id: int) -> None:
+        if self.client.delete(f"{self.prefix}{user_id}"):
+            self.stats.invalidations += 1
+        return None
+
+    def size(self) -> int:
+        return -1
+
+
+def make_cache(backend: str = CACHE_BACKEND):
+    """
+    Create a cache backend by name (memory, redis or none)
+
+    Raises:
+        ValueError: Unknown backend
+        RuntimeError: redis backend without the redis package
+    """
+    if backend == "memory":
+        return LRUCache(CACHE_MAX_USERS, CACHE_TTL)
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+        return RedisCache(redis.Redis.from_url(CACHE_REDIS_URL), CACHE_TTL)
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+cache = make_cache()
+
+
+async def get_or_load(user_id: int, key: str, load: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Get a per-user cache entry or load and store it
+
+    Args:
+        user_id (int): Unique user id (owner of the entry)
+        key (str): Entry key within the user
+        load (Callable): Coroutine function returning a JSON-compatible value, exceptions are not cached
+
+    Returns:
+        Any: Cached or loaded value
+    """
+    if cache.blocking:
+        value = await run_in_threadpool(cache.get, user_id, key)
+    else:
+        value = cache.get(user_id, key)
+    if value is not None:
+        return value
+    value = await load()
+    if cache.blocking:
+        await run_in_threadpool(cache.set, user_id, key, value)
+    else:
+        cache.set(user_id, key, value)
+    return value
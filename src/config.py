@@ -0,0 +1,69 @@
+#src/config.py
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, "1" if default else "0").lower() in ("1", "true", "yes", "on")
+
+
+#region Database
+# sqlite fallback: DATABASE_URL=sqlite:///test.db
+DATABASE_URL = os.getenv("DATABASE_URL", "mysql+mysqlconnector://root:1234@db:3306/subs_db")
+USE_ASYNC_DB = _env_bool("USE_ASYNC_DB", False)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, keep below MySQL wait_timeout
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+#endregion
+
+#region Read replicas
+# comma-separated replica urls, GET routes that tolerate slightly stale data read from them (src.db.get_read_db)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", "5"))  # seconds
+REPLICA_HEALTH_CHECK_TIMEOUT = float(os.getenv("REPLICA_HEALTH_CHECK_TIMEOUT", "2"))  # seconds
+# reads of a user go to the primary for this long after their writes, keep it above the replication lag
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+#endregion
+
+#region Sharding
+# comma-separated shard urls, users (with their subs) are spread over them, the user directory stays in DATABASE_URL;
+# empty: DATABASE_URL is the only shard
+DATABASE_SHARD_URLS = [url.strip() for url in os.getenv("DATABASE_SHARD_URLS", "").split(",") if url.strip()]
+SHARD_DIRECTORY_CACHE_TTL = float(os.getenv("SHARD_DIRECTORY_CACHE_TTL", "10"))  # seconds a user -> shard entry is reused
+#endregion
+
+#region Startup
+# schema changes run through `python -m src.migrations`, enable only for single-process deployments
+MIGRATE_ON_STARTUP = _env_bool("MIGRATE_ON_STARTUP", False)
+DB_POOL_WARMUP = _env_bool("DB_POOL_WARMUP", True)  # open DB_POOL_SIZE connections in the background on startup
+# hourly rollover task in the app, enable in one process only (or run `python -m src.jobs.rollover --loop`)
+ROLLOVER_ON_STARTUP = _env_bool("ROLLOVER_ON_STARTUP", False)
+#endregion
+
+#region Cache
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory | redis | none
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))  # seconds
+CACHE_MAX_USERS = int(os.getenv("CACHE_MAX_USERS", "10000"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+#endregion
+
+#region Identity cache
+# which user ids and names exist, misses are cached for the shorter negative ttl
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "300"))  # seconds
+IDENTITY_CACHE_NEGATIVE_TTL = float(os.getenv("IDENTITY_CACHE_NEGATIVE_TTL", "10"))  # seconds
+IDENTITY_CACHE_MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", "100000"))
+# local | redis (pub/sub on CACHE_REDIS_URL), redis reaches every worker
+INVALIDATION_BACKEND = os.getenv("INVALIDATION_BACKEND", "local")
+INVALIDATION_CHANNEL = os.getenv("INVALIDATION_CHANNEL", "subs-invalidation")
+#endregion
+
+#region Compression
+# gzip responses of at least this many bytes (large sub lists and exports), 0 disables compression
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "0"))
+#endregion
+
+#region Tracing
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # log slower requests with their SQL, 0 disables
+#endregion
@@ -1,4 +1,5 @@
 #src/constants.py
+from decimal import Decimal
 from enum import Enum
 
 
@@ -6,12 +7,61 @@ MIN_SUB_NAME_LENGTH = 3
 MAX_SUB_NAME_LENGTH = 30
 MIN_SUB_COST = 0.0
 MIN_MONTH_COUNT = 1
+CENT = Decimal("0.01")  # amounts in responses are rounded to cents
+MIN_BILLING_INTERVAL = 1
+MAX_BILLING_INTERVAL = 52
 
 MIN_USER_NAME_LENGTH = 3
 MAX_USER_NAME_LENGTH = 20
 
+MAX_PAGE_SIZE = 500
+MAX_BULK_IMPORT_ROWS = 5000
+EXPORT_BATCH_SIZE = 1000
+MAX_UPCOMING_DAYS = 3 * 366
+
+DUE_SCAN_BATCH_SIZE = 1000
+DUE_SCAN_DAYS = 3
+
+ROLLOVER_BATCH_SIZE = 1000
+ROLLOVER_INTERVAL_SECONDS = 60 * 60
+
+SUMMARY_REBUILD_BATCH_SIZE = 1000
+
+MAX_BATCH_USERS = 5000
+BATCH_QUERY_CHUNK_SIZE = 1000
+
+SHARD_VIRTUAL_NODES = 64  # points of every shard on the consistent hash ring
+SUB_ID_BLOCK_SIZE = 1000  # global sub ids reserved per directory round trip (src.db.SubIdAllocator)
+
 
 class Category(str, Enum):
     WORK = "WORK"
     ENTERTAINMENT = "ENTERTAINMENT"
     OTHER = "OTHER"
+
+
+class BillingPeriod(str, Enum):
+    WEEK = "WEEK"
+    MONTH = "MONTH"
+    QUARTER = "QUARTER"
+    YEAR = "YEAR"
+
+
+class SubField(str, Enum):
+    ID = "id"
+    NAME = "name"
+    COST = "cost"
+    NEXT_PAYMENT_DATE = "next_payment_date"
+    CATEGORY = "category"
+    BILLING_PERIOD = "billing_period"
+    BILLING_INTERVAL = "billing_interval"
+
+
+class SubOrder(str, Enum):
+    ID = "id"
+    NEXT_PAYMENT_DATE = "next_payment_date"
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
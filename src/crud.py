@@ -1,24 +1,34 @@
 #src/crud.py
-from typing import Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 from datetime import date
-from dateutil.relativedelta import relativedelta
+from decimal import Decimal
 
+from sqlalchemy import Row, and_, bindparam, case, delete, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 import src.exceptions as exceptions
-from src.models import SubModel, UserModel
+from src.models import (SubModel, UserModel, UserSpendSummaryModel, UserDirectoryModel, SUB_COLUMNS, CATEGORY_MONTHLY_COST_COLUMNS,
+                        CATEGORY_SUB_COUNT_COLUMNS)
 from src.schemas import NewSub
+from src.billing import roll_sub_payment_date, roll_sub_payment_dates, count_monthly_cost
+from src.cache import cache
+from src.identity import identity_cache, invalidation_bus
+from src.db import stick_to_primary, sub_id_allocator
+from src.constants import (ROLLOVER_BATCH_SIZE, EXPORT_BATCH_SIZE, DUE_SCAN_BATCH_SIZE, SUMMARY_REBUILD_BATCH_SIZE,
+                           BATCH_QUERY_CHUNK_SIZE, Category, SubField, SubOrder)
 
 
 #region User
 
-def create_new_user(db: Session, username: str) -> UserModel:
+def create_new_user(db: Session, username: str, user_id: int = None) -> UserModel:
     """
-    Create a new user (UserModel) in db
+    Create a new user (UserModel) and their empty spend summary in db
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
         username (str): New username
+        user_id (int): Id from the user directory (with shards), generated by db if None
 
     Returns:
         UserModel (src.models.UserModel): User model
@@ -26,28 +36,32 @@ def create_new_user(db: Session, username: str) -> UserModel:
     Raises:
         exceptions.UsernameNotUniqueException: Username already exists
     """
-    if not __username_is_unique(db, username):
-        raise exceptions.UsernameNotUniqueException()
-    db_user = UserModel(name=username)
     try:
-        db.add(db_user)
+        values = {"name": username} if user_id is None else {"id": user_id, "name": username}
+        result = db.execute(insert(UserModel).values(**values))
+        db.execute(insert(UserSpendSummaryModel).values(user_id=result.inserted_primary_key[0]))
         db.commit()
-        db.refresh(db_user)
+    except IntegrityError:
+        # user.name is unique in db
+        db.rollback()
+        raise exceptions.UsernameNotUniqueException()
     except Exception as e:
         db.rollback()
         raise e
+    db_user = UserModel(id=result.inserted_primary_key[0], name=username)
+    __on_user_identity_changed(db_user.id, username)
+    __on_user_data_changed(db_user.id)
     return db_user
 
 
-def get_db_user(db: Session, user_id: int = None, username: str = None, update_next_payment_dates: bool = False) -> UserModel:
+def get_db_user(db: Session, user_id: int = None, username: str = None) -> UserModel:
     """
-    Get user (UserModel) and update all next_payment_dates for user subscriptions in db
+    Get user (UserModel) from db
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
         user_id (int): Unique user id
         username (str): Username
-        update_next_payment_dates (bool): Update next payment dates or not
 
     Returns:
         UserModel (src.models.UserModel): User model
@@ -60,20 +74,48 @@ def get_db_user(db: Session, user_id: int = None, username: str = None, update_n
         raise ValueError("Either user_id or name must be provided")
     user: Optional[UserModel] = None
     if user_id is not None:
+        __raise_if_known_missing(user_id)
         user = db.query(UserModel).filter_by(id=user_id).first()
     elif username is not None:
+        cached, cached_user_id = identity_cache.get_user_id(username)
+        if cached and cached_user_id is None:
+            raise exceptions.UserIsNoneException()
         user = db.query(UserModel).filter_by(name=username).first()
     if user is None:
+        identity_cache.set_missing_user(user_id, username if user_id is None else None)
         raise exceptions.UserIsNoneException()
-    if update_next_payment_dates:
-        __update_all_next_payment_dates(db, user)
+    identity_cache.set_user(user.id, user.name)
     return user
 
 
+def get_user_data_version(db: Session, user_id: int) -> int:
+    """
+    Get the data version of a user (one primary key lookup), it grows with every change of their subscriptions
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_id (int): Unique user id
+
+    Returns:
+        int: Data version
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+    """
+    __raise_if_known_missing(user_id)
+    data_version = db.execute(select(UserModel.data_version).where(UserModel.id == user_id)).scalar()
+    if data_version is None:
+        identity_cache.set_missing_user(user_id)
+        raise exceptions.UserIsNoneException()
+    return data_version
+
+
 def delete_db_user(db: Session, user_id: int = None, username: str = None) -> None:
     """
     Delete user (UserModel) and his subs (SubModel) from db
 
+    Subs are deleted by the ON DELETE CASCADE foreign key, not loaded into the session
+
     Args:
         db (sqlalchemy.orm.Session): Database connection session
         user_id (int): Unique user id
@@ -86,13 +128,29 @@ def delete_db_user(db: Session, user_id: int = None, username: str = None) -> No
         ValueError: If neither sub_id nor sub_name is provided
         exceptions.UserIsNoneException: User not found
     """
-    db_user = get_db_user(db, user_id, username)
+    if user_id is None and username is None:
+        raise ValueError("Either user_id or name must be provided")
+    if user_id is None:
+        cached, cached_user_id = identity_cache.get_user_id(username)
+        if cached and cached_user_id is None:
+            raise exceptions.UserIsNoneException()
+        user_id = db.query(UserModel.id).filter_by(name=username).scalar()
+        if user_id is None:
+            identity_cache.set_missing_user(username=username)
+            raise exceptions.UserIsNoneException()
+    else:
+        __raise_if_known_missing(user_id)
     try:
-        db.delete(db_user)
+        deleted = db.execute(delete(UserModel).where(UserModel.id == user_id)).rowcount
         db.commit()
     except Exception as e:
         db.rollback()
         raise e
+    if deleted == 0:
+        identity_cache.set_missing_user(user_id)
+        raise exceptions.UserIsNoneException()
+    __on_user_identity_changed(user_id, username)
+    __on_user_data_changed(user_id)
     return None
 
 #endregion
@@ -100,21 +158,203 @@ def delete_db_user(db: Session, user_id: int = None, username: str = None) -> No
 
 #region User (private)
 
-def __username_is_unique(db: Session, username: str) -> bool:
+def __user_exists(db: Session, user_id: int, use_cache: bool = True) -> bool:
     """
-    Check if username is unique
+    Check if user exists, used to tell "no user" from "no rows" after a statement matched nothing
+
+    Answered from the identity cache (src.identity) when possible, the result of a query is stored there.
+    Write paths pass use_cache=False: a cached positive entry can outlive a user deleted by another process
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
+        user_id (int): Unique user id
+        use_cache (bool): Answer from the identity cache if it has an entry
+
+    Returns:
+        bool: True if the user exists, False otherwise
+    """
+    if use_cache:
+        exists = identity_cache.user_exists(user_id)
+        if exists is not None:
+            return exists
+    exists = db.query(UserModel.id).filter_by(id=user_id).first() is not None
+    if exists:
+        identity_cache.set_user(user_id)
+    else:
+        identity_cache.set_missing_user(user_id)
+    return exists
+
+
+def __raise_if_known_missing(user_id: int) -> None:
+    """
+    Fail before any statement if the identity cache (src.identity) knows the user does not exist
+
+    Args:
+        user_id (int): Unique user id
+
+    Returns:
+        None
+
+    Raises:
+        exceptions.UserIsNoneException: User is cached as missing
+    """
+    if identity_cache.user_exists(user_id) is False:
+        raise exceptions.UserIsNoneException()
+    return None
+
+
+def __bump_data_versions(db: Session, user_ids: Iterable[int]) -> int:
+    """
+    Increment user.data_version of the users in the caller's transaction (one UPDATE)
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_ids (Iterable[int]): Unique user ids
+
+    Returns:
+        int: Number of updated users (existing users of user_ids)
+    """
+    return db.execute(
+        update(UserModel)
+        .where(UserModel.id.in_(list(user_ids)))
+        .values(data_version=UserModel.data_version + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+#endregion
+
+
+#region User directory
+# with DATABASE_SHARD_URLS the directory database (DATABASE_URL) holds global user ids, names and shards
+
+def add_directory_user(db: Session, username: str, shard: int) -> int:
+    """
+    Reserve a global user id and the username in the user directory (UserDirectoryModel)
+
+    Args:
+        db (sqlalchemy.orm.Session): Directory database session
+        username (str): New username
+        shard (int): Shard of the user
+
+    Returns:
+        int: New user id
+
+    Raises:
+        exceptions.UsernameNotUniqueException: Username already exists
+    """
+    try:
+        result = db.execute(insert(UserDirectoryModel).values(name=username, shard=shard))
+        db.commit()
+    except IntegrityError:
+        # user_directory.name is unique
+        db.rollback()
+        raise exceptions.UsernameNotUniqueException()
+    except Exception as e:
+        db.rollback()
+        raise e
+    return result.inserted_primary_key[0]
+
+
+def get_directory_user(db: Session, user_id: int = None, username: str = None) -> Row:
+    """
+    Get the directory entry of a user
+
+    Args:
+        db (sqlalchemy.orm.Session): Directory database session
+        user_id (int): Unique user id
         username (str): Username
 
     Returns:
-        bool: True if the username is unique, False otherwise
+        sqlalchemy.Row: Row with id, name and shard
+
+    Raises:
+        ValueError: If neither user_id nor name is provided
+        exceptions.UserIsNoneException: User not found
+    """
+    if user_id is None and username is None:
+        raise ValueError("Either user_id or name must be provided")
+    query = select(UserDirectoryModel.id, UserDirectoryModel.name, UserDirectoryModel.shard)
+    if user_id is not None:
+        query = query.where(UserDirectoryModel.id == user_id)
+    else:
+        query = query.where(UserDirectoryModel.name == username)
+    entry = db.execute(query).first()
+    if entry is None:
+        raise exceptions.UserIsNoneException()
+    return entry
+
+
+def iter_directory_users(db: Session, batch_size: int = SUMMARY_REBUILD_BATCH_SIZE) -> Iterator[Row]:
+    """
+    Iterate over the directory entries (id, name, shard) in id order, batch_size rows per statement
+
+    Args:
+        db (sqlalchemy.orm.Session): Directory database session
+        batch_size (int): Number of entries per statement
+
+    Returns:
+        Iterator[sqlalchemy.Row]: Rows with id, name and shard
+    """
+    last_id = 0
+    while True:
+        entries = db.execute(
+            select(UserDirectoryModel.id, UserDirectoryModel.name, UserDirectoryModel.shard)
+            .where(UserDirectoryModel.id > last_id)
+            .order_by(UserDirectoryModel.id.asc())
+            .limit(batch_size)
+        ).all()
+        if not entries:
+            return
+        yield from entries
+        last_id = entries[-1].id
+
+
+def set_directory_user_shard(db: Session, user_id: int, shard: int) -> None:
     """
-    db_user = db.query(UserModel).filter_by(name=username).first()
-    if db_user is None:
-        return True
-    return False
+    Point a user to another shard (after their data was copied there)
+
+    Args:
+        db (sqlalchemy.orm.Session): Directory database session
+        user_id (int): Unique user id
+        shard (int): New shard of the user
+
+    Returns:
+        None
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+    """
+    try:
+        updated = db.execute(
+            update(UserDirectoryModel).where(UserDirectoryModel.id == user_id).values(shard=shard)
+        ).rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    if updated == 0:
+        raise exceptions.UserIsNoneException()
+    return None
+
+
+def delete_directory_user(db: Session, user_id: int) -> None:
+    """
+    Remove a user from the directory (after their data was deleted from their shard)
+
+    Args:
+        db (sqlalchemy.orm.Session): Directory database session
+        user_id (int): Unique user id
+
+    Returns:
+        None
+    """
+    try:
+        db.execute(delete(UserDirectoryModel).where(UserDirectoryModel.id == user_id))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise e
+    return None
 
 #endregion
 
@@ -137,29 +377,131 @@ def create_new_sub(db: Session, user_id: int, new_sub: NewSub) -> SubModel:
         exceptions.UserIsNoneException: User not found
         exceptions.SubNameNotUniqueException: Subscription name already exists
     """
-    if not __sub_name_is_unique(db, user_id, new_sub.name):
-        raise exceptions.SubNameNotUniqueException()
-    get_db_user(db, user_id)
-    db_sub = SubModel(
-        name=new_sub.name,
-        cost=new_sub.cost,
-        next_payment_date=new_sub.next_payment_date,
-        category=new_sub.category,
-        user_id=user_id
+    __raise_if_known_missing(user_id)
+    values = {
+        "name": new_sub.name,
+        "cost": new_sub.cost,
+        "next_payment_date": new_sub.next_payment_date,
+        "billing_anchor_date": new_sub.next_payment_date,
+        "category": new_sub.category,
+        "billing_period": new_sub.billing_period,
+        "billing_interval": new_sub.billing_interval,
+        "monthly_cost": count_monthly_cost(new_sub.cost, new_sub.billing_period, new_sub.billing_interval),
+    }
+    # global id with shards (src.db.SubIdAllocator), generated by db otherwise
+    sub_ids = sub_id_allocator.allocate(1)
+    inserted = values if sub_ids is None else {"id": sub_ids[0], **values}
+    # INSERT ... SELECT FROM user inserts nothing if the user does not exist
+    query = insert(SubModel.__table__).from_select(
+        [*inserted, "user_id"],
+        select(
+            *(literal(value, SubModel.__table__.c[name].type) for name, value in inserted.items()),
+            UserModel.id
+        ).where(UserModel.id == user_id)
     )
     try:
-        db.add(db_sub)
+        result = db.execute(query)
+        sub_id = result.lastrowid if sub_ids is None else sub_ids[0]
+        if result.rowcount:
+            __add_to_spend_summary(db, user_id, sub_id, values)
+            __bump_data_versions(db, [user_id])
         db.commit()
-        db.refresh(db_sub)
+    except IntegrityError:
+        # (user_id, name) is covered by the ix_sub_user_id_name unique index,
+        # a user deleted after the SELECT part fails the user_id foreign key instead
+        db.rollback()
+        if not __user_exists(db, user_id, use_cache=False):
+            raise exceptions.UserIsNoneException()
+        raise exceptions.SubNameNotUniqueException()
     except Exception as e:
         db.rollback()
         raise e
+    if result.rowcount == 0:
+        identity_cache.set_missing_user(user_id)
+        raise exceptions.UserIsNoneException()
+    __on_user_data_changed(user_id)
+    db_sub = SubModel(id=sub_id, user_id=user_id, **values)
     return db_sub
 
 
-def get_db_sub(db: Session, user_id: int, sub_id: int = None, sub_name: str = None) -> SubModel:
+def create_new_subs(db: Session, user_id: int, new_subs: List[NewSub]) -> Set[str]:
     """
-    Get subscription (SubModel) in db
+    Create many subscriptions (SubModel) in db in one transaction
+
+    Name collisions with existing subscriptions are detected with one query, such subscriptions are skipped.
+    The rest is inserted with one multi-row INSERT. The data version of the user is bumped first:
+    the UPDATE finds no row if the user is gone and locks the user row until the commit
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_id (int): Unique user id
+        new_subs (List[src.schemas.NewSub]): New subscription schemes with unique names
+
+    Returns:
+        Set[str]: Names that already existed (not created)
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+        exceptions.SubNameNotUniqueException: A name was taken concurrently, nothing is created
+    """
+    __raise_if_known_missing(user_id)
+    if not new_subs:
+        if not __user_exists(db, user_id, use_cache=False):
+            raise exceptions.UserIsNoneException()
+        return set()
+    existing_names = {
+        name for (name,) in
+        db.query(SubModel.name).filter(SubModel.user_id == user_id, SubModel.name.in_([sub.name for sub in new_subs]))
+    }
+    rows = [
+        {
+            "name": new_sub.name,
+            "cost": new_sub.cost,
+            "next_payment_date": new_sub.next_payment_date,
+            "billing_anchor_date": new_sub.next_payment_date,
+            "category": new_sub.category,
+            "billing_period": new_sub.billing_period,
+            "billing_interval": new_sub.billing_interval,
+            "monthly_cost": count_monthly_cost(new_sub.cost, new_sub.billing_period, new_sub.billing_interval),
+            "user_id": user_id,
+        }
+        for new_sub in new_subs if new_sub.name not in existing_names
+    ]
+    if not rows:
+        if not existing_names and not __user_exists(db, user_id, use_cache=False):
+            raise exceptions.UserIsNoneException()
+        return existing_names
+    sub_ids = sub_id_allocator.allocate(len(rows))
+    if sub_ids is not None:
+        for row, sub_id in zip(rows, sub_ids):
+            row["id"] = sub_id
+    try:
+        user_found = __bump_data_versions(db, [user_id]) > 0
+        if user_found:
+            db.execute(insert(SubModel), rows)
+            __refresh_spend_summaries(db, [user_id])
+        db.commit()
+    except IntegrityError:
+        # unique (user_id, name) index, or the user_id foreign key if the user was deleted meanwhile
+        db.rollback()
+        if not __user_exists(db, user_id, use_cache=False):
+            raise exceptions.UserIsNoneException()
+        raise exceptions.SubNameNotUniqueException()
+    except Exception as e:
+        db.rollback()
+        raise e
+    if not user_found:
+        identity_cache.set_missing_user(user_id)
+        raise exceptions.UserIsNoneException()
+    __on_user_data_changed(user_id)
+    return existing_names
+
+
+def get_db_sub(db: Session, user_id: int, sub_id: int = None, sub_name: str = None) -> Row:
+    """
+    Get subscription in db as a row of SUB_COLUMNS (no ORM entity is loaded)
+
+    The stored next_payment_date may be overdue, use src.billing.roll_sub_payment_date() to get the effective one
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
@@ -168,83 +510,273 @@ def get_db_sub(db: Session, user_id: int, sub_id: int = None, sub_name: str = No
         sub_name (str): Subscription name
 
     Returns:
-        SubModel (src.models.SubModel): Subscription model
+        sqlalchemy.Row: Row with the src.models.SUB_COLUMNS as attributes
 
     Raises:
         ValueError: If neither sub_id nor sub_name is provided
         exceptions.UserIsNoneException: User not found
         exceptions.SubIsNoneException: If the subscription does not exist or belongs to another user (via get_db_sub)
     """
-    get_db_user(db, user_id, update_next_payment_dates=True)
+    __raise_if_known_missing(user_id)
     if sub_id is None and sub_name is None:
         raise ValueError("Either sub_id or sub_name must be provided")
-    query = db.query(SubModel).filter_by(user_id=user_id)
+    query = select(*SUB_COLUMNS).where(SubModel.user_id == user_id)
     if sub_id is not None:
-        query = query.filter_by(id=sub_id)
+        query = query.where(SubModel.id == sub_id)
     else:
-        query = query.filter_by(name=sub_name)
-    sub: Optional[SubModel] = query.first()
+        query = query.where(SubModel.name == sub_name)
+    sub: Optional[Row] = db.execute(query).first()
     if sub is None:
+        if not __user_exists(db, user_id):
+            raise exceptions.UserIsNoneException()
         raise exceptions.SubIsNoneException()
-    try:
-        if sub.next_payment_date < date.today():
-            sub.next_payment_date += relativedelta(months=+1)
-            db.commit()
-    except Exception as e:
-        db.rollback()
-        raise e
     return sub
 
 
-def get_next_payment_db_sub(db: Session, user_id: int) -> SubModel:
+def get_db_subs(
+    db: Session,
+    user_id: int,
+    category: Category = None,
+    order_by: SubOrder = SubOrder.ID,
+    after: Tuple = None,
+    limit: int = None,
+    fields: Iterable[SubField] = None
+) -> List[Row]:
     """
-    Get subscription (SubModel) in db with nearest payment date
+    Get a page of subscriptions of a user in db (keyset pagination)
+
+    Only the requested columns are selected, the columns of the sort key are always included,
+    the billing columns and the billing anchor are added with next_payment_date (needed to roll it over)
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
         user_id (int): Unique user id
+        category (src.constants.Category): Only subscriptions of this category
+        order_by (src.constants.SubOrder): Sort key, (next_payment_date, id) or id
+        after (Tuple): Sort key of the last row of the previous page, (next_payment_date, id) or (id,)
+        limit (int): Max number of rows
+        fields (Iterable[src.constants.SubField]): Columns to select, all by default
 
     Returns:
-        SubModel (src.models.SubModel): Subscription model
+        List[sqlalchemy.Row]: Rows with the selected columns as attributes
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+    """
+    __raise_if_known_missing(user_id)
+    names = [field.value for field in (fields or SubField)]
+    for key_field in (SubField.ID, SubField.NEXT_PAYMENT_DATE) if order_by == SubOrder.NEXT_PAYMENT_DATE else (SubField.ID,):
+        if key_field.value not in names:
+            names.append(key_field.value)
+    if SubField.NEXT_PAYMENT_DATE.value in names:
+        for billing_field in (SubField.BILLING_PERIOD, SubField.BILLING_INTERVAL):
+            if billing_field.value not in names:
+                names.append(billing_field.value)
+    columns = [getattr(SubModel, name) for name in names]
+    if SubField.NEXT_PAYMENT_DATE.value in names:
+        columns.append(SubModel.billing_anchor_date)
+    query = db.query(*columns).filter(SubModel.user_id == user_id)
+    if category is not None:
+        query = query.filter(SubModel.category == category)
+    if order_by == SubOrder.NEXT_PAYMENT_DATE:
+        if after is not None:
+            after_date, after_id = after
+            query = query.filter(or_(
+                SubModel.next_payment_date > after_date,
+                and_(SubModel.next_payment_date == after_date, SubModel.id > after_id)
+            ))
+        query = query.order_by(SubModel.next_payment_date.asc(), SubModel.id.asc())
+    else:
+        if after is not None:
+            query = query.filter(SubModel.id > after[0])
+        query = query.order_by(SubModel.id.asc())
+    if limit is not None:
+        query = query.limit(limit)
+    rows = query.all()
+    if not rows and not __user_exists(db, user_id):
+        raise exceptions.UserIsNoneException()
+    return rows
+
+
+def iter_db_subs(db: Session, user_id: int = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Row]:
+    """
+    Iterate over subscriptions in db, reading batch_size rows at a time in keyset order of id
+
+    Every batch is a separate short statement (WHERE id > last id ORDER BY id LIMIT batch_size),
+    so memory stays bounded on drivers without server-side cursors (mysqlconnector buffers whole results)
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_id (int): Unique user id, all subscriptions of all users if None
+        batch_size (int): Max number of rows read by one statement
+
+    Returns:
+        Iterator[sqlalchemy.Row]: Rows with the SubModel columns as attributes, ordered by id
+    """
+    query = select(
+        SubModel.id, SubModel.user_id, SubModel.name, SubModel.cost, SubModel.next_payment_date, SubModel.category,
+        SubModel.billing_period, SubModel.billing_interval, SubModel.billing_anchor_date
+    ).order_by(SubModel.id.asc()).limit(batch_size)
+    if user_id is not None:
+        query = query.where(SubModel.user_id == user_id)
+    last_id = 0
+    while True:
+        rows = db.execute(query.where(SubModel.id > last_id)).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1].id
+
+
+def get_next_payment_db_sub(db: Session, user_id: int) -> Row:
+    """
+    Get subscription in db with nearest payment date as a row of SUB_COLUMNS
+
+    Read through the spend summary (primary key lookups) while its earliest payment date is not overdue.
+    Otherwise overdue subscriptions (not rolled over yet) are compared by their effective payment date,
+    so the result does not depend on whether the rollover job has already run
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_id (int): Unique user id
+
+    Returns:
+        sqlalchemy.Row: Row with the src.models.SUB_COLUMNS as attributes
 
     Raises:
         exceptions.UserIsNoneException: User not found
         exceptions.UserHasNoSubsException: If user has no subscriptions
     """
-    get_db_user(db, user_id, update_next_payment_dates=True)
+    __raise_if_known_missing(user_id)
     today = date.today()
-    next_payment_db_sub: Optional[SubModel] = (
-        db.query(SubModel)
-        .filter_by(user_id=user_id)
-        .filter(SubModel.next_payment_date >= today)
-        .order_by(SubModel.next_payment_date.asc())
-        .first()
+    next_payment_db_sub = db.execute(
+        select(*SUB_COLUMNS)
+        .join(UserSpendSummaryModel, UserSpendSummaryModel.next_payment_sub_id == SubModel.id)
+        .where(UserSpendSummaryModel.user_id == user_id, UserSpendSummaryModel.next_payment_date >= today)
+    ).first()
+    if next_payment_db_sub is not None:
+        return next_payment_db_sub
+    # overdue subs plus the subs on the nearest upcoming date, in one statement
+    nearest_upcoming_date = (
+        select(func.min(SubModel.next_payment_date))
+        .where(SubModel.user_id == user_id, SubModel.next_payment_date >= today)
+        .scalar_subquery()
     )
-    if next_payment_db_sub is None:
+    candidates = db.execute(
+        select(*SUB_COLUMNS)
+        .where(SubModel.user_id == user_id)
+        .where(or_(SubModel.next_payment_date < today, SubModel.next_payment_date == nearest_upcoming_date))
+        .order_by(SubModel.id.asc())
+    ).all()
+    if not candidates:
+        if not __user_exists(db, user_id):
+            raise exceptions.UserIsNoneException()
         raise exceptions.UserHasNoSubsException()
+    next_payment_db_sub = min(candidates, key=lambda sub: roll_sub_payment_date(sub, today))
     return next_payment_db_sub
 
 
-def count_monthly_amount(db: Session, user_id: int) -> float:
+def get_upcoming_db_subs(db: Session, user_id: int, end: date) -> List[Row]:
     """
-    Gets the amount of the user's monthly payments
+    Get subscriptions of a user in db that have a payment on or before end
+
+    A subscription anchored after end has no payment in any window ending at end,
+    so it is filtered out by the (user_id, next_payment_date) index
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
         user_id (int): Unique user id
+        end (datetime.date): Last day of the window
 
     Returns:
-        float: Amount of monthly payments
+        List[sqlalchemy.Row]: Rows with the src.models.SUB_COLUMNS as attributes
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+    """
+    __raise_if_known_missing(user_id)
+    rows = db.execute(
+        select(*SUB_COLUMNS).where(SubModel.user_id == user_id, SubModel.next_payment_date <= end)
+    ).all()
+    if not rows and not __user_exists(db, user_id):
+        raise exceptions.UserIsNoneException()
+    return rows
+
+
+def count_monthly_amount(db: Session, user_id: int) -> Decimal:
+    """
+    Gets the amount of the user's monthly payments from their spend summary (one primary key lookup)
+
+    Falls back to one SUM/COUNT aggregate over the normalized monthly costs if the summary row is missing
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_id (int): Unique user id
+
+    Returns:
+        Decimal: Amount of monthly payments
 
     Raises:
-        ValueError: If neither user_id nor name is provided to func get_db_user()
         exceptions.UserIsNoneException: User not found
         exceptions.UserHasNoSubsException: If user has no subscriptions
     """
-    user = get_db_user(db, user_id)
-    if len(user.subs) == 0:
+    __raise_if_known_missing(user_id)
+    summary = db.execute(
+        select(UserSpendSummaryModel.total_monthly_cost, UserSpendSummaryModel.sub_count)
+        .where(UserSpendSummaryModel.user_id == user_id)
+    ).first()
+    if summary is not None:
+        amount, sub_count = summary
+    else:
+        amount, sub_count = (
+            db.query(func.sum(SubModel.monthly_cost), func.count(SubModel.id))
+            .filter(SubModel.user_id == user_id)
+            .one()
+        )
+    if sub_count == 0:
+        if not __user_exists(db, user_id):
+            raise exceptions.UserIsNoneException()
         raise exceptions.UserHasNoSubsException()
-    result = sum(sub.cost for sub in user.subs)
+    return amount
+
+
+def count_monthly_amount_by_category(db: Session, user_id: int) -> Dict[Category, Decimal]:
+    """
+    Gets the amount of the user's monthly payments per category from their spend summary (one primary key lookup)
+
+    Falls back to one GROUP BY aggregate if the summary row is missing
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_id (int): Unique user id
+
+    Returns:
+        Dict[Category, Decimal]: Amount of monthly payments by category (categories without subscriptions are omitted)
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+        exceptions.UserHasNoSubsException: If user has no subscriptions
+    """
+    __raise_if_known_missing(user_id)
+    summary = db.execute(
+        select(*CATEGORY_MONTHLY_COST_COLUMNS.values(), *CATEGORY_SUB_COUNT_COLUMNS.values())
+        .where(UserSpendSummaryModel.user_id == user_id)
+    ).first()
+    if summary is not None:
+        costs, counts = summary[:len(Category)], summary[len(Category):]
+        rows = [(category, cost) for category, cost, count in zip(CATEGORY_MONTHLY_COST_COLUMNS, costs, counts) if count]
+    else:
+        rows = (
+            db.query(SubModel.category, func.sum(SubModel.monthly_cost))
+            .filter(SubModel.user_id == user_id)
+            .group_by(SubModel.category)
+            .all()
+        )
+    if not rows:
+        if not __user_exists(db, user_id):
+            raise exceptions.UserIsNoneException()
+        raise exceptions.UserHasNoSubsException()
+    result = {category: amount for category, amount in rows}
     return result
 
 
@@ -264,15 +796,36 @@ def delete_db_sub(db: Session, user_id: int, sub_id: int = None, sub_name: str =
     Raises:
         ValueError: If neither sub_id nor sub_name is provided
         exceptions.UserIsNoneException: User not found
-        exceptions.SubIsNoneException: If the subscription does not exist or belongs to another user (via get_db_sub)
+        exceptions.SubIsNoneException: If the subscription does not exist or belongs to another user
     """
-    db_sub = get_db_sub(db, user_id, sub_id, sub_name)
+    __raise_if_known_missing(user_id)
+    if sub_id is None and sub_name is None:
+        raise ValueError("Either sub_id or sub_name must be provided")
+    # the deleted row's cost and category are subtracted from the spend summary
+    query = (
+        select(SubModel.id, SubModel.monthly_cost, SubModel.category)
+        .where(SubModel.user_id == user_id)
+        .with_for_update()
+    )
+    if sub_id is not None:
+        query = query.where(SubModel.id == sub_id)
+    else:
+        query = query.where(SubModel.name == sub_name)
     try:
-        db.delete(db_sub)
+        sub = db.execute(query).first()
+        if sub is not None:
+            db.execute(delete(SubModel).where(SubModel.id == sub.id), execution_options={"synchronize_session": False})
+            __remove_from_spend_summary(db, user_id, sub)
+            __bump_data_versions(db, [user_id])
         db.commit()
     except Exception as e:
         db.rollback()
         raise e
+    if sub is None:
+        if not __user_exists(db, user_id, use_cache=False):
+            raise exceptions.UserIsNoneException()
+        raise exceptions.SubIsNoneException()
+    __on_user_data_changed(user_id)
     return None
 
 
@@ -291,61 +844,555 @@ def delete_all_user_db_subs(db: Session, user_id: int) -> None:
         ValueError: If neither sub_id nor sub_name is provided
         exceptions.UserIsNoneException: User not found
     """
-    get_db_user(db, user_id)
+    __raise_if_known_missing(user_id)
     try:
-        db.query(SubModel).filter_by(user_id=user_id).delete(synchronize_session=False)
+        deleted = db.query(SubModel).filter_by(user_id=user_id).delete(synchronize_session=False)
+        __clear_spend_summary(db, user_id)
+        if deleted:
+            __bump_data_versions(db, [user_id])
         db.commit()
     except Exception as e:
         db.rollback()
         raise e
+    if deleted == 0 and not __user_exists(db, user_id, use_cache=False):
+        raise exceptions.UserIsNoneException()
+    __on_user_data_changed(user_id)
     return None
 
 #endregion
 
 
-#region Sub (private)
+#region Batch reads
 
-def __sub_name_is_unique(db: Session, user_id: int, sub_name: str) -> bool:
+def get_existing_user_ids(db: Session, user_ids: Sequence[int], chunk_size: int = BATCH_QUERY_CHUNK_SIZE) -> Set[int]:
     """
-    Check if sub_name is unique
+    Get which of the given users exist in db, with one IN query per chunk of ids not in the identity cache (src.identity)
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
-        user_id (int): Unique user id
-        sub_name (str): Subscription name
+        user_ids (Sequence[int]): Unique user ids
+        chunk_size (int): Max number of ids in one IN list
 
     Returns:
-        bool: True if the subscription name is unique, False otherwise
+        Set[int]: Ids of existing users
+    """
+    existing = set()
+    unknown = []
+    for user_id in user_ids:
+        exists = identity_cache.user_exists(user_id)
+        if exists is None:
+            unknown.append(user_id)
+        elif exists:
+            existing.add(user_id)
+    for chunk in __chunks(unknown, chunk_size):
+        found = set(db.execute(select(UserModel.id).where(UserModel.id.in_(chunk))).scalars())
+        for user_id in chunk:
+            if user_id in found:
+                identity_cache.set_user(user_id)
+            else:
+                identity_cache.set_missing_user(user_id)
+        existing.update(found)
+    return existing
+
+
+def count_monthly_amounts(
+    db: Session,
+    user_ids: Sequence[int],
+    chunk_size: int = BATCH_QUERY_CHUNK_SIZE
+) -> Dict[int, Tuple[Decimal, int]]:
     """
-    unique = db.query(SubModel).filter_by(user_id=user_id, name=sub_name).first() is None
-    return unique
+    Gets the monthly amounts of many users from their spend summaries, with one IN query per chunk of ids
 
+    Users without a summary row are aggregated from the sub table with one GROUP BY query per chunk
 
-def __update_all_next_payment_dates(db: Session, user: UserModel) -> None:
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        user_ids (Sequence[int]): Unique user ids
+        chunk_size (int): Max number of ids in one IN list
+
+    Returns:
+        Dict[int, Tuple[Decimal, int]]: User id -> (monthly amount, number of subscriptions),
+            users that do not exist are omitted
     """
-    Update all next_payment_dates for user subscriptions in db
+    result: Dict[int, Tuple[Decimal, int]] = {}
+    for chunk in __chunks(user_ids, chunk_size):
+        rows = db.execute(
+            select(UserSpendSummaryModel.user_id, UserSpendSummaryModel.total_monthly_cost, UserSpendSummaryModel.sub_count)
+            .where(UserSpendSummaryModel.user_id.in_(chunk))
+        ).all()
+        result.update((user_id, (amount, sub_count)) for user_id, amount, sub_count in rows)
+    without_summary = [user_id for user_id in user_ids if user_id not in result]
+    if without_summary:
+        existing = get_existing_user_ids(db, without_summary, chunk_size)
+        for chunk in __chunks(sorted(existing), chunk_size):
+            rows = db.execute(
+                select(SubModel.user_id, func.sum(SubModel.monthly_cost), func.count(SubModel.id))
+                .where(SubModel.user_id.in_(chunk))
+                .group_by(SubModel.user_id)
+            ).all()
+            result.update((user_id, (amount, sub_count)) for user_id, amount, sub_count in rows)
+        result.update((user_id, (Decimal(0), 0)) for user_id in existing if user_id not in result)
+    return result
+
+
+def get_next_payment_db_subs(
+    db: Session,
+    user_ids: Sequence[int],
+    chunk_size: int = BATCH_QUERY_CHUNK_SIZE
+) -> Dict[int, Row]:
+    """
+    Get the subscription with the nearest payment date of many users, with one query per chunk of ids
+
+    ROW_NUMBER() OVER (PARTITION BY user_id, overdue ORDER BY next_payment_date, id) keeps the first upcoming sub
+    of every user plus their overdue subs (not rolled over yet), which are then compared by their effective
+    payment date, so the result matches get_next_payment_db_sub()
 
     Args:
         db (sqlalchemy.orm.Session): Database connection session
-        user (src.models.UserModel): User model
+        user_ids (Sequence[int]): Unique user ids
+        chunk_size (int): Max number of ids in one IN list
 
     Returns:
-        None
+        Dict[int, sqlalchemy.Row]: User id -> row with the SubModel columns as attributes,
+            users without subscriptions (or that do not exist) are omitted
     """
-    if not user.subs:
-        return None
-    try:
+    today = date.today()
+    overdue = SubModel.next_payment_date < today
+    result: Dict[int, Row] = {}
+    for chunk in __chunks(user_ids, chunk_size):
+        ranked = (
+            select(
+                SubModel.id, SubModel.user_id, SubModel.name, SubModel.cost, SubModel.next_payment_date,
+                SubModel.category, SubModel.billing_period, SubModel.billing_interval, SubModel.billing_anchor_date,
+                func.row_number().over(
+                    partition_by=(SubModel.user_id, overdue),
+                    order_by=(SubModel.next_payment_date.asc(), SubModel.id.asc())
+                ).label("rank")
+            )
+            .where(SubModel.user_id.in_(chunk))
+            .subquery()
+        )
+        rows = db.execute(
+            select(*(column for column in ranked.c if column.key != "rank"))
+            .where(or_(ranked.c.rank == 1, ranked.c.next_payment_date < today))
+            .order_by(ranked.c.id.asc())
+        ).all()
+        for row in rows:
+            current = result.get(row.user_id)
+            if current is None or roll_sub_payment_date(row, today) < roll_sub_payment_date(current, today):
+                result[row.user_id] = row
+    return result
+
+#endregion
+
+
+#region Batch reads (private)
+
+def __chunks(values: Sequence, size: int) -> Iterator[Sequence]:
+    # bounded IN lists keep statements below max_allowed_packet and the optimizer's range limits
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+#endregion
+
+
+#region Due window
+
+def iter_due_db_subs(
+    db: Session,
+    start: date,
+    end: date,
+    today: date = None,
+    batch_size: int = DUE_SCAN_BATCH_SIZE
+) -> Iterator[List[Row]]:
+    """
+    Iterate over subscriptions of all users with an effective payment date within [start, end]
+
+    One set-based query per batch instead of one query per user: rows are read in keyset order of
+    (next_payment_date, id) on the ix_sub_next_payment_date_id index, every batch is a separate short
+    statement, so batches can be consumed slowly. Overdue rows (not rolled over yet) are matched
+    by their effective payment date
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        start (datetime.date): First day of the window
+        end (datetime.date): Last day of the window
+        today (datetime.date): Reference date for overdue rows, date.today() by default
+        batch_size (int): Max number of rows read by one statement
+
+    Returns:
+        Iterator[List[sqlalchemy.Row]]: Batches of rows with id, user_id, name, cost, next_payment_date (stored),
+            category and the billing columns as attributes, batches can be shorter than batch_size
+    """
+    if today is None:
+        today = date.today()
+    query = (
+        select(
+            SubModel.id, SubModel.user_id, SubModel.name, SubModel.cost, SubModel.next_payment_date, SubModel.category,
+            SubModel.billing_period, SubModel.billing_interval, SubModel.billing_anchor_date
+        )
+        .where(
+            SubModel.next_payment_date <= end,
+            or_(SubModel.next_payment_date >= start, SubModel.next_payment_date < today)
+        )
+        .order_by(SubModel.next_payment_date.asc(), SubModel.id.asc())
+        .limit(batch_size)
+    )
+    after = None
+    while True:
+        batch_query = query
+        if after is not None:
+            after_date, after_id = after
+            batch_query = query.where(or_(
+                SubModel.next_payment_date > after_date,
+                and_(SubModel.next_payment_date == after_date, SubModel.id > after_id)
+            ))
+        rows = db.execute(batch_query).all()
+        if not rows:
+            return
+        after = (rows[-1].next_payment_date, rows[-1].id)
+        due = [
+            row for row in rows
+            if row.next_payment_date >= today or start <= roll_sub_payment_date(row, today) <= end
+        ]
+        if due:
+            yield due
+        if len(rows) < batch_size:
+            return
+
+#endregion
+
+
+#region Rollover
+
+def rollover_overdue_subs(db: Session, today: date = None, batch_size: int = ROLLOVER_BATCH_SIZE) -> int:
+    """
+    Move all overdue next_payment_dates in db to their effective payment dates
+
+    Dates are rolled from billing_anchor_date, which is never changed, so a rolled date does not become
+    the new anchor (Jan 31 -> Feb 29 -> Mar 31). Only next_payment_date is updated.
+    Overdue rows are selected in bounded batches (keyset by id) and updated with one executemany UPDATE
+    per batch (rows deleted in between are skipped), every batch is committed separately (with the spend summaries and data versions of its users)
+    to keep transactions and row locks short
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        today (datetime.date): Reference date, date.today() by default
+        batch_size (int): Max number of rows updated in one transaction
+
+    Returns:
+        int: Number of updated subscriptions
+    """
+    if today is None:
         today = date.today()
-        changed = False
-        for sub in user.subs:
-            while sub.next_payment_date < today:
-                sub.next_payment_date += relativedelta(months=+1)
-                changed = True
-        if changed:
+    # Core executemany: the ORM bulk UPDATE by primary key raises StaleDataError when a selected row
+    # is deleted before the UPDATE, here such a row is simply not matched
+    sub_table = SubModel.__table__
+    rollover_query = (
+        update(sub_table)
+        .where(sub_table.c.id == bindparam("b_id"))
+        .values(next_payment_date=bindparam("b_next_payment_date"))
+    )
+    updated = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(
+                SubModel.id, SubModel.user_id, SubModel.next_payment_date, SubModel.billing_period,
+                SubModel.billing_interval, SubModel.billing_anchor_date
+            )
+            .filter(SubModel.next_payment_date < today, SubModel.id > last_id)
+            .order_by(SubModel.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        rolled_dates = roll_sub_payment_dates(rows, today)
+        try:
+            db.execute(
+                rollover_query,
+                [{"b_id": row.id, "b_next_payment_date": rolled_date} for row, rolled_date in zip(rows, rolled_dates)]
+            )
+            user_ids = {row.user_id for row in rows}
+            __refresh_spend_summaries(db, user_ids, next_payment_only=True)
+            __bump_data_versions(db, user_ids)
             db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+        # drops the cached data versions, cached bodies are keyed by the data version and are not reused after the bump
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+        updated += len(rows)
+        last_id = rows[-1].id
+    return updated
+
+#endregion
+
+
+#region Shard moves
+
+def export_user_data(db: Session, user_id: int) -> Tuple[Row, List[Row]]:
+    """
+    Read a user and all their subscriptions (every column) to copy them to another shard
+
+    The user row is locked (FOR UPDATE) until the caller's transaction ends
+
+    Args:
+        db (sqlalchemy.orm.Session): Session on the source shard
+        user_id (int): Unique user id
+
+    Returns:
+        Tuple[sqlalchemy.Row, List[sqlalchemy.Row]]: User row (id, name, data_version) and sub rows ordered by id
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+    """
+    user = db.execute(
+        select(UserModel.id, UserModel.name, UserModel.data_version).where(UserModel.id == user_id).with_for_update()
+    ).first()
+    if user is None:
+        raise exceptions.UserIsNoneException()
+    subs = db.execute(
+        select(*SubModel.__table__.columns).where(SubModel.user_id == user_id).order_by(SubModel.id.asc())
+    ).all()
+    return user, subs
+
+
+def import_user_data(db: Session, user: Row, subs: Sequence[Row]) -> None:
+    """
+    Insert a user with their subscriptions and spend summary in one transaction (on the target shard of a move)
+
+    Sub ids are global (src.db.SubIdAllocator) and kept, so are the data version and the ETags built from it.
+    Only subs created with per-shard ids before the allocator existed can collide
+
+    Args:
+        db (sqlalchemy.orm.Session): Session on the target shard
+        user (sqlalchemy.Row): User row from export_user_data()
+        subs (Sequence[sqlalchemy.Row]): Sub rows from export_user_data()
+
+    Returns:
+        None
+
+    Raises:
+        exceptions.UserIsOnShardException: The user id or name already exists on this shard
+        exceptions.SubIdIsOnShardException: A sub id of the user is taken on this shard, nothing is inserted
+    """
+    sub_ids = [sub.id for sub in subs]
+    if any(
+        db.execute(select(SubModel.id).where(SubModel.id.in_(chunk)).limit(1)).first() is not None
+        for chunk in __chunks(sub_ids, BATCH_QUERY_CHUNK_SIZE)
+    ):
+        raise exceptions.SubIdIsOnShardException()
+    rows = [dict(sub._mapping) for sub in subs]
+    try:
+        db.execute(insert(UserModel).values(id=user.id, name=user.name, data_version=user.data_version))
+        db.execute(insert(UserSpendSummaryModel).values(user_id=user.id))
+        for chunk in __chunks(rows, SUMMARY_REBUILD_BATCH_SIZE):
+            db.execute(insert(SubModel), chunk)
+        __refresh_spend_summaries(db, [user.id])
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise exceptions.UserIsOnShardException()
     except Exception as e:
         db.rollback()
         raise e
+    __on_user_data_changed(user.id)
+    return None
+
+#endregion
+
+
+#region Spend summary
+
+def rebuild_user_spend_summaries(db: Session, batch_size: int = SUMMARY_REBUILD_BATCH_SIZE) -> int:
+    """
+    Recompute the spend summaries (UserSpendSummaryModel) of all users from the sub table
+
+    Reconciles any drift of the incrementally maintained rows and creates missing ones.
+    Users are processed in keyset batches by id, every batch is replaced and committed separately
+
+    Args:
+        db (sqlalchemy.orm.Session): Database connection session
+        batch_size (int): Number of users per transaction
+
+    Returns:
+        int: Number of rebuilt summaries
+    """
+    rebuilt = 0
+    last_id = 0
+    while True:
+        user_ids = db.execute(
+            select(UserModel.id).where(UserModel.id > last_id).order_by(UserModel.id.asc()).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        values = __spend_summary_values(UserModel.id)
+        try:
+            db.execute(delete(UserSpendSummaryModel).where(UserSpendSummaryModel.user_id.in_(user_ids)))
+            db.execute(
+                insert(UserSpendSummaryModel).from_select(
+                    ["user_id", *values],
+                    select(UserModel.id, *values.values()).where(UserModel.id.in_(user_ids))
+                )
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+        rebuilt += len(user_ids)
+        last_id = user_ids[-1]
+    return rebuilt
+
+#endregion
+
+
+#region Spend summary (private)
+
+def __add_to_spend_summary(db: Session, user_id: int, sub_id: int, values: Dict) -> None:
+    """
+    Add a new subscription to the spend summary of its user (in the caller's transaction)
+
+    New subs have the highest id, so they only become the next payment if their date is strictly earlier
+    """
+    summary = UserSpendSummaryModel
+    monthly_cost = values["monthly_cost"]
+    category = values["category"]
+    is_earlier = or_(summary.next_payment_date.is_(None), summary.next_payment_date > values["next_payment_date"])
+    db.execute(
+        update(summary)
+        .where(summary.user_id == user_id)
+        # MySQL evaluates SET left to right, next_payment_sub_id must be set while next_payment_date is still old
+        .ordered_values(
+            (summary.next_payment_sub_id, case((is_earlier, sub_id), else_=summary.next_payment_sub_id)),
+            (summary.next_payment_date, case((is_earlier, values["next_payment_date"]), else_=summary.next_payment_date)),
+            (summary.total_monthly_cost, summary.total_monthly_cost + monthly_cost),
+            (summary.sub_count, summary.sub_count + 1),
+            (CATEGORY_MONTHLY_COST_COLUMNS[category], CATEGORY_MONTHLY_COST_COLUMNS[category] + monthly_cost),
+            (CATEGORY_SUB_COUNT_COLUMNS[category], CATEGORY_SUB_COUNT_COLUMNS[category] + 1),
+        )
+    )
+    return None
+
+
+def __remove_from_spend_summary(db: Session, user_id: int, sub: Row) -> None:
+    """
+    Subtract a deleted subscription (row with id, monthly_cost and category) from the spend summary of its user,
+    the next payment is recomputed only if it was the deleted one
+    """
+    summary = UserSpendSummaryModel
+    values = __spend_summary_values(summary.user_id)
+    was_next = summary.next_payment_sub_id == sub.id
+    db.execute(
+        update(summary)
+        .where(summary.user_id == user_id)
+        # MySQL evaluates SET left to right, was_next must be checked before next_payment_sub_id changes
+        .ordered_values(
+            (summary.next_payment_date, case((was_next, values["next_payment_date"]), else_=summary.next_payment_date)),
+            (summary.next_payment_sub_id, case((was_next, values["next_payment_sub_id"]), else_=summary.next_payment_sub_id)),
+            (summary.total_monthly_cost, summary.total_monthly_cost - sub.monthly_cost),
+            (summary.sub_count, summary.sub_count - 1),
+            (CATEGORY_MONTHLY_COST_COLUMNS[sub.category], CATEGORY_MONTHLY_COST_COLUMNS[sub.category] - sub.monthly_cost),
+            (CATEGORY_SUB_COUNT_COLUMNS[sub.category], CATEGORY_SUB_COUNT_COLUMNS[sub.category] - 1),
+        ),
+        execution_options={"synchronize_session": False}
+    )
+    return None
+
+
+def __clear_spend_summary(db: Session, user_id: int) -> None:
+    values = {
+        "total_monthly_cost": 0,
+        "sub_count": 0,
+        "next_payment_date": None,
+        "next_payment_sub_id": None,
+        **{column.key: 0 for column in CATEGORY_MONTHLY_COST_COLUMNS.values()},
+        **{column.key: 0 for column in CATEGORY_SUB_COUNT_COLUMNS.values()},
+    }
+    db.execute(update(UserSpendSummaryModel).where(UserSpendSummaryModel.user_id == user_id).values(values))
+    return None
+
+
+def __refresh_spend_summaries(db: Session, user_ids: Iterable[int], next_payment_only: bool = False) -> None:
+    """
+    Recompute the spend summaries of some users from the sub table with one UPDATE (in the caller's transaction)
+
+    With next_payment_only only the next payment columns are recomputed (e.g. after a rollover)
+    """
+    values = __spend_summary_values(UserSpendSummaryModel.user_id)
+    if next_payment_only:
+        values = {name: values[name] for name in ("next_payment_date", "next_payment_sub_id")}
+    db.execute(
+        update(UserSpendSummaryModel).where(UserSpendSummaryModel.user_id.in_(list(user_ids))).values(values),
+        execution_options={"synchronize_session": False}
+    )
+    return None
+
+
+def __spend_summary_values(user_id_column) -> Dict:
+    """
+    Get correlated subqueries computing every spend summary column of the user in user_id_column
+
+    Returns:
+        Dict: Column name -> scalar subquery
+    """
+    def aggregate(expression, *conditions):
+        return select(expression).where(SubModel.user_id == user_id_column, *conditions).scalar_subquery()
+
+    values = {
+        "total_monthly_cost": aggregate(func.coalesce(func.sum(SubModel.monthly_cost), 0)),
+        "sub_count": aggregate(func.count(SubModel.id)),
+        "next_payment_date": aggregate(func.min(SubModel.next_payment_date)),
+        "next_payment_sub_id": (
+            select(SubModel.id)
+            .where(SubModel.user_id == user_id_column)
+            .order_by(SubModel.next_payment_date.asc(), SubModel.id.asc())
+            .limit(1)
+            .scalar_subquery()
+        ),
+    }
+    for category, column in CATEGORY_MONTHLY_COST_COLUMNS.items():
+        values[column.key] = aggregate(func.coalesce(func.sum(SubModel.monthly_cost), 0), SubModel.category == category)
+    for category, column in CATEGORY_SUB_COUNT_COLUMNS.items():
+        values[column.key] = aggregate(func.count(SubModel.id), SubModel.category == category)
+    return values
+
+#endregion
+
+
+#region Cache (private)
+
+def __on_user_data_changed(user_id: int) -> None:
+    """
+    Drop cached reads (src.cache) of a user after a committed change of their data
+    and read their data from the primary until the replicas have it (src.db.stick_to_primary)
+
+    Args:
+        user_id (int): Unique user id
+
+    Returns:
+        None
+    """
+    cache.invalidate(user_id)
+    stick_to_primary(user_id)
+    return None
+
+
+def __on_user_identity_changed(user_id: int, username: Optional[str] = None) -> None:
+    """
+    Drop identity cache entries (src.identity) of a created, deleted or moved user in every process
+    through the invalidation bus
+
+    Args:
+        user_id (int): Unique user id
+        username (Optional[str]): Username if known, drops a cached miss of the name
+
+    Returns:
+        None
+    """
+    invalidation_bus.publish(user_id, username)
     return None
 
 #endregion
@@ -1,33 +1,669 @@
 #src/db.py
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, Union
 
-from src.models import Base, SubModel, UserModel
+from fastapi import Request
+from sqlalchemy import URL, Engine, create_engine, event, make_url, select, update
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from starlette.concurrency import run_in_threadpool
 
+from src.config import (DATABASE_URL, USE_ASYNC_DB, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+                        DB_POOL_TIMEOUT, DATABASE_REPLICA_URLS, REPLICA_HEALTH_CHECK_INTERVAL,
+                        REPLICA_HEALTH_CHECK_TIMEOUT, READ_YOUR_WRITES_SECONDS, DATABASE_SHARD_URLS,
+                        SHARD_DIRECTORY_CACHE_TTL, CACHE_MAX_USERS)
+from src.constants import SHARD_VIRTUAL_NODES, SUB_ID_BLOCK_SIZE
+from src.metrics import make_instrumented_pool_class
+from src.tracing import instrument_engine
+from src.identity import identity_cache, invalidation_bus
+from src.models import UserDirectoryModel, SubIdSequenceModel
 
-#region sqlite
-# SQLALCHEMY_DATABASE_URL = "sqlite:///test.db"
-# engine = create_engine(
-#     SQLALCHEMY_DATABASE_URL,
-#     connect_args={"check_same_thread": False}  # it's for sqlite only
-# )
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+DbSession = Union[Session, AsyncSession]
+
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def make_engine_kwargs(url: URL, name: str, use_async: bool = False) -> Dict[str, Any]:
+    """
+    Get create_engine() keyword arguments for a database url from the DB_* settings
+
+    Args:
+        url (sqlalchemy.URL): Database url
+        name (str): Engine name used as the pool metrics key
+        use_async (bool): Arguments for create_async_engine()
+
+    Returns:
+        Dict[str, Any]: Keyword arguments
+    """
+    kwargs: Dict[str, Any] = {}
+    if url.get_backend_name() == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # in-memory sqlite lives in a single connection, the default pool handles it
+            return kwargs
+    kwargs.update(
+        poolclass=make_instrumented_pool_class(AsyncAdaptedQueuePool if use_async else QueuePool, name),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return kwargs
+
+
+def make_async_url(url: URL) -> URL:
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def _enable_sqlite_foreign_keys(engine: Engine) -> None:
+    if engine.dialect.name != "sqlite":
+        return None
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    return None
+
+
+SQLALCHEMY_DATABASE_URL = make_url(DATABASE_URL)
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **make_engine_kwargs(SQLALCHEMY_DATABASE_URL, "engine"))
+_enable_sqlite_foreign_keys(engine)
+instrument_engine(engine)
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+#region async
+# USE_ASYNC_DB=1 serves requests from an AsyncSession on an async driver instead of the threadpool
+async_engine = None
+AsyncSessionLocal = None
+if USE_ASYNC_DB:
+    SQLALCHEMY_ASYNC_DATABASE_URL = make_async_url(SQLALCHEMY_DATABASE_URL)
+    async_engine = create_async_engine(
+        SQLALCHEMY_ASYNC_DATABASE_URL,
+        **make_engine_kwargs(SQLALCHEMY_ASYNC_DATABASE_URL, "async_engine", use_async=True)
+    )
+    _enable_sqlite_foreign_keys(async_engine.sync_engine)
+    instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autocommit=False, autoflush=False, expire_on_commit=False)
 #endregion
 
-#region mysql
-SQLALCHEMY_DATABASE_URL = "mysql+mysqlconnector://root:1234@db:3306/subs_db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+#region Read replica engines
+# one engine per DATABASE_REPLICA_URLS entry, async engines with USE_ASYNC_DB=1 (requests then use AsyncSession)
+if DATABASE_REPLICA_URLS and DATABASE_SHARD_URLS:
+    raise RuntimeError("DATABASE_REPLICA_URLS cannot be combined with DATABASE_SHARD_URLS")
+replica_engines: List[Union[Engine, AsyncEngine]] = []
+ReplicaSessionLocals: List[Callable[[], DbSession]] = []
+for _index, _replica_url in enumerate(DATABASE_REPLICA_URLS):
+    _url = make_url(_replica_url)
+    if USE_ASYNC_DB:
+        _url = make_async_url(_url)
+        _replica_engine = create_async_engine(_url, **make_engine_kwargs(_url, f"replica_{_index}", use_async=True))
+        _enable_sqlite_foreign_keys(_replica_engine.sync_engine)
+        instrument_engine(_replica_engine.sync_engine)
+        ReplicaSessionLocals.append(
+            async_sessionmaker(_replica_engine, autocommit=False, autoflush=False, expire_on_commit=False)
+        )
+    else:
+        _replica_engine = create_engine(_url, **make_engine_kwargs(_url, f"replica_{_index}"))
+        _enable_sqlite_foreign_keys(_replica_engine)
+        instrument_engine(_replica_engine)
+        ReplicaSessionLocals.append(sessionmaker(autocommit=False, autoflush=False, bind=_replica_engine))
+    replica_engines.append(_replica_engine)
+
+# replicas start healthy, replica_health_worker() and failed requests update the flags
+replica_health: List[bool] = [True] * len(replica_engines)
+_replica_turn = itertools.count()
+# user id -> monotonic deadline of their read-your-writes window, ordered by deadline,
+# written after commits in threadpool workers and read by every request: guarded by _primary_reads_lock
+_primary_reads_until: "OrderedDict[int, float]" = OrderedDict()
+_primary_reads_lock = threading.Lock()
 #endregion
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+#region Shard engines
+# DATABASE_SHARD_URLS spreads users over several databases, without it DATABASE_URL is the only shard.
+# The user directory (global user ids and shards) always lives in DATABASE_URL
+SHARDED = bool(DATABASE_SHARD_URLS)
+shard_engines: List[Engine] = [engine]
+ShardSessionLocals: List[Callable[[], Session]] = [SessionLocal]
+async_shard_engines: List[AsyncEngine] = [async_engine] if USE_ASYNC_DB else []
+AsyncShardSessionLocals: List[Callable[[], AsyncSession]] = [AsyncSessionLocal] if USE_ASYNC_DB else []
+if SHARDED:
+    shard_engines, ShardSessionLocals, async_shard_engines, AsyncShardSessionLocals = [], [], [], []
+    for _index, _shard_url in enumerate(DATABASE_SHARD_URLS):
+        _url = make_url(_shard_url)
+        if _url == SQLALCHEMY_DATABASE_URL:
+            # the directory database is also a shard, share its engines
+            shard_engines.append(engine)
+            ShardSessionLocals.append(SessionLocal)
+            if USE_ASYNC_DB:
+                async_shard_engines.append(async_engine)
+                AsyncShardSessionLocals.append(AsyncSessionLocal)
+            continue
+        _shard_engine = create_engine(_url, **make_engine_kwargs(_url, f"shard_{_index}"))
+        _enable_sqlite_foreign_keys(_shard_engine)
+        instrument_engine(_shard_engine)
+        shard_engines.append(_shard_engine)
+        ShardSessionLocals.append(sessionmaker(autocommit=False, autoflush=False, bind=_shard_engine))
+        if USE_ASYNC_DB:
+            _async_url = make_async_url(_url)
+            _async_shard_engine = create_async_engine(
+                _async_url, **make_engine_kwargs(_async_url, f"async_shard_{_index}", use_async=True)
+            )
+            _enable_sqlite_foreign_keys(_async_shard_engine.sync_engine)
+            instrument_engine(_async_shard_engine.sync_engine)
+            async_shard_engines.append(_async_shard_engine)
+            AsyncShardSessionLocals.append(
+                async_sessionmaker(_async_shard_engine, autocommit=False, autoflush=False, expire_on_commit=False)
+            )
+#endregion
+
+
+def get_engines() -> Dict[str, Engine]:
+    """
+    Get all sync engines (async engines through their sync_engine) by metrics name
+
+    Returns:
+        Dict[str, sqlalchemy.Engine]: Engines
+    """
+    engines = {"engine": engine}
+    if async_engine is not None:
+        engines["async_engine"] = async_engine.sync_engine
+    for index, replica_engine in enumerate(replica_engines):
+        engines[f"replica_{index}"] = replica_engine.sync_engine if USE_ASYNC_DB else replica_engine
+    if SHARDED:
+        for index, shard_engine in enumerate(shard_engines):
+            if shard_engine is not engine:
+                engines[f"shard_{index}"] = shard_engine
+        for index, async_shard_engine in enumerate(async_shard_engines):
+            if async_shard_engine is not async_engine:
+                engines[f"async_shard_{index}"] = async_shard_engine.sync_engine
+    return engines
+
+
+def _open_sync_connections(count: int) -> None:
+    connections = []
+    try:
+        for _ in range(count):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def _open_async_connection() -> None:
+    async with async_engine.connect():
+        pass
+
+
+async def warm_up_pool(count: int = DB_POOL_SIZE) -> None:
+    """
+    Open `count` connections and return them to the pool, so the first requests do not pay for connecting
+
+    Engines connect lazily, this only runs in the background after startup. Errors are logged, not raised,
+    requests then connect on demand as usual
+
+    Args:
+        count (int): Number of connections to open per engine
+
+    Returns:
+        None
+    """
+    try:
+        await asyncio.to_thread(_open_sync_connections, count)
+        if async_engine is not None:
+            await asyncio.gather(*(_open_async_connection() for _ in range(count)))
+    except Exception:
+        logger.exception("Connection pool warm-up failed")
+    return None
+
+
+#region Shards
+
+def _hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class ShardRouter:
+    """
+    Maps users to shards
+
+    New users are placed by a consistent hash of their name, so adding a shard only changes the placement
+    of about 1/N of the names. The placement is stored in the user directory (UserDirectoryModel), which is
+    the source of truth: moves (src.jobs.rebalance) only update it. Lookups are cached for `ttl` seconds
+    """
+
+    def __init__(
+        self,
+        shard_count: int,
+        directory_session_factory: Optional[Callable[[], Session]],
+        ttl: float = SHARD_DIRECTORY_CACHE_TTL,
+        max_users: int = CACHE_MAX_USERS,
+        virtual_nodes: int = SHARD_VIRTUAL_NODES
+    ) -> None:
+        self.shard_count = shard_count
+        self.directory_session_factory = directory_session_factory
+        self.ttl = ttl
+        self.max_users = max_users
+        points = sorted(
+            (_hash_key(f"shard-{shard}-{node}"), shard) for shard in range(shard_count) for node in range(virtual_nodes)
+        )
+        self._ring_keys = [key for key, _ in points]
+        self._ring_shards = [shard for _, shard in points]
+        # user id -> (shard, monotonic expiry), least recently stored first
+        self._user_shards: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()
+        # lookups run in threadpool workers, forget() in the invalidation listener thread (src.identity)
+        self._lock = threading.Lock()
+        # bumped by forget(), a directory read that started before it is not cached
+        self._generation = 0
+
+    def place(self, username: str) -> int:
+        """Shard of a new user (first ring point clockwise from the hash of the name)"""
+        index = bisect.bisect(self._ring_keys, _hash_key(username)) % len(self._ring_keys)
+        return self._ring_shards[index]
+
+    def get_user_shard(self, user_id: int) -> Optional[int]:
+        """
+        Shard of a user from the directory (0 without shards)
+
+        Returns:
+            Optional[int]: Shard index, None if the user is not in the directory
+        """
+        if self.directory_session_factory is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            cached = self._user_shards.get(user_id)
+            if cached is not None and cached[1] > now:
+                return cached[0]
+            generation = self._generation
+        # the directory is read without the lock
+        db = self.directory_session_factory()
+        try:
+            shard = db.execute(select(UserDirectoryModel.shard).where(UserDirectoryModel.id == user_id)).scalar()
+        finally:
+            db.close()
+        with self._lock:
+            if shard is None:
+                self._user_shards.pop(user_id, None)
+                return None
+            if generation != self._generation:
+                return shard
+            self._user_shards[user_id] = (shard, now + self.ttl)
+            self._user_shards.move_to_end(user_id)
+            while len(self._user_shards) > self.max_users:
+                self._user_shards.popitem(last=False)
+        return shard
+
+    def forget(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            self._user_shards.pop(user_id, None)
+        return None
+
+
+class SubIdAllocator:
+    """
+    Hands out global sub ids with shards, so a sub keeps its id when its user moves to another shard
+
+    Ids are reserved from the directory (SubIdSequenceModel) in blocks of `block_size` and handed out from memory,
+    one directory round trip per block and process. Ids grow within a process, not across processes, and the rest
+    of a block is skipped when the process exits
+    """
+
+    def __init__(
+        self,
+        directory_session_factory: Optional[Callable[[], Session]],
+        block_size: int = SUB_ID_BLOCK_SIZE
+    ) -> None:
+        self.directory_session_factory = directory_session_factory
+        self.block_size = block_size
+        # [next id, end id) of the current block
+        self._next_id = 0
+        self._end_id = 0
+        # creates run in threadpool workers
+        self._lock = threading.Lock()
+
+    def allocate(self, count: int) -> Optional[List[int]]:
+        """
+        Reserve `count` new sub ids
+
+        Returns:
+            Optional[List[int]]: Sub ids, None without shards (the database generates them)
+
+        Raises:
+            RuntimeError: If the sequence row is missing (python -m src.migrations creates it)
+        """
+        if self.directory_session_factory is None:
+            return None
+        sub_ids: List[int] = []
+        with self._lock:
+            while len(sub_ids) < count:
+                if self._next_id >= self._end_id:
+                    self._next_id, self._end_id = self._reserve_block(max(self.block_size, count - len(sub_ids)))
+                taken = min(count - len(sub_ids), self._end_id - self._next_id)
+                sub_ids.extend(range(self._next_id, self._next_id + taken))
+                self._next_id += taken
+        return sub_ids
+
+    def _reserve_block(self, size: int) -> Tuple[int, int]:
+        # the UPDATE locks the row until the commit, concurrent processes get disjoint blocks
+        db = self.directory_session_factory()
+        try:
+            db.execute(
+                update(SubIdSequenceModel)
+                .where(SubIdSequenceModel.id == 1)
+                .values(next_id=SubIdSequenceModel.next_id + size)
+            )
+            end_id = db.execute(select(SubIdSequenceModel.next_id).where(SubIdSequenceModel.id == 1)).scalar()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+        if end_id is None:
+            raise RuntimeError("sub_id_sequence has no row, run python -m src.migrations")
+        return end_id - size, end_id
+
+
+shard_router = ShardRouter(len(shard_engines), SessionLocal if SHARDED else None)
+sub_id_allocator = SubIdAllocator(SessionLocal if SHARDED else None)
+# moves and deletes published by other processes (src.identity) drop the cached shard of the user
+invalidation_bus.subscribe(lambda user_id, username: shard_router.forget(user_id))
+
+
+def get_request_shard(user_id: Optional[int]) -> int:
+    # unknown users are routed to shard 0, user ids are global, so crud reports them as not found there;
+    # users cached as missing (src.identity) skip the directory lookup
+    if user_id is None or not SHARDED or identity_cache.user_exists(user_id) is False:
+        return 0
+    shard = shard_router.get_user_shard(user_id)
+    return 0 if shard is None else shard
+
+
+def open_user_session(user_id: Optional[int]) -> Session:
+    """Sync session on the shard of a user, for jobs and streams that outlive the request session"""
+    return ShardSessionLocals[get_request_shard(user_id)]()
 
 
-def create_db():
-    Base.metadata.create_all(bind=engine)
+def group_user_ids_by_shard(user_ids: Sequence[int]) -> Dict[int, List[int]]:
+    """
+    Group user ids by shard (unknown users are left out), the order of the ids is kept within a shard
 
+    Returns:
+        Dict[int, List[int]]: Shard index -> user ids
+    """
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for user_id in user_ids:
+        shard = shard_router.get_user_shard(user_id)
+        if shard is not None:
+            groups[shard].append(user_id)
+    return groups
 
-def get_db():
-    db = SessionLocal()
+
+def run_on_shards(func: Callable[..., T], *args: Any, **kwargs: Any) -> List[T]:
+    """
+    Run a sync src.crud function on every shard (fleet queries), each with its own session
+
+    Returns:
+        List: Results in shard order
+    """
+    results = []
+    for session_factory in ShardSessionLocals:
+        db = session_factory()
+        try:
+            results.append(func(db, *args, **kwargs))
+        finally:
+            db.close()
+    return results
+
+
+def _run_for_user_shards(func: Callable[..., Any], user_ids: Sequence[int], *args: Any) -> Any:
+    # without known users the function still runs once (on shard 0 with no ids) to get its empty result
+    groups = group_user_ids_by_shard(user_ids) or {0: []}
+    merged = None
+    for shard, shard_user_ids in groups.items():
+        db = ShardSessionLocals[shard]()
+        try:
+            result = func(db, shard_user_ids, *args)
+        finally:
+            db.close()
+        if merged is None:
+            merged = result
+        else:
+            merged.update(result)
+    return merged
+
+
+async def run_db_for_users(db: "DbSession", func: Callable[..., T], user_ids: Sequence[int], *args: Any) -> T:
+    """
+    Run a batch src.crud function (first arguments: session and user ids, returns a dict or set keyed by user id)
+
+    Without shards it runs with the request session like run_db, with shards the user ids are split by shard
+    and the per-shard results are merged
+
+    Args:
+        db (DbSession): Database connection session from get_db
+        func (Callable): Function taking a sync Session and user ids
+        user_ids (Sequence[int]): Unique user ids
+        *args: Further positional arguments for func
+
+    Returns:
+        Result of func over all user ids
+    """
+    if not SHARDED:
+        return await run_db(db, func, user_ids, *args)
+    return await run_in_threadpool(_run_for_user_shards, func, user_ids, *args)
+
+#endregion
+
+
+def _get_request_user_id(request: Request) -> Optional[int]:
+    try:
+        return int(request.query_params["user_id"])
+    except (KeyError, ValueError):
+        return None
+
+
+def get_sync_db(request: Request):
+    # sessions of requests with a user_id query parameter are opened on the shard of that user
+    db = open_user_session(_get_request_user_id(request))
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db(request: Request):
+    shard = await run_in_threadpool(get_request_shard, _get_request_user_id(request)) if SHARDED else 0
+    async with AsyncShardSessionLocals[shard]() as db:
+        yield db
+
+
+get_db = get_async_db if USE_ASYNC_DB else get_sync_db
+
+
+#region Read replicas
+
+def stick_to_primary(user_id: int) -> None:
+    """
+    Send reads of a user to the primary for READ_YOUR_WRITES_SECONDS after their committed write
+
+    The window is kept per process: with several workers a read may still reach a replica,
+    sticky load balancing by user keeps it exact
+
+    Args:
+        user_id (int): Unique user id
+
+    Returns:
+        None
+    """
+    if not replica_engines or READ_YOUR_WRITES_SECONDS <= 0:
+        return None
+    now = time.monotonic()
+    with _primary_reads_lock:
+        _primary_reads_until[user_id] = now + READ_YOUR_WRITES_SECONDS
+        _primary_reads_until.move_to_end(user_id)
+        while _primary_reads_until and next(iter(_primary_reads_until.values())) <= now:
+            _primary_reads_until.popitem(last=False)
+    return None
+
+
+def pick_read_replica(user_id: Optional[int] = None) -> Optional[int]:
+    """
+    Choose the replica for a read: round-robin over the healthy replicas
+
+    Returns:
+        Optional[int]: Replica index, None to read from the primary (no healthy replica or a recent write of the user)
+    """
+    if not replica_engines:
+        return None
+    if user_id is not None:
+        with _primary_reads_lock:
+            primary_reads_until = _primary_reads_until.get(user_id, 0)
+        if primary_reads_until > time.monotonic():
+            return None
+    for _ in range(len(replica_engines)):
+        index = next(_replica_turn) % len(replica_engines)
+        if replica_health[index]:
+            return index
+    return None
+
+
+def _mark_replica_failed(index: int) -> None:
+    if replica_health[index]:
+        logger.warning("Replica %s failed, reads go to the other replicas or the primary", index)
+    replica_health[index] = False
+
+
+def get_sync_read_db(request: Request):
+    index = pick_read_replica(_get_request_user_id(request))
+    db = SessionLocal() if index is None else ReplicaSessionLocals[index]()
+    # run_db retries the reads of a failed replica on the primary
+    db.info["replica_index"] = index
+    try:
+        yield db
+    except (OperationalError, InterfaceError):
+        if index is not None:
+            _mark_replica_failed(index)
+        raise
+    finally:
+        db.close()
+
+
+async def get_async_read_db(request: Request):
+    index = pick_read_replica(_get_request_user_id(request))
+    async with (AsyncSessionLocal() if index is None else ReplicaSessionLocals[index]()) as db:
+        db.info["replica_index"] = index
+        try:
+            yield db
+        except (OperationalError, InterfaceError):
+            if index is not None:
+                _mark_replica_failed(index)
+            raise
+
+
+# read-only routes that tolerate slightly stale data, falls back to the primary like get_db
+# (replicas cannot be combined with shards, get_db routes by shard)
+get_read_db = (get_async_read_db if USE_ASYNC_DB else get_sync_read_db) if replica_engines else get_db
+
+
+def _ping_sync_replica(replica_engine: Engine) -> None:
+    with replica_engine.connect() as connection:
+        connection.exec_driver_sql("SELECT 1")
+
+
+async def _ping_replica(replica_engine: Union[Engine, AsyncEngine]) -> None:
+    if isinstance(replica_engine, AsyncEngine):
+        async with replica_engine.connect() as connection:
+            await connection.exec_driver_sql("SELECT 1")
+    else:
+        await asyncio.to_thread(_ping_sync_replica, replica_engine)
+
+
+async def check_replicas(timeout: float = REPLICA_HEALTH_CHECK_TIMEOUT) -> List[bool]:
+    """
+    Ping every replica (SELECT 1) and update replica_health, state changes are logged
+
+    Args:
+        timeout (float): Seconds to wait for one replica
+
+    Returns:
+        List[bool]: Health of the replicas
+    """
+    async def check(index: int, replica_engine: Union[Engine, AsyncEngine]) -> None:
+        try:
+            await asyncio.wait_for(_ping_replica(replica_engine), timeout)
+        except Exception:
+            _mark_replica_failed(index)
+            return None
+        if not replica_health[index]:
+            logger.info("Replica %s is back", index)
+        replica_health[index] = True
+        return None
+
+    await asyncio.gather(*(check(index, replica_engine) for index, replica_engine in enumerate(replica_engines)))
+    return list(replica_health)
+
+
+async def replica_health_worker(interval: float = REPLICA_HEALTH_CHECK_INTERVAL) -> None:
+    """Check the replicas every `interval` seconds until cancelled"""
+    while True:
+        await check_replicas()
+        await asyncio.sleep(interval)
+
+#endregion
+
+
+async def run_db(db: DbSession, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run a sync src.crud function with a request session without blocking the event loop
+
+    With an AsyncSession the function runs through AsyncSession.run_sync() on the async driver,
+    with a sync Session it runs in the threadpool, so both modes share the same query code.
+    A connection error on a read replica session (get_read_db) marks the replica as failed
+    and runs the function again with a new session on the primary
+
+    Args:
+        db (DbSession): Database connection session from get_db
+        func (Callable): Function taking a sync Session as its first argument
+        *args: Positional arguments for func
+        **kwargs: Keyword arguments for func
+
+    Returns:
+        Result of func
+    """
+    try:
+        if isinstance(db, AsyncSession):
+            return await db.run_sync(func, *args, **kwargs)
+        return await run_in_threadpool(func, db, *args, **kwargs)
+    except (OperationalError, InterfaceError):
+        index = db.info.get("replica_index")
+        if index is None:
+            raise
+        _mark_replica_failed(index)
+    if isinstance(db, AsyncSession):
+        async with AsyncSessionLocal() as primary_db:
+            return await primary_db.run_sync(func, *args, **kwargs)
+    with SessionLocal() as primary_db:
+        return await run_in_threadpool(func, primary_db, *args, **kwargs)
@@ -27,6 +27,38 @@ class SubNameNotUniqueException(Exception):
 class UserHasNoSubsException(Exception):
     pass
 
+
+class InvalidBulkBodyException(Exception):
+    pass
+
+
+class TooManyBulkRowsException(Exception):
+    pass
+
+
+class InvalidDateRangeException(Exception):
+    pass
+
+#endregion
+
+
+#region Pagination
+
+class InvalidCursorException(Exception):
+    pass
+
+#endregion
+
+
+#region Shards
+
+class UserIsOnShardException(Exception):
+    pass
+
+
+class SubIdIsOnShardException(Exception):
+    pass
+
 #endregion
 
 
@@ -41,5 +73,15 @@ class DetailsForHTTPExceptions(StrEnum):
     SubIsNoneException = "Subscription not found"
     SubNameNotUniqueException = "The subscription name should be unique"
     UserHasNoSubsException = "User has no subscriptions"
+    InvalidBulkBodyException = "The body should be a JSON array, NDJSON or CSV with a header row"
+    TooManyBulkRowsException = "Too many subscriptions in one request"
+    InvalidDateRangeException = "The date range should not be reversed or longer than the allowed window"
+
+    # Pagination
+    InvalidCursorException = "Invalid cursor"
+
+    # Shards
+    UserIsOnShardException = "The user already exists on the target shard"
+    SubIdIsOnShardException = "A subscription id of the user is already taken on the target shard"
 
 #endregion
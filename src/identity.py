@@ -0,0 +1,252 @@
+#src/identity.py
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.config import (IDENTITY_CACHE_TTL, IDENTITY_CACHE_NEGATIVE_TTL, IDENTITY_CACHE_MAX_ENTRIES,
+                        INVALIDATION_BACKEND, INVALIDATION_CHANNEL, CACHE_REDIS_URL)
+
+
+logger = logging.getLogger(__name__)
+
+# handler(user_id, username), username is None if the change did not come with a name
+InvalidationHandler = Callable[[int, Optional[str]], None]
+
+
+class IdentityStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def saved_round_trips(self) -> int:
+        # every hit answers an existence or name lookup without a statement
+        return self.hits + self.negative_hits
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "saved_round_trips": self.saved_round_trips,
+        }
+
+
+class IdentityCache:
+    """
+    In-process cache of which user ids and usernames exist
+
+    Entries map a user id to existence and a username to its user id, misses are stored as negative entries
+    with their own (shorter) ttl, so repeated lookups of unknown users do not reach the database.
+    At most max_entries ids and max_entries names are kept, the least recently stored go first
+    """
+
+    def __init__(self, max_entries: int, ttl: float, negative_ttl: float) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stats = IdentityStats()
+        # user id -> (monotonic expiry, exists), username -> (monotonic expiry, user id or None)
+        self._ids: "OrderedDict[int, Tuple[float, bool]]" = OrderedDict()
+        self._names: "OrderedDict[str, Tuple[float, Optional[int]]]" = OrderedDict()
+        # user id -> username of positive name entries, to drop them by id
+        self._names_by_id: Dict[int, str] = {}
+        # lookups run in threadpool workers and in the event loop
+        self._lock = threading.Lock()
+
+    def user_exists(self, user_id: int) -> Optional[bool]:
+        """
+        Returns:
+            Optional[bool]: Cached existence of the user, None if unknown
+        """
+        with self._lock:
+            entry = self._ids.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self.stats.misses += 1
+                return None
+            if entry[1]:
+                self.stats.hits += 1
+            else:
+                self.stats.negative_hits += 1
+            return entry[1]
+
+    def get_user_id(self, username: str) -> Tuple[bool, Optional[int]]:
+        """
+        Returns:
+            Tuple[bool, Optional[int]]: (cached, user id), the user id is None for a cached miss
+        """
+        with self._lock:
+            entry = self._names.get(username)
+            if entry is None or entry[0] < time.monotonic():
+                self.stats.misses += 1
+                return False, None
+            if entry[1] is not None:
+                self.stats.hits += 1
+            else:
+                self.stats.negative_hits += 1
+            return True, entry[1]
+
+    def set_user(self, user_id: int, username: Optional[str] = None) -> None:
+        with self._lock:
+            expires = time.monotonic() + self.ttl
+            self.__store(self._ids, user_id, (expires, True))
+            if username is not None:
+                self.__store(self._names, username, (expires, user_id))
+                self._names_by_id[user_id] = username
+        return None
+
+    def set_missing_user(self, user_id: Optional[int] = None, username: Optional[str] = None) -> None:
+        with self._lock:
+            expires = time.monotonic() + self.negative_ttl
+            if user_id is not None:
+                self.__store(self._ids, user_id, (expires, False))
+            if username is not None:
+                self.__store(self._names, username, (expires, None))
+        return None
+
+    def invalidate(self, user_id: int, username: Optional[str] = None) -> None:
+        with self._lock:
+            dropped = self._ids.pop(user_id, None) is not None
+            for name in (self._names_by_id.pop(user_id, None), username):
+                if name is not None and self._names.pop(name, None) is not None:
+                    dropped = True
+            if dropped:
+                self.stats.invalidations += 1
+        return None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+            self._names_by_id.clear()
+        return None
+
+    def size(self) -> int:
+        return len(self._ids) + len(self._names)
+
+    def __store(self, entries: OrderedDict, key: Any, value: Tuple[float, Any]) -> None:
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.max_entries:
+            evicted_key, (_, evicted_value) = entries.popitem(last=False)
+            if entries is self._names and evicted_value is not None:
+                self._names_by_id.pop(evicted_value, None)
+            self.stats.evictions += 1
+        return None
+
+
+class LocalInvalidationBus:
+    """Invalidation bus of a single process: changes reach the handlers of this process only"""
+
+    def __init__(self) -> None:
+        self._handlers: List[InvalidationHandler] = []
+
+    def subscribe(self, handler: InvalidationHandler) -> None:
+        self._handlers.append(handler)
+        return None
+
+    def publish(self, user_id: int, username: Optional[str] = None) -> None:
+        self._deliver(user_id, username)
+        return None
+
+    def start(self) -> None:
+        return None
+
+    def stop(self) -> None:
+        return None
+
+    def _deliver(self, user_id: int, username: Optional[str]) -> None:
+        for handler in self._handlers:
+            try:
+                handler(user_id, username)
+            except Exception:
+                logger.exception("Invalidation handler failed")
+        return None
+
+
+class RedisInvalidationBus(LocalInvalidationBus):
+    """
+    Invalidation bus on Redis pub/sub: every process (uvicorn workers, jobs) publishes identity changes on one channel,
+    processes that called start() apply the changes of the others in a listener thread
+
+    Handlers of the publishing process run synchronously before the message is sent.
+    Messages lost while a worker is disconnected are covered by the cache ttls
+    """
+
+    def __init__(self, client: Any, channel: str = INVALIDATION_CHANNEL) -> None:
+        super().__init__()
+        self.client = client
+        self.channel = channel
+        # the own messages come back from the channel, they were already delivered
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self._pubsub = None
+        self._thread = None
+
+    def publish(self, user_id: int, username: Optional[str] = None) -> None:
+        self._deliver(user_id, username)
+        try:
+            self.client.publish(
+                self.channel, json.dumps({"origin": self.origin, "user_id": user_id, "username": username})
+            )
+        except Exception:
+            logger.exception("Publishing the invalidation of user %s failed", user_id)
+        return None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return None
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self.channel: self._on_message})
+        self._thread = self._pubsub.run_in_thread(sleep_time=1, daemon=True)
+        return None
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._thread.stop()
+            self._pubsub.close()
+            self._thread = self._pubsub = None
+        return None
+
+    def _on_message(self, message: Dict[str, Any]) -> None:
+        try:
+            data = json.loads(message["data"])
+        except (TypeError, ValueError):
+            logger.warning("Ignored a malformed invalidation message")
+            return None
+        if data.get("origin") != self.origin:
+            self._deliver(int(data["user_id"]), data.get("username"))
+        return None
+
+
+def make_invalidation_bus(backend: str = INVALIDATION_BACKEND):
+    """
+    Create an invalidation bus by name (local or redis)
+
+    Raises:
+        ValueError: Unknown backend
+        RuntimeError: redis backend without the redis package
+    """
+    if backend == "local":
+        return LocalInvalidationBus()
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("INVALIDATION_BACKEND=redis requires the redis package")
+        return RedisInvalidationBus(redis.Redis.from_url(CACHE_REDIS_URL))
+    raise ValueError(f"Unknown invalidation backend: {backend}")
+
+
+identity_cache = IdentityCache(IDENTITY_CACHE_MAX_ENTRIES, IDENTITY_CACHE_TTL, IDENTITY_CACHE_NEGATIVE_TTL)
+invalidation_bus = make_invalidation_bus()
+invalidation_bus.subscribe(identity_cache.invalidate)
@@ -0,0 +1 @@
+#src/jobs/__init__.py
@@ -0,0 +1,113 @@
+#src/jobs/due_scan.py
+import argparse
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import List, Tuple
+
+from src.db import ShardSessionLocals, shard_engines
+from src.crud import iter_due_db_subs
+from src.utils import format_sub_rows
+from src.constants import DUE_SCAN_BATCH_SIZE, DUE_SCAN_DAYS, ExportFormat
+
+
+logger = logging.getLogger(__name__)
+
+
+def split_date_range(start: date, end: date, parts: int) -> List[Tuple[date, date]]:
+    """
+    Split [start, end] into at most `parts` adjacent non-overlapping ranges of (almost) equal length
+
+    Args:
+        start (datetime.date): First day
+        end (datetime.date): Last day
+        parts (int): Number of ranges
+
+    Returns:
+        List[Tuple[datetime.date, datetime.date]]: (first day, last day) of every range in order
+    """
+    days = (end - start).days + 1
+    parts = max(1, min(parts, days))
+    ranges = []
+    first = start
+    for index in range(parts):
+        length = days // parts + (1 if index < days % parts else 0)
+        last = first + timedelta(days=length - 1)
+        ranges.append((first, last))
+        first = last + timedelta(days=1)
+    return ranges
+
+
+def scan_due_range(start: date, end: date, today: date, batch_size: int = DUE_SCAN_BATCH_SIZE, shard: int = 0) -> str:
+    """
+    Scan one date range of one shard and return the due subscriptions as NDJSON
+
+    Every row has exactly one effective payment date, so adjacent ranges never return the same row
+
+    Returns:
+        str: NDJSON lines with user_id and the subscription
+    """
+    db = ShardSessionLocals[shard]()
+    try:
+        rows = (row for batch in iter_due_db_subs(db, start, end, today, batch_size) for row in batch)
+        return "".join(format_sub_rows(rows, ExportFormat.NDJSON, with_user_id=True, today=today))
+    finally:
+        db.close()
+
+
+def _init_worker() -> None:
+    # forked workers must not reuse the parent's pooled connections
+    for shard_engine in shard_engines:
+        shard_engine.dispose(close=False)
+
+
+def run_due_scan(days: int = DUE_SCAN_DAYS, workers: int = 1, batch_size: int = DUE_SCAN_BATCH_SIZE, output=None) -> None:
+    """
+    Write subscriptions of all users due within the next `days` days as NDJSON
+
+    Every shard is scanned for every part of the date range. With workers > 1 the date range is split
+    and the (part, shard) scans run in a process pool, the parts are written in date range order
+
+    Args:
+        days (int): Window length in days from today
+        workers (int): Number of processes
+        batch_size (int): Max number of rows read by one statement
+        output: Text stream, sys.stdout by default
+
+    Returns:
+        None
+    """
+    output = output or sys.stdout
+    today = date.today()
+    ranges = split_date_range(today, today + timedelta(days=days), workers)
+    shards = range(len(ShardSessionLocals))
+    if len(ranges) == 1:
+        for shard in shards:
+            output.write(scan_due_range(*ranges[0], today, batch_size, shard))
+        return None
+    with ProcessPoolExecutor(max_workers=len(ranges), initializer=_init_worker) as pool:
+        futures = [
+            [pool.submit(scan_due_range, start, end, today, batch_size, shard) for shard in shards]
+            for start, end in ranges
+        ]
+        for (start, end), range_futures in zip(ranges, futures):
+            for future in range_futures:
+                output.write(future.result())
+            logger.info("Scanned %s..%s", start, end)
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write subscriptions due soon (all users) as NDJSON")
+    parser.add_argument("--days", type=int, default=DUE_SCAN_DAYS)
+    parser.add_argument("--workers", type=int, default=1, help="split the date range across a process pool")
+    parser.add_argument("--batch-size", type=int, default=DUE_SCAN_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run_due_scan(args.days, args.workers, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#src/jobs/rebalance.py
+import argparse
+import logging
+from typing import List, Optional, Tuple
+
+import src.exceptions as exceptions
+from src.db import SHARDED, SessionLocal, shard_router
+from src.crud import iter_directory_users
+from src.shards import move_user
+
+
+logger = logging.getLogger(__name__)
+
+
+def plan_rebalance(limit: Optional[int] = None) -> List[Tuple[int, int, int]]:
+    """
+    Find users whose shard differs from the placement of their name, e.g. after a shard was added
+
+    Args:
+        limit (Optional[int]): Max number of planned moves
+
+    Returns:
+        List[Tuple[int, int, int]]: (user id, source shard, target shard) in user id order
+    """
+    moves = []
+    db = SessionLocal()
+    try:
+        for entry in iter_directory_users(db):
+            target = shard_router.place(entry.name)
+            if target != entry.shard:
+                moves.append((entry.id, entry.shard, target))
+                if limit is not None and len(moves) >= limit:
+                    break
+    finally:
+        db.close()
+    return moves
+
+
+def run_rebalance(limit: Optional[int] = None, dry_run: bool = False) -> int:
+    """
+    Move users to the shard of their name (src.shards.move_user), one user at a time
+
+    A failed move is logged and skipped, the user stays on their shard
+
+    Args:
+        limit (Optional[int]): Max number of moved users
+        dry_run (bool): Only log the planned moves
+
+    Returns:
+        int: Number of moved users
+    """
+    moved = 0
+    for user_id, source, target in plan_rebalance(limit):
+        if dry_run:
+            logger.info("Would move user %s from shard %s to shard %s", user_id, source, target)
+            continue
+        try:
+            move_user(user_id, target)
+        except (exceptions.UserIsNoneException, exceptions.UserIsOnShardException, exceptions.SubIdIsOnShardException):
+            logger.exception("Moving user %s to shard %s failed", user_id, target)
+            continue
+        moved += 1
+    logger.info("Rebalance finished, %d users moved", moved)
+    return moved
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move users between shards (DATABASE_SHARD_URLS)")
+    parser.add_argument("--user-id", type=int, help="move one user, with --to")
+    parser.add_argument("--to", type=int, help="target shard index of --user-id")
+    parser.add_argument("--all", action="store_true", help="move every user whose shard differs from their placement")
+    parser.add_argument("--limit", type=int, default=None, help="max number of users moved by --all")
+    parser.add_argument("--dry-run", action="store_true", help="only log the moves planned by --all")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not SHARDED:
+        parser.error("DATABASE_SHARD_URLS is not configured")
+    if args.all:
+        run_rebalance(args.limit, args.dry_run)
+    elif args.user_id is not None and args.to is not None:
+        if not 0 <= args.to < shard_router.shard_count:
+            parser.error(f"--to must be a shard index below {shard_router.shard_count}")
+        move_user(args.user_id, args.to)
+    else:
+        parser.error("either --all or --user-id with --to is required")
+
+
+if __name__ == "__main__":
+    main()
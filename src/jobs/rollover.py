@@ -0,0 +1,63 @@
+#src/jobs/rollover.py
+import argparse
+import asyncio
+import logging
+
+from src.db import run_on_shards
+from src.crud import rollover_overdue_subs
+from src.constants import ROLLOVER_BATCH_SIZE, ROLLOVER_INTERVAL_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+
+def run_rollover(batch_size: int = ROLLOVER_BATCH_SIZE) -> int:
+    """
+    Roll over all overdue next_payment_dates once, on every shard
+
+    Args:
+        batch_size (int): Max number of rows updated in one transaction
+
+    Returns:
+        int: Number of updated subscriptions
+    """
+    updated = sum(run_on_shards(rollover_overdue_subs, batch_size=batch_size))
+    logger.info("Rollover finished, %d subscriptions updated", updated)
+    return updated
+
+
+async def rollover_worker(interval: float = ROLLOVER_INTERVAL_SECONDS, batch_size: int = ROLLOVER_BATCH_SIZE) -> None:
+    """
+    Run the rollover job every `interval` seconds until cancelled
+
+    Args:
+        interval (float): Delay between two runs in seconds
+        batch_size (int): Max number of rows updated in one transaction
+
+    Returns:
+        None
+    """
+    while True:
+        try:
+            await asyncio.to_thread(run_rollover, batch_size)
+        except Exception:
+            logger.exception("Rollover failed")
+        await asyncio.sleep(interval)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Roll over overdue subscription payment dates")
+    parser.add_argument("--batch-size", type=int, default=ROLLOVER_BATCH_SIZE)
+    parser.add_argument("--loop", action="store_true", help="keep running every --interval seconds")
+    parser.add_argument("--interval", type=float, default=ROLLOVER_INTERVAL_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.loop:
+        asyncio.run(rollover_worker(args.interval, args.batch_size))
+    else:
+        run_rollover(args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
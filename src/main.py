@@ -1,16 +1,79 @@
 #src/main.py
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
+from fastapi import FastAPI, Request
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from src.api import main_router
-from src.db import create_db
+from src.config import MIGRATE_ON_STARTUP, DB_POOL_WARMUP, ROLLOVER_ON_STARTUP, GZIP_MINIMUM_SIZE
+from src.db import async_engine, async_shard_engines, replica_engines, warm_up_pool, replica_health_worker
+from src.migrations import upgrade_all
+from src.identity import invalidation_bus
+from src.jobs.rollover import rollover_worker
+from src.metrics import http_metrics, exception_metrics
+from src.responses import ORJSONResponse
+from src.tracing import RequestStatsMiddleware
 
 
 GLOBAL_TAGS = [
     {"name": "subs"},
-    {"name": "user"}
+    {"name": "user"},
+    {"name": "metrics"},
+    {"name": "admin"},
+    {"name": "batch"}
 ]
 
-app = FastAPI(global_tags=GLOBAL_TAGS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the schema is managed by `python -m src.migrations`, importing the app never touches the database
+    if MIGRATE_ON_STARTUP:
+        await asyncio.to_thread(upgrade_all)
+    # identity changes published by other workers and jobs (src.identity)
+    invalidation_bus.start()
+    background_tasks = []
+    if ROLLOVER_ON_STARTUP:
+        background_tasks.append(asyncio.create_task(rollover_worker()))
+    if DB_POOL_WARMUP:
+        background_tasks.append(asyncio.create_task(warm_up_pool()))
+    if replica_engines:
+        background_tasks.append(asyncio.create_task(replica_health_worker()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+    for task in background_tasks:
+        with suppress(asyncio.CancelledError):
+            await task
+    invalidation_bus.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    for replica_engine in replica_engines:
+        if isinstance(replica_engine, AsyncEngine):
+            await replica_engine.dispose()
+    for async_shard_engine in async_shard_engines:
+        if async_shard_engine is not async_engine:
+            await async_shard_engine.dispose()
+
+
+app = FastAPI(global_tags=GLOBAL_TAGS, lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(main_router)
+app.add_middleware(RequestStatsMiddleware)
+if GZIP_MINIMUM_SIZE:
+    # outermost: Server-Timing and the request log measure the uncompressed response
+    app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE)
+
+for route in app.routes:
+    if isinstance(route, APIRoute):
+        http_metrics.register(route.path, route.methods)
+
 
-create_db()
+@app.exception_handler(StarletteHTTPException)
+async def count_http_exception(request: Request, exc: StarletteHTTPException):
+    # routes raise HTTPException with a DetailsForHTTPExceptions detail, which names the domain exception
+    exception_metrics.observe_detail(exc.detail)
+    return await http_exception_handler(request, exc)
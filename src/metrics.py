@@ -0,0 +1,265 @@
+#src/metrics.py
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Sequence, Tuple, Type
+
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy import Engine
+from sqlalchemy.pool import Pool
+
+from src.exceptions import DetailsForHTTPExceptions
+from src.identity import identity_cache
+
+
+class PoolMetrics:
+    """Checkout statistics of a connection pool"""
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.checkout_seconds_total = 0.0
+        self.checkout_seconds_max = 0.0
+        # sync sessions check out connections in threadpool workers, += is not atomic across threads
+        self._lock = threading.Lock()
+
+    def observe_checkout(self, seconds: float, overflow: bool) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds_total += seconds
+            if seconds > self.checkout_seconds_max:
+                self.checkout_seconds_max = seconds
+            if overflow:
+                self.overflow_checkouts += 1
+
+    def observe_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self, pool: Pool) -> Dict:
+        with self._lock:
+            counters = {
+                "checkouts": self.checkouts,
+                "overflow_checkouts": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "checkout_ms_avg": self.checkout_seconds_total * 1000 / self.checkouts if self.checkouts else 0.0,
+                "checkout_ms_max": self.checkout_seconds_max * 1000,
+            }
+        return {
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            **counters,
+        }
+
+
+# engine name -> metrics of its pool
+pool_metrics: Dict[str, PoolMetrics] = {}
+
+
+def make_instrumented_pool_class(pool_class: Type[Pool], name: str) -> Type[Pool]:
+    """
+    Subclass a QueuePool-like class so every checkout is timed into pool_metrics[name]
+
+    Args:
+        pool_class (Type[sqlalchemy.pool.Pool]): QueuePool or AsyncAdaptedQueuePool
+        name (str): Engine name used as the metrics key
+
+    Returns:
+        Type[sqlalchemy.pool.Pool]: Instrumented pool class
+    """
+    metrics = pool_metrics.setdefault(name, PoolMetrics())
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = pool_class.connect(self)
+        except PoolTimeoutError:
+            metrics.observe_timeout()
+            raise
+        metrics.observe_checkout(time.perf_counter() - started, self.overflow() > 0)
+        return connection
+
+    return type(f"Instrumented{pool_class.__name__}", (pool_class,), {"connect": connect})
+
+
+#region Prometheus
+# Request metrics are updated only from the event loop (RequestStatsMiddleware and exception handlers),
+# so plain int/float fields are enough and no locks are taken on the hot path.
+# Pool metrics are not: checkouts run in threadpool workers, PoolMetrics takes its own lock
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+UNMATCHED_ROUTE = "unmatched"
+
+
+class Histogram:
+    """Fixed-bucket histogram, bucket counts are stored non-cumulative and summed on export"""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        buckets = []
+        total = 0
+        for bound, count in zip((*map(str, self.bounds), "+Inf"), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class RouteMetrics:
+    """Request duration, DB time and status classes of one route and method"""
+
+    def __init__(self) -> None:
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.db_duration = Histogram(DB_DURATION_BUCKETS)
+        self.statements = 0
+        self.status_classes = [0] * 6  # index = status // 100
+
+    def observe(self, status: int, seconds: float, db_seconds: float, statements: int) -> None:
+        self.duration.observe(seconds)
+        self.db_duration.observe(db_seconds)
+        self.statements += statements
+        self.status_classes[status // 100 if 0 < status < 600 else 5] += 1
+
+
+class HTTPMetrics:
+    """Per-route request metrics keyed by route path template and method"""
+
+    def __init__(self) -> None:
+        self.routes: Dict[str, Dict[str, RouteMetrics]] = {}
+
+    def register(self, path: str, methods: Iterable[str]) -> None:
+        by_method = self.routes.setdefault(path, {})
+        for method in methods:
+            by_method.setdefault(method, RouteMetrics())
+
+    def observe(self, path: str, method: str, status: int, seconds: float, db_seconds: float,
+                statements: int) -> None:
+        by_method = self.routes.get(path)
+        route_metrics = by_method.get(method) if by_method is not None else None
+        if route_metrics is None:
+            # routes are registered at startup, this only happens for the first unmatched request of a method
+            self.register(path, (method,))
+            route_metrics = self.routes[path][method]
+        route_metrics.observe(status, seconds, db_seconds, statements)
+
+
+class ExceptionMetrics:
+    """Counters of domain exceptions (by DetailsForHTTPExceptions name) and unhandled exceptions"""
+
+    def __init__(self, details: Iterable) -> None:
+        self.names_by_detail: Dict[str, str] = {detail.value: detail.name for detail in details}
+        self.counts: Dict[str, int] = dict.fromkeys(self.names_by_detail.values(), 0)
+
+    def observe_detail(self, detail: object) -> None:
+        name = self.names_by_detail.get(detail) if isinstance(detail, str) else None
+        if name is not None:
+            self.counts[name] += 1
+
+    def observe_unhandled(self, exc: BaseException) -> None:
+        name = type(exc).__name__
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+http_metrics = HTTPMetrics()
+exception_metrics = ExceptionMetrics(DetailsForHTTPExceptions)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _render_histogram(lines: List[str], name: str, labels: str, histogram: Histogram) -> None:
+    for bound, count in histogram.cumulative():
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {sum(histogram.counts)}")
+
+
+def render_prometheus(engines: Dict[str, Engine]) -> str:
+    """
+    Render all metrics in the Prometheus text exposition format (version 0.0.4)
+
+    Args:
+        engines (Dict[str, sqlalchemy.Engine]): Engines by pool metrics name (src.db.get_engines())
+
+    Returns:
+        str: Metrics text
+    """
+    lines: List[str] = []
+    routes = [
+        (f'method="{method}",route="{_escape_label(path)}"', route_metrics)
+        for path, by_method in sorted(http_metrics.routes.items())
+        for method, route_metrics in sorted(by_method.items())
+    ]
+
+    lines.append("# HELP http_request_duration_seconds Request duration by route")
+    lines.append("# TYPE http_request_duration_seconds histogram")
+    for labels, route_metrics in routes:
+        _render_histogram(lines, "http_request_duration_seconds", labels, route_metrics.duration)
+
+    lines.append("# HELP http_request_db_duration_seconds Time spent in SQL statements per request by route")
+    lines.append("# TYPE http_request_db_duration_seconds histogram")
+    for labels, route_metrics in routes:
+        _render_histogram(lines, "http_request_db_duration_seconds", labels, route_metrics.db_duration)
+
+    lines.append("# HELP http_request_db_statements_total SQL statements executed by route")
+    lines.append("# TYPE http_request_db_statements_total counter")
+    for labels, route_metrics in routes:
+        lines.append(f"http_request_db_statements_total{{{labels}}} {route_metrics.statements}")
+
+    lines.append("# HELP http_responses_total Responses by route and status class")
+    lines.append("# TYPE http_responses_total counter")
+    for labels, route_metrics in routes:
+        for status_class, count in enumerate(route_metrics.status_classes):
+            if count:
+                lines.append(f'http_responses_total{{{labels},status="{status_class}xx"}} {count}')
+
+    lines.append("# HELP app_exceptions_total Domain exceptions returned as HTTP errors and unhandled exceptions")
+    lines.append("# TYPE app_exceptions_total counter")
+    for name, count in sorted(exception_metrics.counts.items()):
+        lines.append(f'app_exceptions_total{{exception="{_escape_label(name)}"}} {count}')
+
+    lines.append("# HELP identity_cache_lookups_total User existence and name lookups by identity cache result")
+    lines.append("# TYPE identity_cache_lookups_total counter")
+    identity_stats = identity_cache.stats
+    for result, count in (("hit", identity_stats.hits), ("negative_hit", identity_stats.negative_hits),
+                          ("miss", identity_stats.misses)):
+        lines.append(f'identity_cache_lookups_total{{result="{result}"}} {count}')
+    lines.append("# HELP identity_cache_saved_round_trips_total Database round trips saved by the identity cache")
+    lines.append("# TYPE identity_cache_saved_round_trips_total counter")
+    lines.append(f"identity_cache_saved_round_trips_total {identity_stats.saved_round_trips}")
+
+    pools = [(name, engine.pool, pool_metrics[name]) for name, engine in engines.items() if name in pool_metrics]
+    gauges = (
+        ("db_pool_size", "gauge", "Configured pool size", lambda pool, metrics: pool.size()),
+        ("db_pool_checked_out", "gauge", "Connections in use", lambda pool, metrics: pool.checkedout()),
+        ("db_pool_checked_in", "gauge", "Idle connections in the pool", lambda pool, metrics: pool.checkedin()),
+        ("db_pool_overflow", "gauge", "Current overflow (negative while below pool size)",
+         lambda pool, metrics: pool.overflow()),
+        ("db_pool_checkouts_total", "counter", "Connection checkouts", lambda pool, metrics: metrics.checkouts),
+        ("db_pool_overflow_checkouts_total", "counter", "Checkouts served by overflow connections",
+         lambda pool, metrics: metrics.overflow_checkouts),
+        ("db_pool_timeouts_total", "counter", "Checkouts that timed out", lambda pool, metrics: metrics.timeouts),
+        ("db_pool_checkout_seconds_total", "counter", "Time spent waiting for connections",
+         lambda pool, metrics: metrics.checkout_seconds_total),
+    )
+    for name, kind, help_text, value in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for engine_name, pool, metrics in pools:
+            lines.append(f'{name}{{engine="{engine_name}"}} {value(pool, metrics)}')
+
+    return "\n".join(lines) + "\n"
+
+#endregion
@@ -0,0 +1,244 @@
+#src/migrations.py
+import argparse
+import logging
+from decimal import Decimal
+from typing import Dict, List, Set
+
+from sqlalchemy import Engine, Numeric, case, inspect, func, insert, literal, select, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+
+from src.db import SHARDED, engine, shard_engines
+from src.models import Base, SubModel, UserSpendSummaryModel, SubIdSequenceModel
+from src.billing import MONTHLY_COST_RATIOS
+from src.crud import rebuild_user_spend_summaries
+
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade(engine: Engine) -> None:
+    """
+    Bring an existing database up to date with src.models (idempotent)
+
+    Creates missing tables, columns (with their server defaults) and indexes, existing objects are left untouched.
+    A newly added sub.monthly_cost column is backfilled from cost and the billing columns,
+    a newly added sub.billing_anchor_date from next_payment_date,
+    a newly created user_spend_summary table (or one outdated by that backfill) is rebuilt
+
+    Args:
+        engine (sqlalchemy.Engine): Database engine
+
+    Returns:
+        None
+
+    Raises:
+        RuntimeError: If existing rows violate a unique index that has to be created
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    Base.metadata.create_all(bind=engine)
+    added_columns = __add_missing_columns(engine)
+    rebuild_summaries = UserSpendSummaryModel.__tablename__ not in existing_tables
+    if "monthly_cost" in added_columns.get(SubModel.__tablename__, ()):
+        rebuild_monthly_costs(engine)
+        rebuild_summaries = True
+    if "billing_anchor_date" in added_columns.get(SubModel.__tablename__, ()):
+        backfill_billing_anchor_dates(engine)
+    if rebuild_summaries:
+        rebuild_spend_summaries(engine)
+    __create_missing_indexes(engine)
+    return None
+
+
+def get_schema_engines() -> List[Engine]:
+    """
+    Get the engines of all databases with the schema: DATABASE_URL (user directory) and every shard, without duplicates
+
+    Returns:
+        List[sqlalchemy.Engine]: Engines
+    """
+    engines = [engine]
+    for shard_engine in shard_engines:
+        if shard_engine not in engines:
+            engines.append(shard_engine)
+    return engines
+
+
+def upgrade_all() -> None:
+    """Upgrade every database from get_schema_engines(), then seed the global sub id sequence with shards"""
+    for schema_engine in get_schema_engines():
+        upgrade(schema_engine)
+    if SHARDED:
+        seed_sub_id_sequence()
+    return None
+
+
+def seed_sub_id_sequence() -> int:
+    """
+    Move the global sub id sequence (SubIdSequenceModel in DATABASE_URL) past every sub id on the shards (idempotent)
+
+    Creates its row on the first sharded run. Subs created before, with ids generated per shard, keep their ids;
+    if two shards used the same id, moving one of these users fails (exceptions.SubIdIsOnShardException)
+
+    Returns:
+        int: Next sub id
+    """
+    max_sub_id = 0
+    for schema_engine in get_schema_engines():
+        with schema_engine.connect() as conn:
+            max_sub_id = max(max_sub_id, conn.execute(select(func.max(SubModel.id))).scalar() or 0)
+    with engine.begin() as conn:
+        next_id = conn.execute(select(SubIdSequenceModel.next_id).where(SubIdSequenceModel.id == 1)).scalar()
+        if next_id is None:
+            next_id = max_sub_id + 1
+            conn.execute(insert(SubIdSequenceModel).values(id=1, next_id=next_id))
+        elif next_id <= max_sub_id:
+            next_id = max_sub_id + 1
+            conn.execute(update(SubIdSequenceModel).where(SubIdSequenceModel.id == 1).values(next_id=next_id))
+    return next_id
+
+
+def rebuild_spend_summaries(engine: Engine) -> int:
+    """
+    Recompute the user_spend_summary rows of all users (src.crud.rebuild_user_spend_summaries)
+
+    Args:
+        engine (sqlalchemy.Engine): Database engine
+
+    Returns:
+        int: Number of rebuilt summaries
+    """
+    with Session(engine) as db:
+        rebuilt = rebuild_user_spend_summaries(db)
+    logger.info("Rebuilt spend summaries of %d users", rebuilt)
+    return rebuilt
+
+
+def rebuild_monthly_costs(engine: Engine, batch_size: int = 10000) -> int:
+    """
+    Recompute sub.monthly_cost of all rows (src.billing.count_monthly_cost in SQL), in id-range batches
+
+    Args:
+        engine (sqlalchemy.Engine): Database engine
+        batch_size (int): Width of the id range updated in one transaction
+
+    Returns:
+        int: Number of updated rows
+    """
+    ratio_type = Numeric(precision=16, scale=6)
+    numerator = case(
+        {period: literal(Decimal(ratio[0]), ratio_type) for period, ratio in MONTHLY_COST_RATIOS.items()},
+        value=SubModel.billing_period
+    )
+    denominator = case(
+        {period: literal(Decimal(ratio[1]), ratio_type) for period, ratio in MONTHLY_COST_RATIOS.items()},
+        value=SubModel.billing_period
+    )
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(SubModel.id))).scalar() or 0
+    updated = 0
+    for first_id in range(0, max_id, batch_size):
+        with engine.begin() as conn:
+            result = conn.execute(
+                update(SubModel)
+                .where(SubModel.id > first_id, SubModel.id <= first_id + batch_size)
+                .values(monthly_cost=SubModel.cost * numerator / (denominator * SubModel.billing_interval))
+            )
+        updated += result.rowcount
+    logger.info("Recomputed monthly_cost of %d subscriptions", updated)
+    return updated
+
+
+def backfill_billing_anchor_dates(engine: Engine, batch_size: int = 10000) -> int:
+    """
+    Set the missing sub.billing_anchor_date values to next_payment_date, in id-range batches
+
+    The stored payment date is the best known anchor of rows created before the column existed
+
+    Args:
+        engine (sqlalchemy.Engine): Database engine
+        batch_size (int): Width of the id range updated in one transaction
+
+    Returns:
+        int: Number of updated rows
+    """
+    with engine.connect() as conn:
+        max_id = conn.execute(select(func.max(SubModel.id))).scalar() or 0
+    updated = 0
+    for first_id in range(0, max_id, batch_size):
+        with engine.begin() as conn:
+            result = conn.execute(
+                update(SubModel)
+                .where(SubModel.id > first_id, SubModel.id <= first_id + batch_size,
+                       SubModel.billing_anchor_date.is_(None))
+                .values(billing_anchor_date=SubModel.next_payment_date)
+            )
+        updated += result.rowcount
+    logger.info("Backfilled billing_anchor_date of %d subscriptions", updated)
+    return updated
+
+
+def __add_missing_columns(engine: Engine) -> Dict[str, Set[str]]:
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    added: Dict[str, Set[str]] = {}
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_spec = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {column_spec}"))
+                added.setdefault(table.name, set()).add(column.name)
+                logger.info("Added column %s.%s", table.name, column.name)
+    return added
+
+
+def __create_missing_indexes(engine: Engine) -> None:
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            if index.name == "ix_sub_user_id_name":
+                __check_sub_names_are_unique(engine)
+            index.create(bind=engine)
+            logger.info("Created index %s on %s", index.name, table.name)
+    return None
+
+
+def __check_sub_names_are_unique(engine: Engine) -> None:
+    query = (
+        select(SubModel.user_id, SubModel.name, func.count().label("count"))
+        .group_by(SubModel.user_id, SubModel.name)
+        .having(func.count() > 1)
+    )
+    with engine.connect() as conn:
+        duplicates = conn.execute(query).all()
+    if duplicates:
+        details = ", ".join(f"user_id={row.user_id} name={row.name!r} ({row.count})" for row in duplicates)
+        raise RuntimeError(f"Duplicate subscription names must be resolved before migrating: {details}")
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create or upgrade the database schema")
+    parser.add_argument("--rebuild-monthly-costs", action="store_true",
+                        help="recompute sub.monthly_cost of all rows after upgrading")
+    parser.add_argument("--rebuild-spend-summaries", action="store_true",
+                        help="recompute user_spend_summary of all users after upgrading (reconciles drift)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade_all()
+    for schema_engine in get_schema_engines():
+        if args.rebuild_monthly_costs:
+            rebuild_monthly_costs(schema_engine)
+        if args.rebuild_monthly_costs or args.rebuild_spend_summaries:
+            rebuild_spend_summaries(schema_engine)
+
+
+if __name__ == "__main__":
+    main()
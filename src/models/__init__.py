@@ -1,4 +1,7 @@
 #src/models/__init__.py
 from src.models.base import Base
-from src.models.sub import SubModel
+from src.models.sub import SubModel, SUB_COLUMNS
 from src.models.user import UserModel
+from src.models.spend_summary import UserSpendSummaryModel, CATEGORY_MONTHLY_COST_COLUMNS, CATEGORY_SUB_COUNT_COLUMNS
+from src.models.user_directory import UserDirectoryModel
+from src.models.sub_id_sequence import SubIdSequenceModel
@@ -0,0 +1,33 @@
+#src/models/spend_summary.py
+from sqlalchemy import Column, Integer, Numeric, Date, ForeignKey
+
+from src.models import Base
+from src.constants import Category
+
+
+class UserSpendSummaryModel(Base):
+    """Per-user rollup of the sub table, maintained by src.crud in the same transaction as the subs"""
+    __tablename__ = "user_spend_summary"
+
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), primary_key=True)
+    total_monthly_cost = Column(Numeric(precision=16, scale=6), default=0, server_default="0", nullable=False)
+    sub_count = Column(Integer, default=0, server_default="0", nullable=False)
+    # earliest stored next_payment_date and its sub (lowest id on ties), NULL without subs
+    next_payment_date = Column(Date, nullable=True)
+    next_payment_sub_id = Column(Integer, nullable=True)
+
+    # per category, see CATEGORY_MONTHLY_COST_COLUMNS and CATEGORY_SUB_COUNT_COLUMNS
+    work_monthly_cost = Column(Numeric(precision=16, scale=6), default=0, server_default="0", nullable=False)
+    work_sub_count = Column(Integer, default=0, server_default="0", nullable=False)
+    entertainment_monthly_cost = Column(Numeric(precision=16, scale=6), default=0, server_default="0", nullable=False)
+    entertainment_sub_count = Column(Integer, default=0, server_default="0", nullable=False)
+    other_monthly_cost = Column(Numeric(precision=16, scale=6), default=0, server_default="0", nullable=False)
+    other_sub_count = Column(Integer, default=0, server_default="0", nullable=False)
+
+
+CATEGORY_MONTHLY_COST_COLUMNS = {
+    category: getattr(UserSpendSummaryModel, f"{category.value.lower()}_monthly_cost") for category in Category
+}
+CATEGORY_SUB_COUNT_COLUMNS = {
+    category: getattr(UserSpendSummaryModel, f"{category.value.lower()}_sub_count") for category in Category
+}
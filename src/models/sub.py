@@ -1,19 +1,44 @@
 #src/models/sub.py
-from sqlalchemy import Column, Integer, String, Numeric, Date, ForeignKey, Enum as SqlEnum
+from sqlalchemy import Column, Integer, String, Numeric, Date, ForeignKey, Index, Enum as SqlEnum
 from sqlalchemy.orm import relationship
 
 from src.models import Base
-from src.constants import Category
+from src.constants import Category, BillingPeriod
 
 
 class SubModel(Base):
     __tablename__ = "sub"
+    __table_args__ = (
+        # leftmost prefix also serves lookups by user_id alone (and the user_id foreign key)
+        Index("ix_sub_user_id_name", "user_id", "name", unique=True),
+        Index("ix_sub_user_id_next_payment_date", "user_id", "next_payment_date"),
+        # fleet-wide due-window scans (src.crud.iter_due_db_subs), keyset order (next_payment_date, id)
+        Index("ix_sub_next_payment_date_id", "next_payment_date", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(63), nullable=False)
     cost = Column(Numeric(precision=10, scale=2), nullable=False)
     next_payment_date = Column(Date, nullable=False)
+    # first payment date, payment dates are always rolled from it so the billing day-of-month is kept
+    # (the rollover only moves next_payment_date), NULL only on rows not backfilled by src.migrations yet
+    billing_anchor_date = Column(Date, nullable=True)
     category = Column(SqlEnum(Category, native_enum=False), default=Category.OTHER, nullable=False)
+    billing_period = Column(
+        SqlEnum(BillingPeriod, native_enum=False), default=BillingPeriod.MONTH, server_default=BillingPeriod.MONTH.value,
+        nullable=False
+    )
+    billing_interval = Column(Integer, default=1, server_default="1", nullable=False)
+    # cost normalized to one month (src.billing.count_monthly_cost), kept up to date on every write
+    monthly_cost = Column(Numeric(precision=16, scale=6), server_default="0", nullable=False)
 
     user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"))
     user = relationship("UserModel", back_populates="subs")
+
+
+# columns of a subscription as sent by the API (and the billing anchor to roll next_payment_date),
+# reads select rows of them instead of loading SubModel entities
+SUB_COLUMNS = (
+    SubModel.id, SubModel.name, SubModel.cost, SubModel.next_payment_date, SubModel.category,
+    SubModel.billing_period, SubModel.billing_interval, SubModel.billing_anchor_date
+)
@@ -0,0 +1,16 @@
+#src/models/sub_id_sequence.py
+from sqlalchemy import Column, Integer
+
+from src.models import Base
+
+
+class SubIdSequenceModel(Base):
+    """
+    Next free global sub id (a single row with id 1), only used in DATABASE_URL with DATABASE_SHARD_URLS
+
+    src.db.SubIdAllocator reserves sub ids from it in blocks, so sub ids are unique across shards
+    """
+    __tablename__ = "sub_id_sequence"
+
+    id = Column(Integer, primary_key=True)
+    next_id = Column(Integer, nullable=False)
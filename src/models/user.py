@@ -10,5 +10,8 @@ class UserModel(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(31), nullable=False, unique=True)
+    # bumped in the transaction of every change of the user's subs, conditional GETs compare it (ETag)
+    data_version = Column(Integer, default=0, server_default="0", nullable=False)
 
-    subs = relationship("SubModel", back_populates="user", cascade="all, delete-orphan")
+    # subs are removed by the ON DELETE CASCADE foreign key, the ORM does not load them to delete
+    subs = relationship("SubModel", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
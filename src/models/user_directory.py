@@ -0,0 +1,13 @@
+#src/models/user_directory.py
+from sqlalchemy import Column, Integer, String
+
+from src.models import Base
+
+
+class UserDirectoryModel(Base):
+    """Global user ids and the shard of every user (src.db.ShardRouter), only used with DATABASE_SHARD_URLS"""
+    __tablename__ = "user_directory"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(31), nullable=False, unique=True)
+    shard = Column(Integer, nullable=False)
@@ -0,0 +1,36 @@
+#src/responses.py
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+
+def _default(value: Any) -> Any:
+    # Decimal costs and amounts are written as JSON numbers like the other costs
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered by orjson (dates, enums and Decimal included), the default response class of the app
+
+    Routes return it directly when the content is built from trusted db rows:
+    FastAPI does not validate a returned Response, response_model then only documents the route
+    """
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class TypeAdapterResponse(JSONResponse):
+    """JSON response of pydantic models serialized in one pass by a TypeAdapter (models may be built with model_construct)"""
+    def __init__(self, adapter: TypeAdapter, content: Any, exclude_none: bool = False, **kwargs) -> None:
+        self.adapter = adapter
+        self.exclude_none = exclude_none
+        super().__init__(content, **kwargs)
+
+    def render(self, content: Any) -> bytes:
+        return self.adapter.dump_json(content, exclude_none=self.exclude_none)
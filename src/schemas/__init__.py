@@ -1,4 +1,6 @@
 #src/schemas/__init__.py
 from src.schemas.other import Ok
-from src.schemas.sub import Sub, NewSub, AmountResponse
+from src.schemas.sub import Sub, SubProjection, NewSub, AmountResponse, BulkImportError, BulkImportReport
 from src.schemas.user import User, NewUser
+from src.schemas.metrics import PoolStats, CacheStats, IdentityCacheStats
+from src.schemas.batch import UserIdsBatch, UserAmount, UserNextPayment
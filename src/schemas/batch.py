@@ -0,0 +1,26 @@
+#src/schemas/batch.py
+from typing import Annotated, List, Optional
+
+from pydantic import BaseModel, Field
+
+from src.schemas.sub import Sub, Amount
+from src.constants import MIN_MONTH_COUNT, MAX_BATCH_USERS
+
+
+class UserIdsBatch(BaseModel):
+    user_ids: Annotated[List[int], Field(min_length=1, max_length=MAX_BATCH_USERS)]
+
+
+class UserAmount(BaseModel):
+    """Amount of one user of a batch, detail is set instead of amount if it cannot be counted"""
+    user_id: int
+    month_count: Annotated[int, Field(ge=MIN_MONTH_COUNT)]
+    amount: Optional[Amount] = None
+    detail: Optional[str] = None
+
+
+class UserNextPayment(BaseModel):
+    """Next payment of one user of a batch, detail is set instead of sub if there is none"""
+    user_id: int
+    sub: Optional[Sub] = None
+    detail: Optional[str] = None
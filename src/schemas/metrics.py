@@ -0,0 +1,34 @@
+#src/schemas/metrics.py
+from pydantic import BaseModel
+
+
+class PoolStats(BaseModel):
+    pool_size: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    checkouts: int
+    overflow_checkouts: int
+    timeouts: int
+    checkout_ms_avg: float
+    checkout_ms_max: float
+
+
+class CacheStats(BaseModel):
+    backend: str
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+
+class IdentityCacheStats(BaseModel):
+    backend: str
+    size: int
+    hits: int
+    negative_hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    saved_round_trips: int
@@ -1,11 +1,13 @@
 #src/schemas/sub.py
-from typing import Annotated
+from typing import Annotated, Dict, List, Optional
 from datetime import date
+from decimal import Decimal
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, PlainSerializer, field_validator
 from pydantic.types import StringConstraints
 
-from src.constants import MIN_SUB_NAME_LENGTH, MAX_SUB_NAME_LENGTH, MIN_SUB_COST, MIN_MONTH_COUNT, Category
+from src.constants import (MIN_SUB_NAME_LENGTH, MAX_SUB_NAME_LENGTH, MIN_SUB_COST, MIN_MONTH_COUNT, MIN_BILLING_INTERVAL,
+                           MAX_BILLING_INTERVAL, Category, BillingPeriod)
 
 
 class Sub(BaseModel):
@@ -14,6 +16,19 @@ class Sub(BaseModel):
     cost: Annotated[float, Field(ge=MIN_SUB_COST)]
     next_payment_date: date
     category: Category = Category.OTHER
+    billing_period: BillingPeriod = BillingPeriod.MONTH
+    billing_interval: Annotated[int, Field(ge=MIN_BILLING_INTERVAL, le=MAX_BILLING_INTERVAL)] = 1
+
+
+class SubProjection(BaseModel):
+    """Sub with only the requested fields (GET /subs?fields=...)"""
+    id: Optional[int] = None
+    name: Optional[str] = None
+    cost: Optional[float] = None
+    next_payment_date: Optional[date] = None
+    category: Optional[Category] = None
+    billing_period: Optional[BillingPeriod] = None
+    billing_interval: Optional[int] = None
 
 
 class NewSub(BaseModel):
@@ -21,6 +36,9 @@ class NewSub(BaseModel):
     cost: Annotated[float, Field(ge=MIN_SUB_COST)]
     next_payment_date: date
     category: Category = Category.OTHER
+    # cost is charged every billing_interval billing_periods (e.g. every 2 WEEKs)
+    billing_period: BillingPeriod = BillingPeriod.MONTH
+    billing_interval: Annotated[int, Field(ge=MIN_BILLING_INTERVAL, le=MAX_BILLING_INTERVAL)] = 1
 
     @field_validator("next_payment_date")
     @classmethod
@@ -30,6 +48,21 @@ class NewSub(BaseModel):
         return value
 
 
+class BulkImportError(BaseModel):
+    row: int
+    detail: str
+
+
+class BulkImportReport(BaseModel):
+    created: int
+    errors: List[BulkImportError]
+
+
+# computed exactly as Decimal, written to JSON as a number like the other costs
+Amount = Annotated[Decimal, Field(ge=MIN_SUB_COST), PlainSerializer(float, return_type=float, when_used="json")]
+
+
 class AmountResponse(BaseModel):
     month_count: Annotated[int, Field(ge=MIN_MONTH_COUNT)]
-    amount: Annotated[float, Field(ge=MIN_SUB_COST)]
+    amount: Amount
+    by_category: Optional[Dict[Category, Amount]] = None
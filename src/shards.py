@@ -0,0 +1,112 @@
+#src/shards.py
+"""
+User operations that span the user directory and the shards (DATABASE_SHARD_URLS)
+
+Every step commits separately, the order keeps a user reachable through the directory at any time
+"""
+import logging
+
+from src.db import SessionLocal, ShardSessionLocals, shard_router
+from src.identity import invalidation_bus
+from src.models import UserModel
+from src.crud import (create_new_user, delete_db_user, add_directory_user, get_directory_user, set_directory_user_shard,
+                      delete_directory_user, export_user_data, import_user_data)
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_sharded_user(username: str) -> UserModel:
+    """
+    Reserve the name and a global id in the directory, then create the user on the shard chosen by the router
+
+    Returns:
+        UserModel (src.models.UserModel): User model
+
+    Raises:
+        exceptions.UsernameNotUniqueException: Username already exists
+    """
+    shard = shard_router.place(username)
+    directory_db = SessionLocal()
+    try:
+        user_id = add_directory_user(directory_db, username, shard)
+        db = ShardSessionLocals[shard]()
+        try:
+            return create_new_user(db, username, user_id)
+        except Exception:
+            delete_directory_user(directory_db, user_id)
+            raise
+        finally:
+            db.close()
+    finally:
+        directory_db.close()
+
+
+def delete_sharded_user(user_id: int = None, username: str = None) -> None:
+    """
+    Delete a user (and their subs) from their shard, then from the directory
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+    """
+    directory_db = SessionLocal()
+    try:
+        entry = get_directory_user(directory_db, user_id, username)
+        db = ShardSessionLocals[entry.shard]()
+        try:
+            delete_db_user(db, user_id=entry.id)
+        finally:
+            db.close()
+        delete_directory_user(directory_db, entry.id)
+    finally:
+        directory_db.close()
+    # drops the cached shard of the user in every process
+    invalidation_bus.publish(entry.id, entry.name)
+    return None
+
+
+def move_user(user_id: int, shard: int) -> None:
+    """
+    Move a user with their subscriptions to another shard
+
+    The copy is committed on the target shard before the directory is switched, then the source rows are deleted.
+    The source user row stays locked meanwhile, writes of the user wait or go to the old shard until other
+    processes refresh their directory cache (SHARD_DIRECTORY_CACHE_TTL), so move users while they are idle.
+    Sub ids are global, the subs keep them
+
+    Args:
+        user_id (int): Unique user id
+        shard (int): Target shard index
+
+    Returns:
+        None
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+        exceptions.UserIsOnShardException: The user already exists on the target shard
+        exceptions.SubIdIsOnShardException: A sub id of the user is taken on the target shard
+    """
+    directory_db = SessionLocal()
+    try:
+        entry = get_directory_user(directory_db, user_id)
+        if entry.shard == shard:
+            return None
+        source_db = ShardSessionLocals[entry.shard]()
+        target_db = ShardSessionLocals[shard]()
+        try:
+            user, subs = export_user_data(source_db, user_id)
+            import_user_data(target_db, user, subs)
+            try:
+                set_directory_user_shard(directory_db, user_id, shard)
+            except Exception:
+                delete_db_user(target_db, user_id=user_id)
+                raise
+            delete_db_user(source_db, user_id=user_id)
+        finally:
+            source_db.close()
+            target_db.close()
+    finally:
+        directory_db.close()
+    invalidation_bus.publish(user_id)
+    logger.info("Moved user %s (%d subs) from shard %s to shard %s", user_id, len(subs), entry.shard, shard)
+    return None
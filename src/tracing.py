@@ -0,0 +1,169 @@
+#src/tracing.py
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Engine, event
+from sqlalchemy.orm import Session
+
+from src.config import SLOW_REQUEST_MS
+from src.metrics import http_metrics, exception_metrics, UNMATCHED_ROUTE
+
+
+logger = logging.getLogger("src.requests")
+
+MAX_LOGGED_STATEMENTS = 50
+
+
+class RequestStats:
+    """Database work done while serving one request"""
+
+    def __init__(self, collect_sql: bool = False) -> None:
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.orm_objects = 0
+        self.commits = 0
+        self.sql: Optional[List[Tuple[str, float]]] = [] if collect_sql else None
+
+    def as_dict(self) -> Dict:
+        return {
+            "statements": self.statements,
+            "db_ms": round(self.db_seconds * 1000, 3),
+            "rows": self.rows,
+            "orm_objects": self.orm_objects,
+            "commits": self.commits,
+        }
+
+
+# set by RequestStatsMiddleware, copied into threadpool workers together with the rest of the context
+_current_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def get_request_stats() -> Optional[RequestStats]:
+    return _current_stats.get()
+
+
+#region SQLAlchemy hooks
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Count statements, DB time and driver-reported rows of an engine into the current RequestStats
+
+    Args:
+        engine (sqlalchemy.Engine): Sync engine (async_engine.sync_engine for async engines)
+
+    Returns:
+        None
+    """
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    if _current_stats.get() is not None:
+        context._stats_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current_stats.get()
+    started = getattr(context, "_stats_started", None)
+    if stats is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats.statements += 1
+    stats.db_seconds += elapsed
+    # drivers that buffer results report SELECT row counts, others report -1
+    if cursor.rowcount > 0:
+        stats.rows += cursor.rowcount
+    if stats.sql is not None and len(stats.sql) < MAX_LOGGED_STATEMENTS:
+        stats.sql.append((statement, elapsed))
+
+
+@event.listens_for(Session, "loaded_as_persistent")
+def _count_loaded_object(session, instance) -> None:
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.orm_objects += 1
+
+
+@event.listens_for(Session, "after_commit")
+def _count_commit(session) -> None:
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.commits += 1
+
+#endregion
+
+
+#region Middleware
+
+class RequestStatsMiddleware:
+    """
+    ASGI middleware that tracks RequestStats per HTTP request
+
+    Adds a Server-Timing header (db and app durations), records the request into src.metrics.http_metrics
+    by route template, logs every request as JSON at DEBUG level on the src.requests logger
+    and logs requests slower than SLOW_REQUEST_MS at WARNING level with their SQL
+    """
+
+    def __init__(self, app, slow_request_ms: float = SLOW_REQUEST_MS) -> None:
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(collect_sql=self.slow_request_ms > 0)
+        token = _current_stats.set(stats)
+        started = time.perf_counter()
+        status = 0
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                server_timing = (
+                    f'db;dur={stats.db_seconds * 1000:.3f};desc="{stats.statements} statements", '
+                    f'app;dur={(time.perf_counter() - started) * 1000:.3f}'
+                )
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", server_timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception as exc:
+            exception_metrics.observe_unhandled(exc)
+            status = status or 500
+            raise
+        finally:
+            _current_stats.reset(token)
+            seconds = time.perf_counter() - started
+            # APIRoute.matches() puts the matched route into the scope, so paths are labeled by template
+            route = scope.get("route")
+            http_metrics.observe(getattr(route, "path", UNMATCHED_ROUTE), scope["method"], status, seconds,
+                                 stats.db_seconds, stats.statements)
+            self._log(scope, status, seconds * 1000, stats)
+
+    def _log(self, scope, status: int, duration_ms: float, stats: RequestStats) -> None:
+        slow = 0 < self.slow_request_ms <= duration_ms
+        if not slow and not logger.isEnabledFor(logging.DEBUG):
+            return
+        record = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round(duration_ms, 3),
+            **stats.as_dict(),
+        }
+        if slow:
+            record["sql"] = [{"statement": statement, "ms": round(seconds * 1000, 3)} for statement, seconds in stats.sql]
+            logger.warning("slow request %s", json.dumps(record))
+        else:
+            logger.debug("request %s", json.dumps(record))
+
+#endregion
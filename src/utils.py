@@ -1,20 +1,390 @@
 #src/utils.py
-from src.schemas import Sub, User
+import base64
+import csv
+import io
+import itertools
+import json
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from dateutil.relativedelta import relativedelta
+from fastapi import Request
+from pydantic import TypeAdapter, ValidationError
+
+import src.exceptions as exceptions
+from src.schemas import Sub, User, NewSub, BulkImportError
 from src.models import SubModel, UserModel
+from src.db import ShardSessionLocals, open_user_session
+from src.crud import get_db_user, iter_db_subs, iter_due_db_subs
+from src.billing import roll_sub_payment_date, merge_payment_schedules
+from src.constants import SubField, SubOrder, ExportFormat
 
 
-def make_scheme_from_submodel(sub: SubModel) -> Sub:
-    return Sub(
+# db rows are trusted: responses are built from them without validation (model_construct, plain dicts)
+
+def make_scheme_from_submodel(sub: Union[SubModel, Any], today: date = None) -> Sub:
+    if today is None:
+        today = date.today()
+    return Sub.model_construct(
         id=sub.id,
         name=sub.name,
-        cost=sub.cost,
-        next_payment_date=sub.next_payment_date,
-        category=sub.category
+        cost=float(sub.cost),
+        next_payment_date=roll_sub_payment_date(sub, today),
+        category=sub.category,
+        billing_period=sub.billing_period,
+        billing_interval=sub.billing_interval
     )
 
 
+def make_dict_from_sub_row(row: Any, fields: Optional[Iterable[SubField]] = None, today: date = None) -> Dict[str, Any]:
+    # JSON-compatible values, the dict is cached and sent as is (src.responses.ORJSONResponse), all fields if None
+    if today is None:
+        today = date.today()
+    if fields is None:
+        return {
+            "id": row.id,
+            "name": row.name,
+            "cost": float(row.cost),
+            "next_payment_date": roll_sub_payment_date(row, today).isoformat(),
+            "category": row.category.value,
+            "billing_period": row.billing_period.value,
+            "billing_interval": row.billing_interval,
+        }
+    result = {}
+    for field in fields:
+        if field == SubField.NEXT_PAYMENT_DATE:
+            value = roll_sub_payment_date(row, today).isoformat()
+        elif field == SubField.COST:
+            value = float(row.cost)
+        elif field in (SubField.CATEGORY, SubField.BILLING_PERIOD):
+            value = getattr(row, field.value).value
+        else:
+            value = getattr(row, field.value)
+        result[field.value] = value
+    return result
+
+
+def encode_sub_cursor(row: Any, order_by: SubOrder) -> str:
+    if order_by == SubOrder.NEXT_PAYMENT_DATE:
+        key = [row.next_payment_date.isoformat(), row.id]
+    else:
+        key = [row.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_sub_cursor(cursor: str, order_by: SubOrder) -> Tuple:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if order_by == SubOrder.NEXT_PAYMENT_DATE:
+            after_date, after_id = key
+            return date.fromisoformat(after_date), int(after_id)
+        (after_id,) = key
+        return (int(after_id),)
+    except (ValueError, TypeError):
+        raise exceptions.InvalidCursorException()
+
+
 def make_scheme_from_usermodel(user: UserModel) -> User:
-    return User(
+    return User.model_construct(
         id=user.id,
         name=user.name
     )
+
+
+#region Export
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+def format_sub_rows(
+    rows: Iterable[Any],
+    export_format: ExportFormat,
+    with_user_id: bool = False,
+    chunk_rows: int = 500,
+    today: date = None
+) -> Iterator[str]:
+    """
+    Format subscription rows as NDJSON or CSV, yielding one chunk of text per chunk_rows rows
+
+    Returns:
+        Iterator[str]: Text chunks (the CSV header is the first chunk)
+    """
+    if today is None:
+        today = date.today()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n") if export_format == ExportFormat.CSV else None
+    if writer is not None:
+        writer.writerow((["user_id"] if with_user_id else []) + [field.value for field in SubField])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    count = 0
+    for row in rows:
+        record = {"user_id": row.user_id} if with_user_id else {}
+        record.update(
+            id=row.id,
+            name=row.name,
+            cost=row.cost,
+            next_payment_date=roll_sub_payment_date(row, today).isoformat(),
+            category=row.category.value,
+            billing_period=row.billing_period.value,
+            billing_interval=row.billing_interval
+        )
+        if writer is not None:
+            writer.writerow(record.values())
+        else:
+            record["cost"] = float(record["cost"])
+            buffer.write(json.dumps(record))
+            buffer.write("\n")
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def __iter_shard_rows(load_rows) -> Iterator[Any]:
+    # one session per shard in turn, the rows of all shards form one export
+    for session_factory in ShardSessionLocals:
+        db = session_factory()
+        try:
+            yield from load_rows(db)
+        finally:
+            db.close()
+
+
+def stream_sub_export(user_id: Optional[int], export_format: ExportFormat) -> Iterator[str]:
+    """
+    Export subscriptions of a user (or of all users if user_id is None) with a dedicated session
+
+    The generator outlives the request handler, so it opens and closes its own session
+    (on the shard of the user, on every shard in turn for all users).
+    Starlette iterates it in the threadpool, memory stays bounded by the keyset batch size (src.crud.iter_db_subs).
+    The user is checked with the same session before the first chunk, start_stream() runs that check
+    before the response starts
+
+    Raises:
+        exceptions.UserIsNoneException: User not found
+    """
+    if user_id is None:
+        rows = __iter_shard_rows(lambda db: iter_db_subs(db, None))
+        yield from format_sub_rows(rows, export_format, with_user_id=True)
+        return
+    db = open_user_session(user_id)
+    try:
+        get_db_user(db, user_id)
+        yield from format_sub_rows(iter_db_subs(db, user_id), export_format)
+    finally:
+        db.close()
+
+
+def start_stream(chunks: Iterator[str]) -> Iterator[str]:
+    """
+    Run a stream up to its first chunk, so that its checks raise before a response is started
+
+    Blocking, run it in the threadpool. The request handler needs no session of its own
+    (a request session would stay checked out while the response streams)
+    """
+    try:
+        first_chunk = next(chunks)
+    except StopIteration:
+        return iter(())
+    return itertools.chain((first_chunk,), chunks)
+
+
+def stream_due_subs(start: date, end: date, export_format: ExportFormat) -> Iterator[str]:
+    """
+    Export subscriptions of all users that are due within [start, end] with a dedicated session per shard
+
+    Rows are fetched in keyset batches (src.crud.iter_due_db_subs) while the response is streamed
+    """
+    rows = __iter_shard_rows(lambda db: itertools.chain.from_iterable(iter_due_db_subs(db, start, end)))
+    yield from format_sub_rows(rows, export_format, with_user_id=True)
+#endregion
+
+
+#region Upcoming payments
+
+def make_upcoming_window(start: Optional[date], end: Optional[date], max_days: int) -> Tuple[date, date]:
+    """
+    Resolve the [start, end] window of upcoming payments, from today for one month by default
+
+    Raises:
+        exceptions.InvalidDateRangeException: end is before start or the window is longer than max_days
+    """
+    start = start or date.today()
+    end = end or start + relativedelta(months=+1)
+    if end < start or end - start > timedelta(days=max_days):
+        raise exceptions.InvalidDateRangeException()
+    return start, end
+
+
+def format_upcoming_payments(rows: Iterable[Any], start: date, end: date, chunk_rows: int = 500) -> Iterator[str]:
+    """
+    Format the payments of subscription rows within [start, end] as NDJSON in date order
+
+    Payments are expanded and merged lazily, every line carries the running total of the window
+
+    Returns:
+        Iterator[str]: Text chunks of chunk_rows lines
+    """
+    buffer = io.StringIO()
+    running_total = Decimal(0)
+    count = 0
+    for payment_date, row in merge_payment_schedules(rows, start, end):
+        running_total += row.cost
+        buffer.write(json.dumps({
+            "date": payment_date.isoformat(),
+            "sub_id": row.id,
+            "name": row.name,
+            "cost": float(row.cost),
+            "category": row.category.value,
+            "running_total": float(running_total),
+        }))
+        buffer.write("\n")
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+#endregion
+
+
+#region Bulk import
+
+_new_sub_adapter = TypeAdapter(NewSub)
+
+
+async def read_bulk_records(request: Request, max_rows: int) -> List[Union[Dict, str]]:
+    """
+    Read raw subscription records from a JSON array, NDJSON or CSV (with a header row) request body
+
+    NDJSON and CSV bodies are parsed line by line while they are streamed
+
+    Returns:
+        List[Union[Dict, str]]: Records, a str instead of a record is a parse error of that row
+
+    Raises:
+        exceptions.InvalidBulkBodyException: Body cannot be parsed at all
+        exceptions.TooManyBulkRowsException: More than max_rows records
+    """
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    records: List[Union[Dict, str]] = []
+    try:
+        if content_type in ("application/x-ndjson", "application/jsonl"):
+            async for line in __iter_body_lines(request):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError as e:
+                    records.append(f"invalid JSON: {e}")
+                if len(records) > max_rows:
+                    raise exceptions.TooManyBulkRowsException()
+        elif content_type == "text/csv":
+            header = None
+            async for line in __iter_body_lines(request):
+                if not line.strip():
+                    continue
+                values = next(csv.reader([line]))
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                if len(values) != len(header):
+                    records.append(f"expected {len(header)} columns, got {len(values)}")
+                else:
+                    # empty cells fall back to the schema defaults
+                    records.append({name: value for name, value in zip(header, values) if value != ""})
+                if len(records) > max_rows:
+                    raise exceptions.TooManyBulkRowsException()
+        else:
+            body = json.loads(await request.body())
+            if not isinstance(body, list):
+                raise exceptions.InvalidBulkBodyException()
+            if len(body) > max_rows:
+                raise exceptions.TooManyBulkRowsException()
+            records = body
+    except (ValueError, csv.Error):
+        raise exceptions.InvalidBulkBodyException()
+    return records
+
+
+def validate_bulk_records(records: List[Union[Dict, str]]) -> Tuple[List[Tuple[int, NewSub]], List[BulkImportError]]:
+    """
+    Validate raw records in one pass, names repeated within the batch are rejected after their first row
+
+    Returns:
+        Tuple: (row index, NewSub) of valid records and errors of the rejected rows
+    """
+    valid: List[Tuple[int, NewSub]] = []
+    errors: List[BulkImportError] = []
+    seen_names = set()
+    for row, record in enumerate(records):
+        if isinstance(record, str):
+            errors.append(BulkImportError(row=row, detail=record))
+            continue
+        try:
+            new_sub = _new_sub_adapter.validate_python(record)
+        except ValidationError as e:
+            detail = "; ".join(f"{'.'.join(str(loc) for loc in error['loc']) or 'row'}: {error['msg']}" for error in e.errors())
+            errors.append(BulkImportError(row=row, detail=detail))
+            continue
+        if new_sub.name in seen_names:
+            errors.append(BulkImportError(row=row, detail=exceptions.DetailsForHTTPExceptions.SubNameNotUniqueException))
+            continue
+        seen_names.add(new_sub.name)
+        valid.append((row, new_sub))
+    return valid, errors
+
+
+async def __iter_body_lines(request: Request) -> AsyncIterator[str]:
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8-sig").rstrip("\r")
+
+#endregion
+
+
+#region Conditional requests
+
+def make_user_etag(user_id: int, data_version: int, today: date) -> str:
+    """
+    Weak ETag of a user's read responses: effective payment dates move with the date, compression changes the bytes
+
+    Returns:
+        str: ETag header value
+    """
+    return f'W/"{user_id}-{data_version}-{today.isoformat()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header with an ETag
+
+    Returns:
+        bool: True if the client already has the representation (304)
+    """
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+#endregion
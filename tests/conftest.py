@@ -0,0 +1,76 @@
+#tests/conftest.py
+"""
+Shared fixtures of the test suite, on SQLite files in a temporary directory
+
+src reads its configuration and creates the engines at import, so the environment is set here, before any
+test module imports src. Variables already set by the caller win (tests/test_shards.py reruns itself with shards)
+"""
+import os
+import tempfile
+import uuid
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+
+_TMP_DIR = tempfile.mkdtemp(prefix="subs-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TMP_DIR, 'subs.db')}")
+# every read reaches the database, statement counts and query plans do not depend on earlier tests
+os.environ.setdefault("CACHE_BACKEND", "none")
+os.environ.setdefault("INVALIDATION_BACKEND", "local")
+os.environ.setdefault("DB_POOL_WARMUP", "0")
+os.environ.setdefault("ROLLOVER_ON_STARTUP", "0")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    from src.migrations import upgrade_all
+
+    upgrade_all()
+    yield
+
+
+@pytest.fixture
+def db():
+    from src.db import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    from src.main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+def make_username() -> str:
+    return f"user-{uuid.uuid4().hex[:12]}"
+
+
+def make_new_subs(count: int, today: date = None) -> list:
+    from src.schemas import NewSub
+
+    today = today or date.today()
+    return [
+        NewSub(name=f"sub-{index:03d}", cost=Decimal("9.99"), next_payment_date=today + timedelta(days=index + 1))
+        for index in range(count)
+    ]
+
+
+@pytest.fixture
+def user_id(db) -> int:
+    """Id of a new user with 5 subscriptions due in the next 5 days"""
+    from src.crud import create_new_user, create_new_subs
+
+    user = create_new_user(db, make_username())
+    create_new_subs(db, user.id, make_new_subs(5))
+    return user.id
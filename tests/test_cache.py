@@ -0,0 +1,82 @@
+#tests/test_cache.py
+"""
+Redis response cache (src.cache.RedisCache) on fakeredis: entries of a user live in one hash, a write drops it
+for every process sharing the server, cached bodies are keyed by the data version of the user
+"""
+from datetime import date, timedelta
+
+import pytest
+
+from src import cache as cache_module, crud
+from src.cache import RedisCache
+from tests.conftest import make_username
+
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+def make_redis_cache(server, ttl: float = 60) -> RedisCache:
+    return RedisCache(fakeredis.FakeRedis(server=server), ttl)
+
+
+def test_get_set_and_invalidate(server):
+    redis_cache = make_redis_cache(server)
+
+    assert redis_cache.get(1, "monthly@v1") is None
+    redis_cache.set(1, "monthly@v1", {"amount": "9.99", "by_category": None})
+    redis_cache.set(1, "data-version", 1)
+    redis_cache.set(2, "data-version", 3)
+
+    assert redis_cache.get(1, "monthly@v1") == {"amount": "9.99", "by_category": None}
+    assert redis_cache.get(1, "data-version") == 1
+    assert 0 < redis_cache.client.ttl("subs-cache:1") <= 60
+    redis_cache.invalidate(1)
+    assert redis_cache.get(1, "monthly@v1") is None
+    assert redis_cache.get(1, "data-version") is None
+    # other users keep their entries
+    assert redis_cache.get(2, "data-version") == 3
+    assert redis_cache.stats.snapshot() == {"hits": 3, "misses": 3, "evictions": 0, "invalidations": 1}
+
+
+def test_invalidation_reaches_other_workers(server):
+    workers = [make_redis_cache(server), make_redis_cache(server)]
+    workers[0].set(1, "data-version", 1)
+    assert workers[1].get(1, "data-version") == 1
+
+    workers[1].invalidate(1)
+
+    assert workers[0].get(1, "data-version") is None
+
+
+def test_writes_drop_bodies_of_the_old_data_version(client, server, monkeypatch):
+    redis_cache = make_redis_cache(server)
+    # get_or_load reads the module global, crud invalidates through its own import
+    monkeypatch.setattr(cache_module, "cache", redis_cache)
+    monkeypatch.setattr(crud, "cache", redis_cache)
+    user_id = client.post("/register", json={"name": make_username()}).json()["id"]
+    new_sub = {"name": "first", "cost": 5, "next_payment_date": (date.today() + timedelta(days=1)).isoformat()}
+    assert client.post("/subs", params={"user_id": user_id}, json=new_sub).status_code == 200
+
+    first = client.get("/subs", params={"user_id": user_id})
+    hits = redis_cache.stats.hits
+    cached = client.get("/subs", params={"user_id": user_id})
+    keys = {key.decode() for key in redis_cache.client.hkeys(f"subs-cache:{user_id}")}
+
+    assert redis_cache.stats.hits == hits + 2
+    assert cached.json() == first.json()
+    assert cached.headers["ETag"] == first.headers["ETag"]
+    data_version = redis_cache.get(user_id, "data-version")
+    assert any(key.startswith("subs:") and key.endswith(f"@v{data_version}") for key in keys)
+
+    assert client.post("/subs", params={"user_id": user_id}, json={**new_sub, "name": "second"}).status_code == 200
+
+    assert not redis_cache.client.exists(f"subs-cache:{user_id}")
+    changed = client.get("/subs", params={"user_id": user_id})
+    assert {sub["name"] for sub in changed.json()} == {"first", "second"}
+    assert changed.headers["ETag"] != first.headers["ETag"]
+    assert redis_cache.get(user_id, "data-version") == data_version + 1
@@ -0,0 +1,77 @@
+#tests/test_connections.py
+"""
+Streamed and rendered endpoints must not hold more than one pooled connection at a time:
+a request session kept checked out while a second one streams the body exhausts the pool under load
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+import pytest
+from sqlalchemy import event
+
+from src.db import SHARDED, async_engine, engine
+from tests.conftest import make_username
+
+# with shards the connections are checked out from the shard engines
+pytestmark = pytest.mark.skipif(SHARDED, reason="counts the connections of the primary pool")
+# with USE_ASYNC_DB=1 requests check out from the async engine's pool
+ENGINES = [engine] if async_engine is None else [engine, async_engine.sync_engine]
+
+
+@contextmanager
+def track_checkouts() -> Iterator[Dict[str, int]]:
+    counts = {"checked_out": 0, "max_checked_out": 0}
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counts["checked_out"] += 1
+        counts["max_checked_out"] = max(counts["max_checked_out"], counts["checked_out"])
+
+    def on_checkin(dbapi_connection, connection_record):
+        counts["checked_out"] -= 1
+
+    for tracked_engine in ENGINES:
+        event.listen(tracked_engine, "checkout", on_checkout)
+        event.listen(tracked_engine, "checkin", on_checkin)
+    try:
+        yield counts
+    finally:
+        for tracked_engine in ENGINES:
+            event.remove(tracked_engine, "checkout", on_checkout)
+            event.remove(tracked_engine, "checkin", on_checkin)
+
+
+@pytest.fixture
+def user_with_subs(client) -> int:
+    user_id = client.post("/register", json={"name": make_username()}).json()["id"]
+    body = [{"name": f"sub-{index}", "cost": 9.99, "next_payment_date": "2030-01-01"} for index in range(3)]
+    client.post("/subs/bulk", params={"user_id": user_id}, json=body)
+    return user_id
+
+
+@pytest.mark.parametrize("export_format", ["ndjson", "csv"])
+def test_export_holds_one_connection(client, user_with_subs, export_format):
+    with track_checkouts() as counts:
+        response = client.get("/subs/export", params={"user_id": user_with_subs, "format": export_format})
+
+    assert response.status_code == 200
+    assert "sub-2" in response.text
+    assert counts["max_checked_out"] == 1
+    assert counts["checked_out"] == 0
+
+
+def test_export_of_unknown_user_is_404(client):
+    with track_checkouts() as counts:
+        response = client.get("/subs/export", params={"user_id": 0})
+
+    assert response.status_code == 404
+    assert counts["checked_out"] == 0
+
+
+def test_upcoming_holds_one_connection(client, user_with_subs):
+    with track_checkouts() as counts:
+        response = client.get("/subs/upcoming", params={"user_id": user_with_subs, "from": "2030-01-01", "to": "2030-01-10"})
+
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 3
+    assert counts["max_checked_out"] == 1
+    assert counts["checked_out"] == 0
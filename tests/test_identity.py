@@ -0,0 +1,123 @@
+#tests/test_identity.py
+"""
+Identity cache (src.identity): entries are dropped by every create and delete of a user,
+write paths do not trust a positive entry, invalidations reach the caches of other processes through the bus
+"""
+import time
+
+import pytest
+from sqlalchemy import delete
+
+from src import crud, exceptions
+from src.db import SHARDED, SessionLocal
+from src.identity import IdentityCache, LocalInvalidationBus, RedisInvalidationBus, identity_cache
+from src.models import UserModel
+from tests.conftest import make_new_subs, make_username
+
+
+@pytest.fixture(autouse=True)
+def clear_identity_cache():
+    identity_cache.clear()
+    yield
+    identity_cache.clear()
+
+
+def make_cache() -> IdentityCache:
+    return IdentityCache(max_entries=100, ttl=60, negative_ttl=60)
+
+
+def test_register_drops_negative_name_entry(client):
+    name = make_username()
+    assert client.delete("/delete-user/by-name", params={"name": name}).status_code == 404
+    assert identity_cache.get_user_id(name) == (True, None)
+
+    response = client.post("/register", json={"name": name})
+
+    assert response.status_code == 200, response.text
+    assert identity_cache.get_user_id(name) == (False, None)
+    assert client.delete("/delete-user/by-name", params={"name": name}).status_code == 200
+
+
+def test_delete_user_drops_positive_entries(client):
+    name = make_username()
+    user_id = client.post("/register", json={"name": name}).json()["id"]
+    identity_cache.set_user(user_id, name)
+
+    response = client.delete("/delete-user/by-id", params={"user_id": user_id})
+
+    assert response.status_code == 200
+    assert identity_cache.user_exists(user_id) is None
+    assert identity_cache.get_user_id(name) == (False, None)
+    assert client.get("/subs", params={"user_id": user_id}).status_code == 404
+
+
+@pytest.mark.skipif(SHARDED, reason="deletes the user row of the primary database")
+@pytest.mark.parametrize("write", [
+    lambda db, user_id: crud.create_new_sub(db, user_id, make_new_subs(1)[0]),
+    lambda db, user_id: crud.create_new_subs(db, user_id, []),
+    lambda db, user_id: crud.delete_all_user_db_subs(db, user_id),
+], ids=["create_new_sub", "create_new_subs", "delete_all_user_db_subs"])
+def test_write_paths_ignore_stale_positive_entry(db, write):
+    user_id = crud.create_new_user(db, make_username()).id
+    # another process deletes the user, its invalidation did not reach this one
+    with SessionLocal() as other_db:
+        other_db.execute(delete(UserModel).where(UserModel.id == user_id))
+        other_db.commit()
+    identity_cache.set_user(user_id)
+
+    with pytest.raises(exceptions.UserIsNoneException):
+        write(db, user_id)
+
+    assert identity_cache.user_exists(user_id) is False
+
+
+def test_local_bus_delivers_to_every_handler():
+    bus = LocalInvalidationBus()
+    caches = [make_cache(), make_cache()]
+
+    def failing_handler(user_id, username):
+        raise RuntimeError("handler failed")
+
+    bus.subscribe(failing_handler)
+    for cache in caches:
+        cache.set_user(7, "seven")
+        bus.subscribe(cache.invalidate)
+
+    bus.publish(7)
+
+    for cache in caches:
+        assert cache.user_exists(7) is None
+        assert cache.get_user_id("seven") == (False, None)
+
+
+def test_redis_bus_invalidates_other_workers():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    workers = []
+    deliveries = []
+    for _ in range(2):
+        bus = RedisInvalidationBus(fakeredis.FakeRedis(server=server), channel="test-identity")
+        cache = make_cache()
+        bus.subscribe(cache.invalidate)
+        bus.start()
+        workers.append((bus, cache))
+    workers[0][0].subscribe(lambda user_id, username: deliveries.append(user_id))
+    (publisher, publisher_cache), (listener, listener_cache) = workers
+    try:
+        listener_cache.set_missing_user(username="new-user")
+        publisher_cache.set_missing_user(username="new-user")
+
+        publisher.publish(42, "new-user")
+
+        # the publishing process drops its entries synchronously
+        assert publisher_cache.get_user_id("new-user") == (False, None)
+        deadline = time.monotonic() + 5
+        while listener_cache.get_user_id("new-user")[0] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert listener_cache.get_user_id("new-user") == (False, None)
+        # its own message coming back from the channel is not delivered again
+        time.sleep(0.1)
+        assert deliveries == [42]
+    finally:
+        for bus, _ in workers:
+            bus.stop()
@@ -0,0 +1,105 @@
+#tests/test_indexes.py
+"""
+Every CRUD query on the sub table must search an index (EXPLAIN QUERY PLAN on SQLite), never scan the table
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Callable, List, Tuple
+
+import pytest
+from sqlalchemy import event
+
+from src import crud
+from src.constants import Category, SubOrder
+from src.db import engine
+from src.identity import identity_cache
+from src.schemas import NewSub
+
+
+PRIMARY_KEY = "INTEGER PRIMARY KEY"
+
+
+def capture_statements(fn: Callable[[], object]) -> List[Tuple[str, object]]:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    # the identity cache would answer existence checks without a statement
+    identity_cache.clear()
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def explain_sub_accesses(statements: List[Tuple[str, object]]) -> List[str]:
+    # plan lines that read the sub table, with the statement for the assertion messages
+    lines = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            if " sub" not in statement or statement.lstrip().upper().startswith("INSERT"):
+                continue
+            for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters):
+                detail = row[-1]
+                if detail.startswith(("SEARCH sub ", "SCAN sub")):
+                    lines.append(f"{detail}  <-  {' '.join(statement.split())[:120]}")
+    return lines
+
+
+def new_sub(name: str) -> NewSub:
+    return NewSub(name=name, cost=Decimal("1.00"), next_payment_date=date.today() + timedelta(days=1))
+
+
+CRUD_QUERIES = {
+    "get_db_sub by name": (lambda db, user_id: crud.get_db_sub(db, user_id, sub_name="sub-001"), "ix_sub_user_id_name"),
+    "get_db_sub by id": (
+        lambda db, user_id: crud.get_db_sub(db, user_id, sub_id=crud.get_db_sub(db, user_id, sub_name="sub-001").id),
+        PRIMARY_KEY
+    ),
+    # joined to the earliest next payment stored in the user's spend summary
+    "get_next_payment_db_sub": (lambda db, user_id: crud.get_next_payment_db_sub(db, user_id), PRIMARY_KEY),
+    "get_db_subs": (lambda db, user_id: crud.get_db_subs(db, user_id), "ix_sub_user_id_"),
+    "get_db_subs by next_payment_date": (
+        lambda db, user_id: crud.get_db_subs(db, user_id, order_by=SubOrder.NEXT_PAYMENT_DATE, limit=2),
+        "ix_sub_user_id_next_payment_date"
+    ),
+    "get_db_subs by category": (
+        lambda db, user_id: crud.get_db_subs(db, user_id, category=Category.OTHER), "ix_sub_user_id_"
+    ),
+    "iter_db_subs": (lambda db, user_id: list(crud.iter_db_subs(db, user_id)), "ix_sub_user_id_"),
+    "get_upcoming_db_subs": (
+        lambda db, user_id: crud.get_upcoming_db_subs(db, user_id, date.today() + timedelta(days=10)),
+        "ix_sub_user_id_next_payment_date"
+    ),
+    "get_next_payment_db_subs": (
+        lambda db, user_id: crud.get_next_payment_db_subs(db, [user_id]), "ix_sub_user_id_next_payment_date"
+    ),
+    "iter_due_db_subs": (
+        lambda db, user_id: list(crud.iter_due_db_subs(db, date.today(), date.today() + timedelta(days=3))),
+        "ix_sub_next_payment_date_id"
+    ),
+    "create_new_subs": (
+        lambda db, user_id: crud.create_new_subs(db, user_id, [new_sub("sub-001"), new_sub("new-sub")]),
+        "ix_sub_user_id_name"
+    ),
+    "delete_db_sub by name": (lambda db, user_id: crud.delete_db_sub(db, user_id, sub_name="sub-002"), "ix_sub_user_id_name"),
+    "delete_all_user_db_subs": (lambda db, user_id: crud.delete_all_user_db_subs(db, user_id), "ix_sub_user_id_"),
+    # fleet-wide batches in keyset order of id
+    "rollover_overdue_subs": (
+        lambda db, user_id: crud.rollover_overdue_subs(db, date.today() + timedelta(days=3)), PRIMARY_KEY
+    ),
+}
+
+
+@pytest.mark.parametrize("name", CRUD_QUERIES)
+def test_crud_query_uses_index(db, user_id, name):
+    run, expected_index = CRUD_QUERIES[name]
+    lines = explain_sub_accesses(capture_statements(lambda: run(db, user_id)))
+
+    assert lines, f"{name} did not read the sub table"
+    assert not [line for line in lines if line.startswith("SCAN sub")], "\n".join(lines)
+    assert any(expected_index in line for line in lines), "\n".join(lines)
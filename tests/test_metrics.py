@@ -0,0 +1,35 @@
+#tests/test_metrics.py
+"""
+Connection pool metrics (src.metrics.PoolMetrics) are updated from threadpool workers and must not lose checkouts
+"""
+import sys
+import threading
+
+from src.metrics import PoolMetrics
+
+
+def test_pool_metrics_count_concurrent_checkouts():
+    metrics = PoolMetrics()
+    threads, checkouts = 8, 5000
+    # switch threads as often as possible to interleave the counter updates
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+
+    def check_out():
+        for _ in range(checkouts):
+            metrics.observe_checkout(0.001, overflow=True)
+        metrics.observe_timeout()
+
+    workers = [threading.Thread(target=check_out) for _ in range(threads)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert metrics.checkouts == threads * checkouts
+    assert metrics.overflow_checkouts == threads * checkouts
+    assert metrics.timeouts == threads
+    assert abs(metrics.checkout_seconds_total - threads * checkouts * 0.001) < 1e-6
@@ -0,0 +1,113 @@
+#tests/test_replicas.py
+"""
+Read replicas (DATABASE_REPLICA_URLS): read-your-writes stickiness and failover to the primary
+
+src reads DATABASE_REPLICA_URLS at import, so a test session without replicas reruns this module in a child
+pytest process (test_replica_suite). Replica 0 is the primary's own SQLite file (an always up-to-date replica),
+replica 1 cannot be opened and fails every connection
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+from sqlalchemy import event
+
+import src.db
+from src.db import pick_read_replica, replica_engines, replica_health, stick_to_primary
+from tests.conftest import make_username
+
+
+with_replicas = pytest.mark.skipif(not replica_engines, reason="runs in the child process of test_replica_suite")
+
+
+@pytest.mark.skipif(bool(replica_engines), reason="already running with replicas")
+def test_replica_suite():
+    tmp_dir = tempfile.mkdtemp(prefix="subs-replica-tests-")
+    primary_url = f"sqlite:///{os.path.join(tmp_dir, 'primary.db')}"
+    env = dict(os.environ)
+    env.pop("DATABASE_SHARD_URLS", None)
+    env["DATABASE_URL"] = primary_url
+    env["DATABASE_REPLICA_URLS"] = f"{primary_url},sqlite:///{os.path.join(tmp_dir, 'missing', 'replica.db')}"
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", __file__],
+        cwd=Path(__file__).resolve().parent.parent, env=env, capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import src.main
+
+    async def no_health_checks():
+        return None
+
+    # the startup health check would mark the broken replica as failed before the tests pick it
+    monkeypatch.setattr(src.main, "replica_health_worker", no_health_checks)
+    with TestClient(src.main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def healthy_replicas():
+    replica_health[:] = [True] * len(replica_engines)
+    yield
+    replica_health[:] = [True] * len(replica_engines)
+
+
+def count_replica_statements(index: int, run) -> int:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    replica_engine = replica_engines[index]
+    sync_engine = getattr(replica_engine, "sync_engine", replica_engine)
+    event.listen(sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        run()
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", before_cursor_execute)
+    return len(statements)
+
+
+@with_replicas
+def test_reads_stick_to_primary_after_write(client, healthy_replicas):
+    replica_health[1] = False
+    user_id = client.post("/register", json={"name": make_username()}).json()["id"]
+
+    assert pick_read_replica(user_id) is None
+    assert pick_read_replica(user_id + 1) == 0
+    assert count_replica_statements(0, lambda: client.get("/subs", params={"user_id": user_id})) == 0
+
+
+@with_replicas
+def test_stickiness_expires(healthy_replicas, monkeypatch):
+    replica_health[1] = False
+    monkeypatch.setattr(src.db, "READ_YOUR_WRITES_SECONDS", 0.05)
+    stick_to_primary(-1)
+
+    assert pick_read_replica(-1) is None
+    time.sleep(0.1)
+    assert pick_read_replica(-1) == 0
+
+
+@with_replicas
+def test_failed_replica_read_is_retried_on_primary(client, healthy_replicas, monkeypatch):
+    user_id = client.post("/register", json={"name": make_username()}).json()["id"]
+    monkeypatch.setattr(src.db, "READ_YOUR_WRITES_SECONDS", 0)
+    src.db._primary_reads_until.clear()
+    replica_health[0] = False
+
+    response = client.get("/subs", params={"user_id": user_id})
+
+    assert response.status_code == 200, response.text
+    assert replica_health == [False, False]
+    # with no healthy replica every read goes to the primary
+    assert pick_read_replica(user_id) is None
@@ -0,0 +1,35 @@
+#tests/test_rollover.py
+"""
+rollover_overdue_subs against subscriptions that change between its SELECT and its UPDATE
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import delete, select
+
+from src import crud
+from src.db import SessionLocal
+from src.models import SubModel
+
+
+def test_rollover_skips_sub_deleted_after_select(db, user_id, monkeypatch):
+    today = date.today() + timedelta(days=10)
+    roll_sub_payment_dates = crud.roll_sub_payment_dates
+    deleted_ids = []
+
+    def delete_one_then_roll(rows, today):
+        # another session deletes a selected row before the batch UPDATE
+        sub_id = next(row.id for row in rows if row.user_id == user_id)
+        with SessionLocal() as other_db:
+            other_db.execute(delete(SubModel).where(SubModel.id == sub_id))
+            other_db.commit()
+        deleted_ids.append(sub_id)
+        return roll_sub_payment_dates(rows, today)
+
+    monkeypatch.setattr(crud, "roll_sub_payment_dates", delete_one_then_roll)
+    crud.rollover_overdue_subs(db, today)
+
+    rows = db.execute(select(SubModel.id, SubModel.next_payment_date).where(SubModel.user_id == user_id)).all()
+    assert len(deleted_ids) == 1
+    assert deleted_ids[0] not in {row.id for row in rows}
+    assert len(rows) == 4
+    assert all(row.next_payment_date >= today for row in rows)
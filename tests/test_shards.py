@@ -0,0 +1,226 @@
+#tests/test_shards.py
+"""
+Sharding (DATABASE_SHARD_URLS) on two temporary SQLite shards and a separate directory database
+
+src reads DATABASE_SHARD_URLS at import, so an unsharded test session reruns this module in a child
+pytest process with the shard urls set (test_sharded_suite), the other tests only run there
+"""
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import insert, select
+
+from src.db import SHARDED, SessionLocal, ShardSessionLocals, shard_router
+from src.models import SubModel, UserModel, UserDirectoryModel
+from tests.conftest import make_username
+
+
+sharded = pytest.mark.skipif(not SHARDED, reason="runs in the child process of test_sharded_suite")
+
+
+@pytest.mark.skipif(SHARDED, reason="already running with shards")
+def test_sharded_suite():
+    tmp_dir = tempfile.mkdtemp(prefix="subs-shard-tests-")
+    env = dict(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp_dir, 'directory.db')}"
+    env["DATABASE_SHARD_URLS"] = ",".join(f"sqlite:///{os.path.join(tmp_dir, f'shard{shard}.db')}" for shard in range(2))
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", __file__],
+        cwd=Path(__file__).resolve().parent.parent, env=env, capture_output=True, text=True, timeout=300
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def name_on_shard(shard: int) -> str:
+    while True:
+        name = make_username()
+        if shard_router.place(name) == shard:
+            return name
+
+
+def register(client, name: str) -> int:
+    response = client.post("/register", json={"name": name})
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+def add_subs(client, user_id: int, count: int) -> List[dict]:
+    response = client.post("/subs/bulk", params={"user_id": user_id}, json=[
+        {"name": f"sub-{index:04d}", "cost": 5, "next_payment_date": (date.today() + timedelta(days=1)).isoformat()}
+        for index in range(count)
+    ])
+    assert response.status_code == 200, response.text
+    return client.get("/subs", params={"user_id": user_id}).json()
+
+
+def shard_user_ids(shard: int) -> set:
+    db = ShardSessionLocals[shard]()
+    try:
+        return set(db.execute(select(UserModel.id)).scalars())
+    finally:
+        db.close()
+
+
+def shard_sub_ids(shard: int, user_id: int = None) -> set:
+    db = ShardSessionLocals[shard]()
+    try:
+        query = select(SubModel.id)
+        if user_id is not None:
+            query = query.where(SubModel.user_id == user_id)
+        return set(db.execute(query).scalars())
+    finally:
+        db.close()
+
+
+def directory_shard(user_id: int) -> int:
+    db = SessionLocal()
+    try:
+        return db.execute(select(UserDirectoryModel.shard).where(UserDirectoryModel.id == user_id)).scalar()
+    finally:
+        db.close()
+
+
+@sharded
+def test_registration_places_users_by_name(client):
+    names = [name_on_shard(shard) for shard in (0, 1, 0, 1)]
+
+    user_ids = [register(client, name) for name in names]
+
+    for name, user_id in zip(names, user_ids):
+        shard = shard_router.place(name)
+        assert directory_shard(user_id) == shard
+        assert user_id in shard_user_ids(shard)
+        assert user_id not in shard_user_ids(1 - shard)
+    # ids come from the directory, they are unique across shards
+    assert len(set(user_ids)) == len(user_ids)
+
+
+@sharded
+def test_duplicate_name_is_rejected_across_shards(client):
+    name = make_username()
+    register(client, name)
+
+    response = client.post("/register", json={"name": name})
+
+    assert response.status_code == 409
+
+
+@sharded
+@pytest.mark.parametrize("shard", [0, 1])
+def test_reads_and_writes_are_routed_to_the_user_shard(client, shard):
+    user_id = register(client, name_on_shard(shard))
+
+    subs = add_subs(client, user_id, 3)
+    sub_id = subs[0]["id"]
+
+    assert {sub["id"] for sub in subs} == shard_sub_ids(shard, user_id)
+    assert not shard_sub_ids(1 - shard, user_id)
+    assert client.get(f"/subs/by-id/{sub_id}", params={"user_id": user_id}).json()["name"] == subs[0]["name"]
+    assert client.get("/subs/monthly-amount", params={"user_id": user_id}).json()["amount"] == 15.0
+    assert client.delete(f"/subs/by-id/{sub_id}", params={"user_id": user_id}).status_code == 200
+    assert shard_sub_ids(shard, user_id) == {sub["id"] for sub in subs[1:]}
+    assert client.delete("/delete-user/by-id", params={"user_id": user_id}).status_code == 200
+    assert user_id not in shard_user_ids(shard)
+    assert directory_shard(user_id) is None
+    assert client.get("/subs", params={"user_id": user_id}).status_code == 404
+
+
+@sharded
+def test_batch_and_admin_reads_fan_out_to_all_shards(client):
+    user_ids = [register(client, name_on_shard(shard)) for shard in (0, 1)]
+    for count, user_id in enumerate(user_ids, start=1):
+        add_subs(client, user_id, count)
+
+    amounts = client.post("/batch/subs/amount", json={"user_ids": [*user_ids, 0]}).json()
+    next_payments = client.post("/batch/subs/next-payment", json={"user_ids": user_ids}).json()
+    export = client.get("/admin/subs/export").text
+    due = client.get("/admin/subs/due", params={"days": 3}).text
+
+    assert [(item["user_id"], item.get("amount")) for item in amounts] == [(user_ids[0], 5.0), (user_ids[1], 10.0), (0, None)]
+    assert "detail" in amounts[2]
+    assert [item["user_id"] for item in next_payments if "sub" in item] == user_ids
+    for user_id in user_ids:
+        assert f'"user_id":{user_id},' in export.replace(" ", "")
+        assert f'"user_id":{user_id},' in due.replace(" ", "")
+
+
+@sharded
+def test_sub_ids_are_unique_across_shards(client):
+    user_ids = [register(client, name_on_shard(shard)) for shard in (0, 1, 0, 1)]
+
+    sub_ids = [sub["id"] for user_id in user_ids for sub in add_subs(client, user_id, 3)]
+    sub_ids.append(client.post("/subs", params={"user_id": user_ids[1]}, json={
+        "name": "single", "cost": 5, "next_payment_date": (date.today() + timedelta(days=1)).isoformat()
+    }).json()["id"])
+
+    # ids come from the directory sequence, not from the shards
+    assert len(set(sub_ids)) == len(sub_ids)
+    assert not shard_sub_ids(0) & shard_sub_ids(1)
+
+
+@sharded
+def test_move_user_keeps_sub_ids(client):
+    from src.shards import move_user
+
+    user_id = register(client, name_on_shard(0))
+    subs = add_subs(client, user_id, 3)
+    other_id = register(client, name_on_shard(1))
+    add_subs(client, other_id, 5)
+    etag = client.get("/subs", params={"user_id": user_id}).headers["ETag"]
+
+    move_user(user_id, 1)
+
+    assert directory_shard(user_id) == 1
+    assert user_id not in shard_user_ids(0)
+    assert not shard_sub_ids(0, user_id)
+    moved = client.get("/subs", params={"user_id": user_id}, headers={"If-None-Match": etag})
+    # same ids and data, the ETag stays valid
+    assert moved.status_code == 304
+    assert client.get("/subs", params={"user_id": user_id}).json() == subs
+    assert shard_sub_ids(1, user_id) == {sub["id"] for sub in subs}
+    assert client.get("/subs/monthly-amount", params={"user_id": user_id}).json()["amount"] == 15.0
+    # the other user on the target shard is untouched
+    assert len(client.get("/subs", params={"user_id": other_id}).json()) == 5
+
+
+@sharded
+def test_move_user_rejects_sub_id_taken_on_target(client):
+    from src import exceptions
+    from src.shards import move_user
+
+    user_id = register(client, name_on_shard(0))
+    sub_id = add_subs(client, user_id, 1)[0]["id"]
+    other_id = register(client, name_on_shard(1))
+    # a sub created with a per-shard id before the global sequence existed
+    db = ShardSessionLocals[1]()
+    try:
+        db.execute(insert(SubModel).values(
+            id=sub_id, name="legacy", cost=5, monthly_cost=5, next_payment_date=date.today(), user_id=other_id
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+    with pytest.raises(exceptions.SubIdIsOnShardException):
+        move_user(user_id, 1)
+
+    assert directory_shard(user_id) == 0
+    assert shard_sub_ids(0, user_id) == {sub_id}
+    assert user_id not in shard_user_ids(1)
+
+
+@sharded
+def test_router_forget_drops_cached_shard():
+    user_id = max(shard_user_ids(0) | shard_user_ids(1))
+    shard = shard_router.get_user_shard(user_id)
+
+    shard_router.forget(user_id)
+
+    assert user_id not in shard_router._user_shards
+    assert shard_router.get_user_shard(user_id) == shard
@@ -0,0 +1,107 @@
+#tests/test_sql_budgets.py
+"""
+SQL statement budget of every endpoint on the happy path, counted with a before_cursor_execute listener
+
+The identity cache is cleared before each request (worst case), the response cache is off (CACHE_BACKEND=none).
+Raise a budget only on purpose, the failure message lists the statements that ran
+"""
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Iterator, List
+
+import pytest
+from sqlalchemy import event
+
+from src.db import SHARDED, async_engine, engine
+from src.identity import identity_cache
+from tests.conftest import make_username
+
+
+# budgets of a single database, with shards the directory lookups come on top
+pytestmark = pytest.mark.skipif(SHARDED, reason="SQL budgets are counted without DATABASE_SHARD_URLS")
+# with USE_ASYNC_DB=1 requests run on the async engine, fixtures and jobs on the sync one
+ENGINES = [engine] if async_engine is None else [engine, async_engine.sync_engine]
+
+
+@contextmanager
+def count_statements() -> Iterator[List[str]]:
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(" ".join(statement.split()))
+
+    identity_cache.clear()
+    for counted_engine in ENGINES:
+        event.listen(counted_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for counted_engine in ENGINES:
+            event.remove(counted_engine, "before_cursor_execute", before_cursor_execute)
+
+
+def new_sub_body(name: str) -> dict:
+    return {"name": name, "cost": 9.99, "next_payment_date": (date.today() + timedelta(days=2)).isoformat()}
+
+
+@pytest.fixture
+def user(client) -> dict:
+    """A registered user with 3 subscriptions: {"id", "name", "sub_id", "sub_name"}"""
+    name = make_username()
+    user_id = client.post("/register", json={"name": name}).json()["id"]
+    subs = [client.post("/subs", params={"user_id": user_id}, json=new_sub_body(f"sub-{index}")).json() for index in range(3)]
+    return {"id": user_id, "name": name, "sub_id": subs[0]["id"], "sub_name": subs[1]["name"]}
+
+
+# (method, path, request arguments built from the user fixture, max statements)
+ENDPOINT_BUDGETS = {
+    "register": ("POST", "/register", lambda user: {"json": {"name": make_username()}}, 2),
+    "create sub": ("POST", "/subs", lambda user: {"params": {"user_id": user["id"]}, "json": new_sub_body("new-sub")}, 3),
+    "create subs bulk": (
+        "POST", "/subs/bulk",
+        lambda user: {"params": {"user_id": user["id"]}, "json": [new_sub_body(f"bulk-{index}") for index in range(5)]},
+        4
+    ),
+    "list subs": ("GET", "/subs", lambda user: {"params": {"user_id": user["id"]}}, 2),
+    "list subs page": ("GET", "/subs", lambda user: {"params": {"user_id": user["id"], "limit": 2}}, 2),
+    "list subs by category": ("GET", "/subs/by-category/OTHER", lambda user: {"params": {"user_id": user["id"]}}, 2),
+    "sub by id": ("GET", "/subs/by-id/{sub_id}", lambda user: {"params": {"user_id": user["id"]}}, 1),
+    "sub by name": ("GET", "/subs/by-name/{sub_name}", lambda user: {"params": {"user_id": user["id"]}}, 1),
+    "export subs": ("GET", "/subs/export", lambda user: {"params": {"user_id": user["id"]}}, 2),
+    "next payment": ("GET", "/subs/next-payment", lambda user: {"params": {"user_id": user["id"]}}, 2),
+    "upcoming payments": ("GET", "/subs/upcoming", lambda user: {"params": {"user_id": user["id"]}}, 1),
+    "monthly amount": ("GET", "/subs/monthly-amount", lambda user: {"params": {"user_id": user["id"]}}, 2),
+    "monthly amount by category": (
+        "GET", "/subs/monthly-amount", lambda user: {"params": {"user_id": user["id"], "by_category": True}}, 2
+    ),
+    "annual amount": ("GET", "/subs/annual-amount", lambda user: {"params": {"user_id": user["id"]}}, 2),
+    "amount": ("GET", "/subs/amount", lambda user: {"params": {"user_id": user["id"], "months": 3}}, 2),
+    "batch amounts": ("POST", "/batch/subs/amount", lambda user: {"json": {"user_ids": [user["id"], 0]}}, 2),
+    "batch next payments": ("POST", "/batch/subs/next-payment", lambda user: {"json": {"user_ids": [user["id"], 0]}}, 2),
+    "delete sub by id": ("DELETE", "/subs/by-id/{sub_id}", lambda user: {"params": {"user_id": user["id"]}}, 4),
+    "delete sub by name": ("DELETE", "/subs/by-name/{sub_name}", lambda user: {"params": {"user_id": user["id"]}}, 4),
+    "delete all subs": ("DELETE", "/subs", lambda user: {"params": {"user_id": user["id"]}}, 3),
+    "delete user by id": ("DELETE", "/delete-user/by-id", lambda user: {"params": {"user_id": user["id"]}}, 1),
+    "delete user by name": ("DELETE", "/delete-user/by-name", lambda user: {"params": {"name": user["name"]}}, 2),
+}
+
+
+@pytest.mark.parametrize("name", ENDPOINT_BUDGETS)
+def test_endpoint_sql_budget(client, user, name):
+    method, path, make_arguments, budget = ENDPOINT_BUDGETS[name]
+
+    with count_statements() as statements:
+        response = client.request(method, path.format(**user), **make_arguments(user))
+
+    assert response.status_code == 200, response.text
+    assert len(statements) <= budget, "\n".join(statements)
+
+
+def test_not_modified_costs_one_statement(client, user):
+    etag = client.get("/subs", params={"user_id": user["id"]}).headers["ETag"]
+
+    with count_statements() as statements:
+        response = client.get("/subs", params={"user_id": user["id"]}, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert len(statements) <= 1, "\n".join(statements)
@@ -0,0 +1,27 @@
+#tests/test_tracing.py
+"""
+The Server-Timing header of RequestStatsMiddleware reports the statements that the request ran
+"""
+import re
+
+import pytest
+
+from src.db import SHARDED
+from tests.conftest import make_username
+from tests.test_sql_budgets import count_statements
+
+
+# count_statements listens to the primary engine only, with shards the request also runs on a shard
+pytestmark = pytest.mark.skipif(SHARDED, reason="statements are counted without DATABASE_SHARD_URLS")
+
+
+def test_server_timing_counts_request_statements(client):
+    user_id = client.post("/register", json={"name": make_username()}).json()["id"]
+
+    with count_statements() as statements:
+        response = client.get("/subs", params={"user_id": user_id})
+
+    assert response.status_code == 200
+    match = re.search(r'db;dur=[0-9.]+;desc="(\d+) statements", app;dur=[0-9.]+', response.headers["server-timing"])
+    assert match, response.headers["server-timing"]
+    assert int(match.group(1)) == len(statements)